@@ -160,8 +160,81 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
+    # Token buckets per client IP on writes to viewsets with a rate_limit_scope (see RATE_LIMITS)
+    'DEFAULT_THROTTLE_CLASSES': [
+        'packing_lists.ratelimit.WriteRateThrottle',
+    ],
+    # Reverse proxies in front of the app. The client IP is read that many
+    # entries from the end of X-Forwarded-For; with 0 the header is ignored
+    # and REMOTE_ADDR is used. Rate limits and vote dedup key on this IP, so
+    # never set it higher than the real proxy chain (clients can spoof XFF).
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+}
+
+# Write rate limits per client IP (packing_lists.ratelimit), shared by the API
+# and the HTML forms. RATE is the sustained refill rate, BURST the bucket size.
+RATE_LIMITS = {
+    'ENABLED': os.getenv('RATE_LIMITS_ENABLED', 'True') == 'True',
+    'votes': {
+        'RATE': os.getenv('RATE_LIMIT_VOTES', '60/min'),
+        'BURST': int(os.getenv('RATE_LIMIT_VOTES_BURST', '30')),
+    },
+    'prices': {
+        'RATE': os.getenv('RATE_LIMIT_PRICES', '30/min'),
+        'BURST': int(os.getenv('RATE_LIMIT_PRICES_BURST', '15')),
+    },
+    'stores': {
+        'RATE': os.getenv('RATE_LIMIT_STORES', '20/min'),
+        'BURST': int(os.getenv('RATE_LIMIT_STORES_BURST', '10')),
+    },
+}
+
+# Cache - local memory by default. Point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'community-packing-list'),
+    }
 }
 
+# Seconds a built packing list detail stays cached (entries are keyed by list version)
+PACKING_LIST_CACHE_TIMEOUT = int(os.getenv('PACKING_LIST_CACHE_TIMEOUT', '300'))
+
+# Price ranking (packing_lists.ranking) - shared by the HTML pages and the API
+PRICE_RANKING = {
+    'PRICE_WEIGHT': float(os.getenv('PRICE_RANKING_PRICE_WEIGHT', '0.7')),
+    'VOTE_WEIGHT': float(os.getenv('PRICE_RANKING_VOTE_WEIGHT', '0.3')),
+    'BASE_PRICE': float(os.getenv('PRICE_RANKING_BASE_PRICE', '50.0')),  # Normalization price per unit
+    # Votes lose half their weight every VOTE_HALF_LIFE_DAYS (at least 30); run reconcile_vote_counts after changing it
+    'VOTE_HALF_LIFE_DAYS': float(os.getenv('PRICE_RANKING_VOTE_HALF_LIFE_DAYS', '180')),
+}
+
+# Write-behind vote buffer (packing_lists.votes). Off by default; when on, votes
+# are queued in memory per process and bulk-written every MAX_SIZE votes or
+# MAX_AGE seconds, and on clean shutdown.
+VOTE_BUFFER = {
+    'ENABLED': os.getenv('VOTE_BUFFER_ENABLED', 'False') == 'True',
+    'MAX_SIZE': int(os.getenv('VOTE_BUFFER_MAX_SIZE', '200')),
+    'MAX_AGE': float(os.getenv('VOTE_BUFFER_MAX_AGE', '2.0')),
+    # Flushes a vote may fail (after its batch is retried vote by vote) before it is dropped
+    'MAX_ATTEMPTS': int(os.getenv('VOTE_BUFFER_MAX_ATTEMPTS', '3')),
+}
+
+# Parsed upload cache (packing_lists.parse_cache): items parsed from each
+# uploaded file are kept by the file's SHA-256, least recently used evicted first.
+PARSE_CACHE = {
+    'ENABLED': os.getenv('PARSE_CACHE_ENABLED', 'True') == 'True',
+    'MAX_ENTRIES': int(os.getenv('PARSE_CACHE_MAX_ENTRIES', '500')),
+}
+
+# Hash uploads as they stream in (for the parse cache), then Django's defaults
+FILE_UPLOAD_HANDLERS = [
+    'packing_lists.parse_cache.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 # CORS Settings - Allow React frontend to access Django API
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",  # Vite dev server
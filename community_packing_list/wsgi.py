@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "community_packing_list.settings")
 
 application = get_wsgi_application()
+
+# Build the nearest-store index while the worker starts rather than on its first request
+from packing_lists.spatial_index import warm_store_index  # noqa: E402
+
+warm_store_index()
@@ -25,3 +25,16 @@ export function useVotePrice() {
     },
   });
 }
+
+export function useVoteBatch() {
+  const queryClient = useQueryClient();
+
+  // Flushes queued votes (e.g. cast while offline) in a single request
+  return useMutation({
+    mutationFn: (votes: Array<{ priceId: number; isUpvote: boolean }>) =>
+      pricesApi.voteBatch(votes.map(({ priceId, isUpvote }) => ({ price_id: priceId, is_upvote: isUpvote }))),
+    onSuccess: () => {
+      queryClient.invalidateQueries({ queryKey: ['packing-list'] });
+    },
+  });
+}
@@ -3,8 +3,11 @@ import type {
   PackingList,
   PackingListDetailResponse,
   Store,
+  NearestStoresResponse,
+  BasketPlanResponse,
   Price,
   PackingListItem,
+  VoteBatchResponse,
 } from '@/types';
 
 const API_BASE = import.meta.env.VITE_API_URL || 'http://localhost:8000/api';
@@ -28,6 +31,10 @@ export const packingListsApi = {
   }),
   togglePacked: (listId: number, itemId: number) =>
     api.post(`/packing-lists/${listId}/toggle_packed/`, { toggle_packed_item_id: itemId }),
+  basket: (listId: number, params: { lat: number; lon: number; radius: number; max_stores?: number; online?: boolean }) =>
+    api.get<BasketPlanResponse>(`/packing-lists/${listId}/basket/`, {
+      params: { ...params, online: params.online ? 1 : undefined },
+    }),
 };
 
 // Items
@@ -49,12 +56,18 @@ export const pricesApi = {
       price_id: priceId,
       [isUpvote ? 'upvote_price_id' : 'downvote_price_id']: priceId,
     }),
+  voteBatch: (votes: Array<{ price_id: number; is_upvote: boolean }>) =>
+    api.post<VoteBatchResponse>('/votes/batch/', votes),
 };
 
 // Stores
 export const storesApi = {
   list: () => api.get<Store[]>('/stores/'),
   get: (id: number) => api.get<Store>(`/stores/${id}/`),
+  nearest: (params: { lat: number; lon: number; k?: number; radius?: number }) =>
+    api.get<NearestStoresResponse>('/stores/nearest/', { params }),
+  nearby: (params: { lat: number; lon: number; radius: number; limit?: number }) =>
+    api.get<NearestStoresResponse>('/stores/nearby/', { params }),
   create: (data: Partial<Store>) => api.post<Store>('/stores/', data),
   update: (id: number, data: Partial<Store>) => api.put<Store>(`/stores/${id}/`, data),
   delete: (id: number) => api.delete(`/stores/${id}/`),
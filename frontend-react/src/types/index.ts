@@ -69,6 +69,8 @@ export interface Price {
   price: string; // Decimal as string
   quantity: number;
   date_purchased?: string;
+  upvotes: number;
+  downvotes: number;
 }
 
 export interface Vote {
@@ -79,12 +81,53 @@ export interface Vote {
   created_at: string;
 }
 
+export interface NearestStoresResponse {
+  results: Array<Store & { distance_km: number }>;
+}
+
+export interface BasketPlanResponse {
+  stores: Array<{
+    store: Store;
+    distance_km: number | null;
+    packing_list_item_ids: number[];
+    subtotal: number;
+  }>;
+  assignments: Array<{
+    packing_list_item_id: number;
+    item_id: number;
+    item_name: string;
+    quantity: number;
+    store_id: number;
+    price_id: number;
+    cost: number;
+  }>;
+  unavailable: Array<{
+    packing_list_item_id: number;
+    item_id: number;
+    item_name: string;
+  }>;
+  total_cost: number;
+  method: 'exact' | 'greedy';
+  optimal: boolean;
+}
+
+export interface VoteBatchResponse {
+  recorded: number;
+  prices: Array<{
+    price_id: number;
+    upvotes: number;
+    downvotes: number;
+    vote_confidence: number;
+  }>;
+}
+
 export interface PriceWithVotes {
   price: Price;
   upvotes: number;
   downvotes: number;
   vote_confidence: number;
   price_per_unit: number;
+  smart_score: number;
 }
 
 export interface PackingListDetailResponse {
@@ -93,5 +136,15 @@ export interface PackingListDetailResponse {
     pli: PackingListItem;
     item: Item;
     prices_with_votes: PriceWithVotes[];
+    more_count: number;
+  }>;
+  next_cursor?: string | null;
+}
+
+export interface PackingListSectionsResponse {
+  sections: Array<{
+    section: string;
+    item_count: number;
+    cursor: string;
   }>;
 }
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import School, Store, PackingList, Item, PackingListItem, Price, Vote
+from .models import School, Store, PackingList, Item, PackingListItem, Price, Vote, ItemPriceStats, VoteDailyRollup, ParsedUpload
 
 @admin.register(School)
 class SchoolAdmin(admin.ModelAdmin):
@@ -66,12 +66,31 @@ class PackingListItemAdmin(admin.ModelAdmin):
     autocomplete_fields = ['item', 'packing_list']
 
 
+class VoteDailyRollupInline(admin.TabularInline):
+    # Archived votes; recent ones are still individual Vote rows
+    model = VoteDailyRollup
+    fields = ('day', 'upvotes', 'downvotes')
+    readonly_fields = ('day', 'upvotes', 'downvotes')
+    extra = 0
+    can_delete = False
+    max_num = 0
+
+
 @admin.register(Price)
 class PriceAdmin(admin.ModelAdmin):
-    list_display = ('item', 'store', 'price', 'quantity', 'date_purchased')
+    list_display = ('item', 'store', 'price', 'quantity', 'date_purchased', 'upvotes', 'downvotes')
     list_filter = ('store', 'date_purchased', 'item')
+    readonly_fields = ('upvotes', 'downvotes')
     search_fields = ('item__name', 'store__name')
     autocomplete_fields = ['item', 'store']
+    inlines = [VoteDailyRollupInline]
+
+
+@admin.register(ItemPriceStats)
+class ItemPriceStatsAdmin(admin.ModelAdmin):
+    list_display = ('item', 'price_count', 'min_price', 'p25_price', 'median_price', 'p75_price', 'updated_at')
+    search_fields = ('item__name',)
+    readonly_fields = ('item', 'price_count', 'min_price', 'p25_price', 'median_price', 'p75_price', 'updated_at')
 
 
 @admin.register(Vote)
@@ -84,6 +103,28 @@ class VoteAdmin(admin.ModelAdmin):
         return str(obj.price)
     price_display.short_description = "Price"
 
+    def delete_queryset(self, request, queryset):
+        # Delete one by one so Vote.delete() keeps the Price counters in step
+        for vote in queryset:
+            vote.delete()
+
+
+@admin.register(VoteDailyRollup)
+class VoteDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('price', 'day', 'upvotes', 'downvotes')
+    list_filter = ('day',)
+    search_fields = ('price__item__name', 'price__store__name')
+    readonly_fields = ('price', 'day', 'upvotes', 'downvotes')
+    date_hierarchy = 'day'
+
+
+@admin.register(ParsedUpload)
+class ParsedUploadAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'parser', 'hits', 'created_at', 'last_used_at')
+    list_filter = ('parser',)
+    search_fields = ('content_hash',)
+    readonly_fields = ('content_hash', 'parser', 'items', 'hits', 'created_at', 'last_used_at')
+
 # If you prefer not to use decorators, you can use admin.site.register:
 # admin.site.register(School, SchoolAdmin)
 # admin.site.register(Store, StoreAdmin)
@@ -1,15 +1,77 @@
-from rest_framework import viewsets, status
+import base64
+import binascii
+import hashlib
+import json
+import math
+
+from rest_framework import renderers, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from django.db.models import Count, Q, F
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from decimal import Decimal
 
+from .basket import DEFAULT_MAX_STORES, MAX_STORES_LIMIT, plan_basket
+from .geo import stores_nearby
 from .models import School, Base, Store, PackingList, Item, PackingListItem, Price, Vote
 from .serializers import (
     SchoolSerializer, BaseSerializer, StoreSerializer, PackingListSerializer,
     ItemSerializer, PackingListItemSerializer, PriceSerializer, VoteSerializer,
-    PackingListDetailSerializer
+    PackingListDetailSerializer, BatchVoteSerializer
+)
+from .pricing import (
+    ranked_prices_by_item, more_count, cached_items_with_prices, iter_items_with_prices,
+    page_items_with_prices, section_index,
 )
+from .ranking import ranking_key
+from .ratelimit import client_ident
+from .spatial_index import nearest_store_objects
+from .votes import PendingVote, UnknownPricesError, price_vote_aggregates, record_votes, submit_vote
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+DEFAULT_DETAIL_PAGE_SIZE = 50
+MAX_VOTE_BATCH = 200
+DEFAULT_NEAREST_STORES = 10
+MAX_NEAREST_STORES = 200
+MAX_DETAIL_PAGE_SIZE = 500
+
+
+def encode_section_cursor(section_key, item_name):
+    """Opaque cursor pointing just after (section, item name)"""
+    raw = json.dumps([section_key, item_name], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_section_cursor(cursor):
+    """Inverse of encode_section_cursor(); raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('invalid cursor')
+    if not (isinstance(position, list) and len(position) == 2 and all(isinstance(v, str) for v in position)):
+        raise ValueError('invalid cursor')
+    return tuple(position)
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Newline-delimited JSON. Lets clients ask for streamed detail views with
+    Accept: application/x-ndjson; regular responses (errors) render as a
+    single line.
+    """
+    media_type = NDJSON_CONTENT_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(data, cls=JSONEncoder) + '\n').encode(self.charset)
 
 
 class SchoolViewSet(viewsets.ModelViewSet):
@@ -22,54 +84,192 @@ class BaseViewSet(viewsets.ModelViewSet):
     serializer_class = BaseSerializer
 
 
+def location_query(params, radius_required=False):
+    """
+    (lat, lon, radius km) from ?lat=&lon=&radius=; radius is None when
+    optional and absent. Raises ValueError on missing or bad input.
+    """
+    try:
+        lat = float(params['lat'])
+        lon = float(params['lon'])
+        radius = params['radius'] if radius_required else params.get('radius')
+        radius = float(radius) if radius is not None else None
+    except KeyError:
+        raise ValueError('missing parameter')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('coordinates out of range')
+    if radius is not None and not (radius > 0 and math.isfinite(radius)):
+        raise ValueError('radius must be positive')
+    return lat, lon, radius
+
+
+def bounded_int(params, name, default, maximum):
+    """Integer ?name= between 1 and `maximum`; raises ValueError otherwise"""
+    value = int(params.get(name, default))
+    if not 1 <= value <= maximum:
+        raise ValueError(f'{name} out of range')
+    return value
+
+
 class StoreViewSet(viewsets.ModelViewSet):
     queryset = Store.objects.all()
     serializer_class = StoreSerializer
+    rate_limit_scope = 'stores'
+
+    @action(detail=False, methods=['get'])
+    def nearest(self, request):
+        """
+        Stores nearest to ?lat=&lon=, answered from the in-process spatial
+        index: the ?k= nearest (default 10, at most MAX_NEAREST_STORES),
+        limited to ?radius= km when given. Each store carries `distance_km`.
+        """
+        try:
+            lat, lon, radius = location_query(request.query_params)
+            k = bounded_int(request.query_params, 'k', DEFAULT_NEAREST_STORES, MAX_NEAREST_STORES)
+        except ValueError:
+            return Response(
+                {'error': f'lat and lon are required; k must be 1-{MAX_NEAREST_STORES} and radius positive'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        stores = nearest_store_objects(lat, lon, k=k, radius_km=radius)
+        return Response({
+            'results': [{**StoreSerializer(store).data, 'distance_km': store.distance} for store in stores],
+        })
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Stores within ?radius= km of ?lat=&lon=, nearest first, found in the
+        database through geohash prefix ranges (see geo.geohash_q). At most
+        ?limit= stores (default 10, at most MAX_NEAREST_STORES), each with
+        `distance_km`.
+        """
+        try:
+            lat, lon, radius = location_query(request.query_params, radius_required=True)
+            limit = bounded_int(request.query_params, 'limit', DEFAULT_NEAREST_STORES, MAX_NEAREST_STORES)
+        except ValueError:
+            return Response(
+                {'error': f'lat, lon and a positive radius are required; limit must be 1-{MAX_NEAREST_STORES}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        stores = stores_nearby(Store.objects.all(), lat, lon, radius, limit=limit)
+        return Response({
+            'results': [{**StoreSerializer(store).data, 'distance_km': store.distance} for store in stores],
+        })
 
 
 class PackingListViewSet(viewsets.ModelViewSet):
     queryset = PackingList.objects.all().select_related('school', 'base')
     serializer_class = PackingListSerializer
 
-    @action(detail=True, methods=['get'])
+    def _etag(self, request, versions):
+        """
+        Strong ETag over list (id, version) pairs, the exact request URL, the
+        negotiated renderer, so JSON and NDJSON bodies never share a tag, and
+        the ranking day, as rankings drift with vote age alone
+        """
+        digest = hashlib.sha1(request.get_full_path().encode())
+        digest.update(f":{request.accepted_renderer.format}:{ranking_key()}".encode())
+        for list_id, version in versions:
+            digest.update(f":{list_id}-{version}".encode())
+        return f'"{digest.hexdigest()}"'
+
+    def _list_etag(self, request, pk):
+        """ETag for one list from a single narrow query, or None if it doesn't exist"""
+        if not str(pk).isdigit():
+            return None
+        version = PackingList.objects.filter(pk=pk).values_list('version', flat=True).first()
+        if version is None:
+            return None
+        return self._etag(request, [(pk, version)])
+
+    def _conditional(self, request, etag, respond):
+        """Answer If-None-Match with 304, otherwise tag the response built by respond()"""
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                patch_vary_headers(not_modified, ['Accept'])
+                return not_modified
+        response = respond()
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            patch_cache_control(response, no_cache=True)
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        versions = self.filter_queryset(self.get_queryset()).order_by('id').values_list('id', 'version')
+        etag = self._etag(request, versions)
+        return self._conditional(request, etag, lambda: super(PackingListViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self._list_etag(request, kwargs.get(self.lookup_field))
+        return self._conditional(request, etag, lambda: super(PackingListViewSet, self).retrieve(request, *args, **kwargs))
+
+    @action(detail=True, methods=['get'], renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer])
     def detail_view(self, request, pk=None):
-        """Get detailed packing list with all items and prices"""
+        """
+        Get detailed packing list with all items and prices.
+
+        ?max_prices=K returns only each item's K best prices (ranked in the
+        database); `more_count` on every item tells how many were left out.
+        Responses carry an ETag; a matching If-None-Match gets a 304 after a
+        single version lookup.
+
+        ?stream=1 (or Accept: application/x-ndjson) streams the list as
+        newline-delimited JSON instead, see _stream_detail(). ?page_size=N
+        and/or ?cursor= page through it instead, see _detail_page().
+        """
+        etag = self._list_etag(request, pk)
+        return self._conditional(request, etag, lambda: self._detail_response(request))
+
+    def _detail_response(self, request):
         packing_list = self.get_object()
 
-        # Get all items for this packing list
-        packing_list_items = PackingListItem.objects.filter(
-            packing_list=packing_list
-        ).select_related('item').prefetch_related('item__prices__store', 'item__prices__votes')
-
-        items_with_prices = []
-        for pli in packing_list_items:
-            # Get all prices for this item
-            prices = Price.objects.filter(item=pli.item).select_related('store').prefetch_related('votes')
-
-            prices_with_votes = []
-            for price in prices:
-                upvotes = price.votes.filter(is_correct_price=True).count()
-                downvotes = price.votes.filter(is_correct_price=False).count()
-                total_votes = upvotes + downvotes
-                vote_confidence = (upvotes - downvotes) / max(total_votes, 1)
-                price_per_unit = float(price.price) / price.quantity if price.quantity > 0 else 0
-
-                prices_with_votes.append({
-                    'price': PriceSerializer(price).data,
-                    'upvotes': upvotes,
-                    'downvotes': downvotes,
-                    'vote_confidence': vote_confidence,
-                    'price_per_unit': price_per_unit,
-                })
-
-            # Sort by vote confidence then price per unit
-            prices_with_votes.sort(key=lambda x: (-x['vote_confidence'], x['price_per_unit']))
-
-            items_with_prices.append({
-                'pli': PackingListItemSerializer(pli).data,
-                'item': ItemSerializer(pli.item).data,
-                'prices_with_votes': prices_with_votes,
-            })
+        max_prices = request.query_params.get('max_prices')
+        if max_prices is not None:
+            try:
+                max_prices = int(max_prices)
+                if max_prices < 1:
+                    raise ValueError
+            except ValueError:
+                return Response(
+                    {'error': 'max_prices must be a positive integer'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        if self._wants_stream(request):
+            response = StreamingHttpResponse(
+                self._stream_detail(packing_list, max_prices),
+                content_type=NDJSON_CONTENT_TYPE,
+            )
+            response['X-Accel-Buffering'] = 'no'  # Let nginx pass lines through as they come
+            return response
+
+        if 'cursor' in request.query_params or 'page_size' in request.query_params:
+            return self._detail_page(request, packing_list, max_prices)
+
+        def build_items_with_prices():
+            # Get all items for this packing list
+            packing_list_items = PackingListItem.objects.filter(
+                packing_list=packing_list
+            ).select_related('item')
+
+            # Ranked prices for every item on the list, from one query
+            ranked_prices = ranked_prices_by_item(packing_list, max_prices=max_prices)
+
+            return [
+                self._item_payload(pli, ranked_prices.get(pli.item_id, []))
+                for pli in packing_list_items
+            ]
+
+        # Serialized payload is cached per list version (and max_prices cut)
+        items_with_prices = cached_items_with_prices(
+            packing_list, f"api:max_prices={max_prices}", build_items_with_prices
+        )
 
         response_data = {
             'packing_list': PackingListSerializer(packing_list).data,
@@ -78,6 +278,173 @@ class PackingListViewSet(viewsets.ModelViewSet):
 
         return Response(response_data)
 
+    def _detail_page(self, request, packing_list, max_prices):
+        """
+        One page of the detail payload in (section, item name) order.
+        ?page_size=N sets the page length; ?cursor= takes the `next_cursor`
+        of the previous page (or a section's `cursor` from the sections
+        action to jump straight to it). `next_cursor` is null on the last page.
+        """
+        try:
+            page_size = int(request.query_params.get('page_size', DEFAULT_DETAIL_PAGE_SIZE))
+            if not 1 <= page_size <= MAX_DETAIL_PAGE_SIZE:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {'error': f'page_size must be an integer between 1 and {MAX_DETAIL_PAGE_SIZE}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        cursor = request.query_params.get('cursor') or None
+        after = None
+        if cursor is not None:
+            try:
+                after = decode_section_cursor(cursor)
+            except ValueError:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def build_page():
+            pairs, has_more = page_items_with_prices(
+                packing_list, after=after, limit=page_size, max_prices=max_prices
+            )
+            next_cursor = None
+            if has_more:
+                last = pairs[-1][0]
+                next_cursor = encode_section_cursor(last.section_key, last.item.name)
+            return {
+                'items_with_prices': [self._item_payload(pli, rows) for pli, rows in pairs],
+                'next_cursor': next_cursor,
+            }
+
+        page = cached_items_with_prices(
+            packing_list, f"api:page:{cursor}:{page_size}:max_prices={max_prices}", build_page
+        )
+        return Response({
+            'packing_list': PackingListSerializer(packing_list).data,
+            **page,
+        })
+
+    @action(detail=True, methods=['get'])
+    def sections(self, request, pk=None):
+        """
+        Section index: each section's name, item count and a cursor that
+        starts a detail_view page at its first item. Costs one grouped
+        COUNT query, so clients can lay out a long list before paging in items.
+        """
+        etag = self._list_etag(request, pk)
+        return self._conditional(request, etag, lambda: self._sections_response())
+
+    def _sections_response(self):
+        packing_list = self.get_object()
+        return Response({
+            'sections': [
+                {
+                    'section': section_key,
+                    'item_count': item_count,
+                    'cursor': encode_section_cursor(section_key, ''),
+                }
+                for section_key, item_count in section_index(packing_list)
+            ],
+        })
+
+    def _item_payload(self, pli, rows):
+        return {
+            'pli': PackingListItemSerializer(pli).data,
+            'item': ItemSerializer(pli.item).data,
+            'prices_with_votes': [
+                {**row, 'price': PriceSerializer(row['price']).data}
+                for row in rows
+            ],
+            'more_count': more_count(rows),
+        }
+
+    def _wants_stream(self, request):
+        if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return True
+        return request.accepted_renderer.format == NDJSONRenderer.format
+
+    def _stream_detail(self, packing_list, max_prices):
+        """
+        Yields the detail payload as NDJSON, one object per line:
+        {"type": "packing_list", "data": {...}} first, then for every section
+        {"type": "section", "name": "..."} followed by its
+        {"type": "item", "data": {pli, item, prices_with_votes, more_count}}
+        lines, and finally {"type": "end", "item_count": N}. Items are read
+        in chunks from a server-side cursor, so memory stays flat however
+        long the list is.
+        """
+        def line(payload):
+            return json.dumps(payload, cls=JSONEncoder) + '\n'
+
+        yield line({'type': 'packing_list', 'data': PackingListSerializer(packing_list).data})
+
+        section = None
+        count = 0
+        for pli, rows in iter_items_with_prices(packing_list, max_prices=max_prices):
+            if pli.section_key != section or count == 0:
+                section = pli.section_key
+                yield line({'type': 'section', 'name': section})
+            count += 1
+            yield line({'type': 'item', 'data': self._item_payload(pli, rows)})
+
+        yield line({'type': 'end', 'item_count': count})
+
+    @action(detail=True, methods=['get'])
+    def basket(self, request, pk=None):
+        """
+        Where to buy the list's unpacked items: at most ?max_stores= stores
+        (default 3) within ?radius= km of ?lat=&lon=, plus online stores with
+        ?online=1, chosen to cover as many items as possible at the lowest
+        total (see packing_lists.basket). `method` says whether the plan was
+        proven optimal by enumeration or found greedily within the time budget.
+        """
+        packing_list = self.get_object()
+        try:
+            lat, lon, radius = location_query(request.query_params, radius_required=True)
+            max_stores = bounded_int(request.query_params, 'max_stores', DEFAULT_MAX_STORES, MAX_STORES_LIMIT)
+        except ValueError:
+            return Response(
+                {'error': f'lat, lon and a positive radius are required; max_stores must be 1-{MAX_STORES_LIMIT}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        include_online = request.query_params.get('online', '').lower() in ('1', 'true', 'yes')
+
+        plan = plan_basket(packing_list, lat, lon, radius, max_stores=max_stores, include_online=include_online)
+        return Response({
+            'stores': [
+                {
+                    'store': StoreSerializer(store).data,
+                    'distance_km': store.distance,
+                    'packing_list_item_ids': [pli.id for pli in store.items],
+                    'subtotal': round(store.subtotal, 2),
+                }
+                for store in plan['stores']
+            ],
+            'assignments': [
+                {
+                    'packing_list_item_id': entry['packing_list_item'].id,
+                    'item_id': entry['packing_list_item'].item_id,
+                    'item_name': entry['packing_list_item'].item.name,
+                    'quantity': entry['packing_list_item'].quantity,
+                    'store_id': entry['store'].id,
+                    'price_id': entry['price_id'],
+                    'cost': round(entry['cost'], 2),
+                }
+                for entry in plan['assignments']
+            ],
+            'unavailable': [
+                {
+                    'packing_list_item_id': entry['packing_list_item'].id,
+                    'item_id': entry['packing_list_item'].item_id,
+                    'item_name': entry['packing_list_item'].item.name,
+                }
+                for entry in plan['unavailable']
+            ],
+            'total_cost': round(plan['total_cost'], 2),
+            'method': plan['method'],
+            'optimal': plan['optimal'],
+        })
+
     @action(detail=True, methods=['post'])
     def toggle_packed(self, request, pk=None):
         """Toggle packed status for an item"""
@@ -113,11 +480,21 @@ class PackingListItemViewSet(viewsets.ModelViewSet):
 class PriceViewSet(viewsets.ModelViewSet):
     queryset = Price.objects.all().select_related('item', 'store')
     serializer_class = PriceSerializer
+    rate_limit_scope = 'prices'
+
+    def get_queryset(self):
+        """Optionally filter by ?item=<id> (used to lazily load prices cut by max_prices)"""
+        queryset = super().get_queryset()
+        item_id = self.request.query_params.get('item')
+        if item_id and item_id.isdigit():
+            queryset = queryset.filter(item_id=item_id)
+        return queryset.order_by('id')
 
 
 class VoteViewSet(viewsets.ModelViewSet):
     queryset = Vote.objects.all()
     serializer_class = VoteSerializer
+    rate_limit_scope = 'votes'
 
     def create(self, request, *args, **kwargs):
         """Create a vote for a price"""
@@ -130,9 +507,7 @@ class VoteViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            price = Price.objects.get(id=price_id)
-        except Price.DoesNotExist:
+        if not str(price_id).isdigit():
             return Response(
                 {'error': 'Price not found'},
                 status=status.HTTP_404_NOT_FOUND
@@ -141,21 +516,66 @@ class VoteViewSet(viewsets.ModelViewSet):
         # Get IP address
         ip_address = self.get_client_ip(request)
 
-        # Create vote
-        vote = Vote.objects.create(
-            price=price,
-            is_correct_price=is_upvote,
-            ip_address=ip_address
-        )
+        # Create vote (or queue it when the vote buffer is enabled)
+        try:
+            vote = submit_vote(price_id, is_upvote, ip_address)
+        except Price.DoesNotExist:
+            return Response(
+                {'error': 'Price not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except ValueError:
+            return Response(
+                {'error': 'Invalid client address'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if vote is None:
+            return Response(
+                {'queued': True, 'price_id': int(price_id), 'is_correct_price': is_upvote},
+                status=status.HTTP_202_ACCEPTED
+            )
 
         serializer = self.get_serializer(vote)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Record many votes in one round trip, e.g. when an offline client
+        flushes its queue. Body: [{"price_id": 1, "is_upvote": true}, ...]
+        (or {"votes": [...]}), at most MAX_VOTE_BATCH entries.
+
+        All price ids are checked with one query and the votes are written in
+        one transaction: either every vote is recorded or, if any price is
+        unknown, none are (400 with `unknown_price_ids`). Votes replace this
+        IP's earlier votes on the same prices. Returns the updated vote
+        aggregates of every affected price.
+        """
+        entries = request.data.get('votes') if isinstance(request.data, dict) else request.data
+        serializer = BatchVoteSerializer(data=entries, many=True, allow_empty=False, max_length=MAX_VOTE_BATCH)
+        serializer.is_valid(raise_exception=True)
+
+        ip_address = self.get_client_ip(request)
+        now = timezone.now()
+        try:
+            record_votes(
+                [
+                    PendingVote(entry['price_id'], entry['is_upvote'], ip_address, now)
+                    for entry in serializer.validated_data
+                ],
+                strict=True,
+            )
+        except UnknownPricesError as e:
+            return Response(
+                {'error': 'Price not found', 'unknown_price_ids': e.price_ids},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'recorded': len(serializer.validated_data),
+            'prices': price_vote_aggregates({entry['price_id'] for entry in serializer.validated_data}),
+        })
+
     def get_client_ip(self, request):
-        """Get client IP address from request"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
+        """Client IP address, with the same proxy trust as the rate limits"""
+        return client_ident(request)
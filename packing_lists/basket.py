@@ -0,0 +1,227 @@
+"""
+Multi-store basket planning: which nearby stores to buy a packing list's
+unpacked items from.
+
+The inputs are reduced to a cost matrix with one row per item and one column
+per candidate store; a cell holds what buying the item's full quantity at
+that store costs (whole packs of the cheapest price there), or nothing. A
+plan is a set of at most `max_stores` columns; each item is bought where it
+is cheapest among them. Plans are compared first by how many items they
+cover, then by total cost (uncovered items carry a penalty larger than any
+possible total).
+
+choose_stores() first drops dominated stores (within half the time budget;
+stores it has no time to check are kept), then always runs a greedy
+set-cover pass (add the store that improves the plan most, then swap stores
+while that helps), which gives an answer in milliseconds. When the number of
+store combinations is at most EXACT_COMBINATION_LIMIT it then enumerates them
+all in vectorized chunks to prove the optimum, unless the deadline runs out
+first. plan_basket() only considers the MAX_CANDIDATE_STORES nearest stores
+that price at least one wanted item, which keeps the matrix small whatever
+the radius.
+"""
+import math
+import time
+from collections import defaultdict
+from itertools import combinations, islice
+
+import numpy as np
+from django.db.models import F
+
+from .geo import stores_nearby
+from .models import Price, Store
+
+DEFAULT_MAX_STORES = 3
+MAX_STORES_LIMIT = 10
+DEFAULT_TIME_BUDGET = 0.5  # seconds
+EXACT_COMBINATION_LIMIT = 20000
+COMBINATION_CHUNK = 2000
+MAX_CANDIDATE_STORES = 200
+
+
+def _penalized(costs):
+    """Costs with missing cells (inf) replaced by a penalty above any complete plan's total"""
+    finite = np.where(np.isfinite(costs), costs, 0.0)
+    penalty = finite.max(axis=1).sum() + 1.0
+    return np.where(np.isfinite(costs), costs, penalty)
+
+
+def _prune_columns(costs, deadline):
+    """
+    Indexes of the columns worth considering: those that price at least
+    one item and aren't dominated (as cheap or cheaper for every item) by
+    another column. The dominance check is quadratic in the columns; those
+    not reached by the deadline are kept unchecked.
+    """
+    columns = np.flatnonzero(np.isfinite(costs).any(axis=0))
+    costs = costs[:, columns]
+    kept = []
+    for position, column in enumerate(columns):
+        if time.monotonic() >= deadline:
+            kept.extend(int(column) for column in columns[position:])
+            break
+        own = costs[:, [position]]
+        # Ties between identical columns keep the first one
+        dominates = np.all(costs <= own, axis=0) & (np.any(costs < own, axis=0) | (np.arange(len(columns)) < position))
+        dominates[position] = False
+        if not dominates.any():
+            kept.append(int(column))
+    return kept
+
+
+def _greedy(costs, max_stores, deadline):
+    """Greedy set cover followed by single-store swaps; returns column indexes"""
+    n_items = costs.shape[0]
+    chosen = []
+    best = np.full(n_items, np.inf)
+    while len(chosen) < max_stores:
+        totals = np.minimum(best[:, None], costs).sum(axis=0)
+        totals[chosen] = np.inf
+        column = int(np.argmin(totals))
+        if not totals[column] < best.sum():
+            break
+        chosen.append(column)
+        best = np.minimum(best, costs[:, column])
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for position in range(len(chosen)):
+            others = chosen[:position] + chosen[position + 1:]
+            rest = costs[:, others].min(axis=1) if others else np.full(n_items, np.inf)
+            totals = np.minimum(rest[:, None], costs).sum(axis=0)
+            totals[others] = np.inf
+            column = int(np.argmin(totals))
+            if totals[column] < np.minimum(rest, costs[:, chosen[position]]).sum() - 1e-9:
+                chosen[position] = column
+                improved = True
+    return chosen
+
+
+def _exact(costs, size, deadline):
+    """
+    Best `size`-column subset by full enumeration, or None if the deadline
+    passes first.
+    """
+    best_total, best_combo = np.inf, None
+    combos = combinations(range(costs.shape[1]), size)
+    while True:
+        chunk = np.array(list(islice(combos, COMBINATION_CHUNK)), dtype=np.intp).reshape(-1, size)
+        if not len(chunk):
+            return list(best_combo)
+        totals = costs[:, chunk].min(axis=2).sum(axis=0)
+        index = int(np.argmin(totals))
+        if totals[index] < best_total:
+            best_total, best_combo = totals[index], chunk[index]
+        if time.monotonic() >= deadline:
+            return None
+
+
+def choose_stores(costs, max_stores, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Picks at most `max_stores` columns of the (items x stores) cost matrix
+    `costs` (np.inf where a store doesn't sell an item). Returns
+    (column indexes, method, optimal) where method is 'exact' or 'greedy'.
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    costs = np.asarray(costs, dtype=np.float64)
+    candidates = _prune_columns(costs, started + time_budget / 2)
+    if not candidates or max_stores < 1:
+        return [], 'exact', True
+    reduced = _penalized(costs[:, candidates])
+
+    chosen = _greedy(reduced, max_stores, deadline)
+    method, optimal = 'greedy', False
+    size = min(max_stores, len(candidates))
+    if math.comb(len(candidates), size) <= EXACT_COMBINATION_LIMIT:
+        exact = _exact(reduced, size, deadline)
+        if exact is not None:
+            chosen, method, optimal = exact, 'exact', True
+
+    # Drop stores no item ends up being bought from
+    used = set(np.argmin(reduced[:, chosen], axis=1).tolist())
+    chosen = [column for position, column in enumerate(chosen) if position in used]
+    return sorted(candidates[column] for column in chosen), method, optimal
+
+
+def _line_cost(price, pack_size, needed):
+    """Cost of `needed` units bought in whole packs of `pack_size`"""
+    return float(price) * math.ceil(needed / max(pack_size, 1))
+
+
+def plan_basket(packing_list, lat, lon, radius_km, max_stores=DEFAULT_MAX_STORES,
+                include_online=False, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Plans where to buy every unpacked item of `packing_list` among the
+    MAX_CANDIDATE_STORES nearest stores within `radius_km` of (lat, lon) that
+    price one of its items, plus as many online stores when
+    `include_online`. Prices voted wrong more than right are ignored.
+
+    Returns {'stores': [Store with `distance` (km or None), `items`,
+    `subtotal`], 'assignments': [...], 'unavailable': [...], 'total_cost',
+    'method', 'optimal'}; assignments and unavailable entries are dicts
+    keyed by PackingListItem.
+    """
+    wanted = list(packing_list.items.filter(packed=False).select_related('item').order_by('item__name', 'pk'))
+    item_ids = {pli.item_id for pli in wanted}
+    usable = Price.objects.filter(item__in=item_ids, decayed_downvotes__lte=F('decayed_upvotes'))
+    # Only the nearest stores with a usable price for something on the list
+    selling = Store.objects.filter(pk__in=usable.values('store_id'))
+    nearby = stores_nearby(selling, lat, lon, radius_km, limit=MAX_CANDIDATE_STORES)
+    stores = {store.pk: store for store in nearby}
+    if include_online:
+        online = selling.filter(is_online=True).exclude(pk__in=list(stores)).order_by('name')
+        for store in online[:MAX_CANDIDATE_STORES]:
+            store.distance = None
+            stores[store.pk] = store
+
+    prices = usable.filter(store__in=list(stores)).values_list('pk', 'item_id', 'store_id', 'price', 'quantity')
+    by_item = defaultdict(list)
+    for row in prices:
+        by_item[row[1]].append(row)
+
+    # Cheapest full-quantity cost of each list item at each store
+    store_ids = list(stores)
+    column_of = {store_id: column for column, store_id in enumerate(store_ids)}
+    costs = np.full((len(wanted), len(store_ids)), np.inf)
+    cheapest = {}
+    for row_index, pli in enumerate(wanted):
+        for price_id, _, store_id, price, pack_size in by_item[pli.item_id]:
+            cost = _line_cost(price, pack_size, pli.quantity)
+            column = column_of[store_id]
+            if cost < costs[row_index, column]:
+                costs[row_index, column] = cost
+                cheapest[row_index, column] = price_id
+
+    chosen, method, optimal = choose_stores(costs, max_stores, time_budget)
+
+    plan_stores = []
+    for column in chosen:
+        store = stores[store_ids[column]]
+        store.items, store.subtotal = [], 0.0
+        plan_stores.append(store)
+    assignments, unavailable = [], []
+    for row_index, pli in enumerate(wanted):
+        row = costs[row_index, chosen] if chosen else np.empty(0)
+        if not len(row) or not np.isfinite(row.min()):
+            unavailable.append({'packing_list_item': pli})
+            continue
+        position = int(np.argmin(row))
+        store, cost = plan_stores[position], float(row[position])
+        store.items.append(pli)
+        store.subtotal += cost
+        assignments.append({
+            'packing_list_item': pli,
+            'store': store,
+            'price_id': cheapest[row_index, chosen[position]],
+            'cost': cost,
+        })
+    return {
+        'stores': plan_stores,
+        'assignments': assignments,
+        'unavailable': unavailable,
+        'total_cost': sum(a['cost'] for a in assignments),
+        'method': method,
+        'optimal': optimal,
+    }
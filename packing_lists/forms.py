@@ -1,5 +1,6 @@
 from django import forms
 from .models import PackingList, School, Price, Store, Item, PackingListItem
+from .parsers import supported_extensions
 
 class PackingListForm(forms.ModelForm):
     """
@@ -50,7 +51,7 @@ class UploadFileForm(forms.Form):
 
         if file:
             # Basic file type validation by extension (can be improved with content type checking)
-            allowed_extensions = ['.csv', '.xls', '.xlsx', '.pdf']
+            allowed_extensions = supported_extensions()
             filename = file.name.lower()
             if not any(filename.endswith(ext) for ext in allowed_extensions):
                 raise forms.ValidationError(f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}")
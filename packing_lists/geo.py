@@ -0,0 +1,207 @@
+"""
+Great-circle distance helpers for store search.
+
+bounding_box_q() turns "within R km of a point" into plain latitude/longitude
+range filters that the (latitude, longitude) index can answer, and
+distance_expression() computes the exact haversine distance inside the
+database, so a radius query is: cheap indexed prefilter, exact distance on
+the few survivors, ORDER BY distance and LIMIT all in SQL. Both work on
+SQLite (Django registers the math functions) and PostgreSQL.
+
+Locations also carry a geohash: a base32 string naming a latitude/longitude
+cell, where every extra character subdivides the cell. Nearby points mostly
+share a prefix, so geohash_q() turns a radius search into a handful of range
+scans on the indexed geohash column (the cell holding the point plus its
+eight neighbours) with no spatial extension in the database.
+"""
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~5 m cells; searches use shorter prefixes
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometers"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box_q(lat, lon, radius_km, lat_field='latitude', lon_field='longitude'):
+    """
+    Q filter for the lat/lon rectangle enclosing the circle of `radius_km`
+    around (lat, lon). Every point within the radius passes; corners of the
+    rectangle also pass, so follow with an exact distance filter.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    q = Q(**{f'{lat_field}__gte': max(min_lat, -90.0), f'{lat_field}__lte': min(max_lat, 90.0)})
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return q  # The circle covers a pole: every longitude is in range
+
+    delta_lon = _longitude_span(lat, radius_km)
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if delta_lon >= 180.0:
+        return q
+    if min_lon < -180.0:
+        # Wraps past the antimeridian: two longitude ranges
+        return q & (Q(**{f'{lon_field}__gte': min_lon + 360.0}) | Q(**{f'{lon_field}__lte': max_lon}))
+    if max_lon > 180.0:
+        return q & (Q(**{f'{lon_field}__gte': min_lon}) | Q(**{f'{lon_field}__lte': max_lon - 360.0}))
+    return q & Q(**{f'{lon_field}__gte': min_lon, f'{lon_field}__lte': max_lon})
+
+
+def _longitude_span(lat, radius_km):
+    """Widest longitude half-span in degrees of the circle, at the latitude where it is tangent"""
+    return math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of (lat, lon) with `precision` characters"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate longitude, latitude, starting with longitude
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(height, width) in degrees of a geohash cell with `precision` characters"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_neighbors(lat, lon, precision):
+    """
+    Geohashes of the cell holding (lat, lon) and of its eight neighbours,
+    wrapping across the antimeridian. Rows beyond a pole are left out.
+    """
+    height, width = geohash_cell_size(precision)
+    # Centre of the cell holding the point, then step one cell each way
+    center_lat = (math.floor((lat + 90.0) / height) + 0.5) * height - 90.0
+    center_lon = (math.floor((lon + 180.0) / width) + 0.5) * width - 180.0
+    cells = set()
+    for d_lat in (-height, 0.0, height):
+        row = center_lat + d_lat
+        if not -90.0 < row < 90.0:
+            continue
+        for d_lon in (-width, 0.0, width):
+            column = (center_lon + d_lon + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(row, column, precision))
+    return sorted(cells)
+
+
+def _geohash_successor(prefix):
+    """Smallest geohash-alphabet string sorting after every string starting with `prefix`"""
+    for i in range(len(prefix) - 1, -1, -1):
+        position = GEOHASH_ALPHABET.index(prefix[i])
+        if position + 1 < len(GEOHASH_ALPHABET):
+            return prefix[:i] + GEOHASH_ALPHABET[position + 1]
+    return None
+
+
+def geohash_prefix_q(prefix, field='geohash'):
+    """
+    Q filter for geohashes starting with `prefix`, as a range so it uses a
+    plain B-tree index on any backend (SQLite's LIKE doesn't).
+    """
+    q = Q(**{f'{field}__gte': prefix})
+    upper = _geohash_successor(prefix)
+    if upper is not None:
+        q &= Q(**{f'{field}__lt': upper})
+    return q
+
+
+def geohash_q(lat, lon, radius_km, field='geohash', lat_field='latitude', lon_field='longitude'):
+    """
+    Q filter keeping rows whose geohash can be within `radius_km` of
+    (lat, lon): prefix ranges over the 3x3 block of the finest cells that
+    are at least as large as the radius. Like bounding_box_q(), follow with
+    an exact distance filter. Radii too large for any geohash cell, or
+    circles reaching a pole, fall back to the bounding box.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    if abs(lat) + delta_lat >= 90.0:
+        return bounding_box_q(lat, lon, radius_km, lat_field=lat_field, lon_field=lon_field)
+    delta_lon = _longitude_span(lat, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        if height >= delta_lat and width >= delta_lon:
+            q = Q()
+            for cell in geohash_neighbors(lat, lon, precision):
+                q |= geohash_prefix_q(cell, field=field)
+            return q
+    return bounding_box_q(lat, lon, radius_km, lat_field=lat_field, lon_field=lon_field)
+
+
+def distance_expression(lat, lon, lat_field='latitude', lon_field='longitude'):
+    """
+    Database expression for the haversine distance in kilometers from
+    (lat, lon) to each row's coordinates.
+    """
+    lat_rad = Value(math.radians(lat))
+    lon_rad = Value(math.radians(lon))
+    row_lat = Radians(F(lat_field))
+    row_lon = Radians(F(lon_field))
+    a = (
+        Power(Sin((row_lat - lat_rad) / Value(2.0)), 2)
+        + Value(math.cos(math.radians(lat))) * Cos(row_lat) * Power(Sin((row_lon - lon_rad) / Value(2.0)), 2)
+    )
+    # Rounding can push `a` a hair above 1 for antipodal points
+    return Value(2.0 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
+
+
+def stores_within(queryset, lat, lon, radius_km=None, limit=None):
+    """
+    Annotates `distance` (km) on a Store queryset and orders by it, nearest
+    first. With `radius_km`, only stores inside the radius are kept (after an
+    indexed bounding-box prefilter); with `limit`, only the nearest `limit`.
+    Stores without coordinates are skipped.
+    """
+    queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+    if radius_km is not None:
+        queryset = queryset.filter(bounding_box_q(lat, lon, radius_km))
+    queryset = queryset.annotate(distance=distance_expression(lat, lon))
+    if radius_km is not None:
+        queryset = queryset.filter(distance__lte=radius_km)
+    queryset = queryset.order_by('distance', 'name')
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset
+
+
+def stores_nearby(queryset, lat, lon, radius_km, limit=None):
+    """
+    Like stores_within() with a radius, but resolves candidates through
+    geohash prefix ranges instead of the latitude/longitude bounding box.
+    """
+    queryset = (
+        queryset.filter(geohash_q(lat, lon, radius_km), latitude__isnull=False, longitude__isnull=False)
+        .annotate(distance=distance_expression(lat, lon))
+        .filter(distance__lte=radius_km)
+        .order_by('distance', 'name')
+    )
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset
@@ -0,0 +1,71 @@
+import csv
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from packing_lists.parsers import iter_csv
+
+
+class Command(BaseCommand):
+    help = 'Peak memory and throughput of streaming CSV parsing (iter_csv) on a synthetic upload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=200, help='Size of the generated CSV file')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also measure reading, decoding and parsing the whole file at once')
+
+    def handle(self, *args, **options):
+        target = options['size_mb'] * 1024 * 1024
+        with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as handle:
+            path = handle.name
+        try:
+            rows = self._write_csv(path, target)
+            self.stdout.write(f"{os.path.getsize(path) / 2**20:.0f} MB, {rows:,} rows")
+
+            def streamed():
+                with open(path, 'rb') as upload:
+                    return sum(1 for _ in iter_csv(upload))
+
+            def whole_file():
+                # What upload_packing_list used to do: bytes, str and StringIO copies at once
+                with open(path, 'rb') as upload:
+                    text = upload.read().decode('utf-8')
+                return sum(1 for _ in csv.DictReader(io.StringIO(text)))
+
+            runs = [('streaming (iter_csv)', streamed)]
+            if options['compare']:
+                runs.append(('whole file', whole_file))
+            for label, func in runs:
+                count, seconds, peak = self._measure(func)
+                self.stdout.write(
+                    f"{label:<22} {count:>10,} items  {seconds:8.2f} s  peak {peak / 2**20:8.2f} MB"
+                )
+        finally:
+            os.unlink(path)
+
+    @staticmethod
+    def _write_csv(path, target):
+        rows = 0
+        with open(path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            writer.writerow(['Item Name', 'Quantity', 'Notes'])
+            while out.tell() < target:
+                for _ in range(10_000):
+                    writer.writerow([f'Item {rows}', rows % 5 + 1, 'Olive drab, size medium, per SOP'])
+                    rows += 1
+        return rows
+
+    @staticmethod
+    def _measure(func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            count = func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return count, time.perf_counter() - start, peak
@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from packing_lists import ranking
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of the vectorized price ranking on synthetic price rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='Number of price rows to rank')
+        parser.add_argument('--items', type=int, default=10_000, help='Number of distinct items the rows are spread over')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs (best run is reported)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        rng = np.random.default_rng(options['seed'])
+        item_ids = rng.integers(0, options['items'], size=rows)
+        price_per_unit = rng.uniform(1.0, 300.0, size=rows)
+        upvotes = rng.integers(0, 50, size=rows)
+        downvotes = rng.integers(0, 20, size=rows)
+
+        def vectorized():
+            _, score = ranking.score_prices(price_per_unit, upvotes, downvotes)
+            return ranking.rank_order(item_ids, price_per_unit, score)
+
+        # Same scoring done the old way: one dict per price, sorted per item in Python
+        weights = ranking.ranking_weights()
+        columns = list(zip(item_ids.tolist(), price_per_unit.tolist(), upvotes.tolist(), downvotes.tolist()))
+
+        def per_row():
+            grouped = {}
+            for item_id, ppu, up, down in columns:
+                confidence = (up - down) / max(up + down, 1)
+                score = (weights['PRICE_WEIGHT'] * (1.0 - ppu / weights['BASE_PRICE'])
+                         + weights['VOTE_WEIGHT'] * (confidence + 1) / 2)
+                grouped.setdefault(item_id, []).append({'smart_score': score, 'price_per_unit': ppu})
+            for prices in grouped.values():
+                prices.sort(key=lambda p: (-p['smart_score'], p['price_per_unit']))
+            return grouped
+
+        for label, func in (('vectorized (NumPy)', vectorized), ('per-row (Python)', per_row)):
+            best = min(self._time(func) for _ in range(repeat))
+            self.stdout.write(
+                f"{label:<20} {best * 1000:9.2f} ms  {rows / best:14,.0f} rows/s"
+            )
+
+    @staticmethod
+    def _time(func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
@@ -75,18 +75,13 @@ class Command(BaseCommand):
                     # Add votes
                     existing_votes = price_obj.votes.count()
                     if existing_votes == 0:  # Only add votes if none exist
-                        for _ in range(upvotes):
-                            Vote.objects.create(
-                                price=price_obj,
-                                is_correct_price=True,
-                                ip_address='127.0.0.1'
-                            )
-                        for _ in range(downvotes):
-                            Vote.objects.create(
-                                price=price_obj,
-                                is_correct_price=False,
-                                ip_address='127.0.0.1'
-                            )
+                        # One vote per IP and price, so each sample vote gets its own address
+                        Vote.objects.bulk_create([
+                            Vote(price=price_obj, is_correct_price=n < upvotes, ip_address=f'10.0.{n // 256}.{n % 256}')
+                            for n in range(upvotes + downvotes)
+                        ])
+                        # bulk_create skips Vote.save(), so bump the counters in one atomic update
+                        Price.adjust_vote_counts(price_obj.id, upvotes=upvotes, downvotes=downvotes)
                         self.stdout.write(f"Added {upvotes} upvotes and {downvotes} downvotes for {item.name} at {store.name}")
                     
                 except Item.DoesNotExist:
@@ -0,0 +1,52 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from packing_lists.models import ItemPriceStats, Price
+from packing_lists.ranking import price_distribution
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-item price statistics (ItemPriceStats) used to normalize price scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Stats rows written per bulk upsert')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        stats_fields = ['price_count', 'min_price', 'p25_price', 'median_price', 'p75_price', 'updated_at']
+
+        rows = (
+            Price.objects.order_by('item_id')
+            .values_list('item_id', 'price', 'quantity')
+            .iterator(chunk_size=batch_size * 10)
+        )
+
+        batch = []
+        written = 0
+        with transaction.atomic():
+            for item_id, item_rows in groupby(rows, key=lambda row: row[0]):
+                stats = price_distribution([float(price) / max(quantity, 1) for _, price, quantity in item_rows])
+                batch.append(ItemPriceStats(item_id=item_id, **stats))
+                if len(batch) >= batch_size:
+                    written += self._flush(batch, stats_fields)
+                    batch = []
+            written += self._flush(batch, stats_fields)
+
+            removed, _ = ItemPriceStats.objects.exclude(item__in=Price.objects.values('item')).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt price stats for {written} items; removed {removed} stale rows."
+        ))
+
+    @staticmethod
+    def _flush(batch, stats_fields):
+        if not batch:
+            return 0
+        ItemPriceStats.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['item'],
+            update_fields=stats_fields,
+        )
+        return len(batch)
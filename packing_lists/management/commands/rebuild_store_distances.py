@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from packing_lists.store_distances import refresh_all
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the nearest stores of every school and base (LocationStoreDistance), e.g. after bulk imports'
+
+    def handle(self, *args, **options):
+        count = refresh_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt nearest-store lists for {count} schools and bases."))
@@ -0,0 +1,70 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from packing_lists.models import Price, VoteDailyRollup
+from packing_lists.ranking import day_weight
+from packing_lists.votes import vote_totals_by_price
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the denormalized upvote/downvote counters (plain and decayed) on Price '
+        'from the Vote table and the daily vote rollups, reweighting every vote (rolled-up ones by '
+        'their day) with the current half-life. Run it after changing VOTE_HALF_LIFE_DAYS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted counters without fixing them')
+        parser.add_argument('--batch-size', type=int, default=500, help='Prices updated per bulk_update call')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        totals = vote_totals_by_price()
+
+        checked = 0
+        drifted = []
+        for price in Price.objects.only('id', *Price.VOTE_COUNTER_FIELDS).iterator(chunk_size=batch_size):
+            checked += 1
+            up, down, decayed_up, decayed_down = totals.get(price.id, (0, 0, 0.0, 0.0))
+            counts_drifted = (price.upvotes, price.downvotes) != (up, down)
+            # Decayed sums only need to agree up to float rounding
+            decay_drifted = not (
+                math.isclose(price.decayed_upvotes, decayed_up, rel_tol=1e-6, abs_tol=1e-9)
+                and math.isclose(price.decayed_downvotes, decayed_down, rel_tol=1e-6, abs_tol=1e-9)
+            )
+            if counts_drifted or decay_drifted:
+                detail = f"stored {price.upvotes}/{price.downvotes}, actual {up}/{down}"
+                if not counts_drifted:
+                    detail = "decayed vote weights out of date"
+                self.stdout.write(f"Price {price.id}: {detail}")
+                price.upvotes, price.downvotes = up, down
+                price.decayed_upvotes, price.decayed_downvotes = decayed_up, decayed_down
+                drifted.append(price)
+
+        # Keep the rollups' stored weights in step with the half-life used above
+        reweighted = []
+        for rollup in VoteDailyRollup.objects.iterator(chunk_size=batch_size):
+            weight = day_weight(rollup.day)
+            decayed = (rollup.upvotes * weight, rollup.downvotes * weight)
+            if not all(
+                math.isclose(stored, actual, rel_tol=1e-6, abs_tol=1e-9)
+                for stored, actual in zip((rollup.decayed_upvotes, rollup.decayed_downvotes), decayed)
+            ):
+                rollup.decayed_upvotes, rollup.decayed_downvotes = decayed
+                reweighted.append(rollup)
+
+        if (drifted or reweighted) and not dry_run:
+            with transaction.atomic():
+                Price.objects.bulk_update(drifted, list(Price.VOTE_COUNTER_FIELDS), batch_size=batch_size)
+                VoteDailyRollup.objects.bulk_update(
+                    reweighted, ['decayed_upvotes', 'decayed_downvotes'], batch_size=batch_size
+                )
+
+        verb = 'would be fixed' if dry_run else 'fixed'
+        summary = f"Checked {checked} prices; {len(drifted)} {verb}."
+        if reweighted:
+            summary += f" {len(reweighted)} daily rollups reweighted."
+        self.stdout.write(self.style.SUCCESS(summary))
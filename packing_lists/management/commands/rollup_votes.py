@@ -0,0 +1,149 @@
+import csv
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from packing_lists.models import Price, RolledUpVote, Vote, VoteDailyRollup
+from packing_lists.ranking import day_weight, vote_weight
+
+
+class Command(BaseCommand):
+    help = (
+        'Folds votes older than --days into per-price daily rollups (VoteDailyRollup) '
+        'and deletes the raw rows in bounded batches. Price vote counts are unchanged; the '
+        'folded votes are weighted by their day from then on. Each folded vote keeps a '
+        'RolledUpVote (price, IP, side, day) row so the IP still holds one vote per price; '
+        'those rows are deleted after --keep-ip-days, after which the IP voting on the price '
+        'again counts as a new vote.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Roll up votes older than this many days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Votes folded and deleted per transaction')
+        parser.add_argument(
+            '--keep-ip-days', type=int, default=365,
+            help='Forget which IP cast a rolled-up vote after this many days',
+        )
+        parser.add_argument('--archive', metavar='PATH', help='Append the raw rows to this CSV file before deleting them')
+        parser.add_argument('--dry-run', action='store_true', help='Count the votes that would be rolled up')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1 or options['keep_ip_days'] < 1:
+            raise CommandError('--days, --batch-size and --keep-ip-days must be positive')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+
+        archive = open(options['archive'], 'a', newline='') if options['archive'] else None
+        writer = csv.writer(archive) if archive else None
+        rolled = 0
+        last_id = 0
+        try:
+            while True:
+                # Keyset batches rather than one long cursor: we delete from
+                # the table we're reading, which SQLite doesn't isolate
+                batch = list(
+                    Vote.objects.filter(created_at__lt=cutoff, id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', 'price_id', 'is_correct_price', 'ip_address', 'created_at')[:batch_size]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                rolled += len(batch)
+                if options['dry_run']:
+                    continue
+                if writer:
+                    writer.writerows(
+                        (vote_id, price_id, int(is_correct), ip or '', created_at.isoformat())
+                        for vote_id, price_id, is_correct, ip, created_at in batch
+                    )
+                    archive.flush()
+                with transaction.atomic():
+                    self.fold(batch)
+                    # The counts keep these votes; fold() moved their weight to the rollups
+                    Vote.objects.filter(id__in=[row[0] for row in batch]).delete_keeping_counts()
+                self.stdout.write(f"Rolled up {rolled} votes...")
+        finally:
+            if archive:
+                archive.close()
+
+        ip_cutoff = timezone.localdate() - timedelta(days=options['keep_ip_days'])
+        expired = self.expire_ips(ip_cutoff, batch_size, options['dry_run'])
+
+        verb = 'would be rolled up' if options['dry_run'] else 'rolled up'
+        self.stdout.write(self.style.SUCCESS(f"{rolled} votes older than {cutoff:%Y-%m-%d} {verb}."))
+        verb = 'would be forgotten' if options['dry_run'] else 'forgotten'
+        self.stdout.write(self.style.SUCCESS(f"{expired} rolled-up vote IPs from before {ip_cutoff:%Y-%m-%d} {verb}."))
+
+    def expire_ips(self, before, batch_size, dry_run):
+        """
+        Deletes the RolledUpVote rows of votes cast before `before`, in
+        batches; returns how many. Their votes stay in the daily rollups,
+        so the IP voting on the price again adds a vote instead of flipping it.
+        """
+        expired = RolledUpVote.objects.filter(day__lt=before)
+        if dry_run:
+            return expired.count()
+        total = 0
+        while True:
+            ids = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += RolledUpVote.objects.filter(pk__in=ids).delete()[0]
+
+    def fold(self, batch):
+        """
+        Adds a batch of raw votes onto the existing daily rollups. A folded
+        vote's weight in Price's decayed counters moves from its exact time to
+        the start of its day (ranking.day_weight), which is all the rollup can
+        reproduce later.
+        """
+        totals = defaultdict(lambda: [0, 0])
+        shift = defaultdict(lambda: [0.0, 0.0])  # Decayed counter change per price
+        for _, price_id, is_correct, _, created_at in batch:
+            side = 0 if is_correct else 1
+            totals[(price_id, timezone.localdate(created_at))][side] += 1
+            shift[price_id][side] -= vote_weight(created_at)
+
+        existing = {
+            (rollup.price_id, rollup.day): rollup
+            for rollup in VoteDailyRollup.objects.select_for_update().filter(
+                price_id__in={price_id for price_id, _ in totals},
+                day__in={day for _, day in totals},
+            )
+        }
+        rollups = []
+        for (price_id, day), (up, down) in totals.items():
+            rollup = existing.get((price_id, day)) or VoteDailyRollup(price_id=price_id, day=day)
+            weight = day_weight(day)
+            rollup.upvotes += up
+            rollup.downvotes += down
+            # Reweighted in full, in case the half-life changed since the last fold
+            shift[price_id][0] += rollup.upvotes * weight - rollup.decayed_upvotes
+            shift[price_id][1] += rollup.downvotes * weight - rollup.decayed_downvotes
+            rollup.decayed_upvotes = rollup.upvotes * weight
+            rollup.decayed_downvotes = rollup.downvotes * weight
+            rollups.append(rollup)
+        VoteDailyRollup.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['price', 'day'],
+            update_fields=['upvotes', 'downvotes', 'decayed_upvotes', 'decayed_downvotes'],
+        )
+        Price.bulk_adjust_vote_counts({price_id: (0, 0, up, down) for price_id, (up, down) in shift.items()})
+        # What's left of each vote to keep one vote per IP and price
+        RolledUpVote.objects.bulk_create(
+            [
+                RolledUpVote(
+                    price_id=price_id, ip_address=ip, is_correct_price=is_correct,
+                    day=timezone.localdate(created_at),
+                )
+                for _, price_id, is_correct, ip, created_at in batch
+                if ip
+            ],
+            update_conflicts=True,
+            unique_fields=['price', 'ip_address'],
+            update_fields=['is_correct_price', 'day'],
+        )
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:09
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_vote_counters(apps, schema_editor):
+    Price = apps.get_model('packing_lists', 'Price')
+    Vote = apps.get_model('packing_lists', 'Vote')
+    totals = (
+        Vote.objects.values('price_id')
+        .annotate(
+            up=Count('id', filter=Q(is_correct_price=True)),
+            down=Count('id', filter=Q(is_correct_price=False)),
+        )
+        .order_by()
+    )
+    for row in totals.iterator():
+        Price.objects.filter(pk=row['price_id']).update(upvotes=row['up'], downvotes=row['down'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0008_store_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='price',
+            name='downvotes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='upvotes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_vote_counters, migrations.RunPython.noop),
+    ]
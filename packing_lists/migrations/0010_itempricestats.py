@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0009_price_vote_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemPriceStats',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_stats', serialize=False, to='packing_lists.item')),
+                ('price_count', models.PositiveIntegerField(default=0)),
+                ('min_price', models.FloatField()),
+                ('p25_price', models.FloatField()),
+                ('median_price', models.FloatField()),
+                ('p75_price', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'item price stats',
+            },
+        ),
+    ]
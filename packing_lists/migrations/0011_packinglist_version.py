@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0010_itempricestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packinglist',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:20
+
+from functools import reduce
+from operator import or_
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+BATCH_SIZE = 500
+
+
+def compact_duplicate_votes(apps, schema_editor):
+    """
+    Keeps only the latest vote of each (price, IP) pair, deleting the rest a
+    batch of pairs at a time, then recounts the affected prices.
+    """
+    Price = apps.get_model('packing_lists', 'Price')
+    Vote = apps.get_model('packing_lists', 'Vote')
+    duplicates = (
+        Vote.objects.filter(ip_address__isnull=False)
+        .values('price_id', 'ip_address')
+        .annotate(n=Count('id'), keep=Max('id'))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    affected = set()
+    while True:
+        # Re-query each round: compacted pairs drop out of the result
+        batch = list(duplicates[:BATCH_SIZE])
+        if not batch:
+            break
+        pairs = reduce(or_, (Q(price_id=row['price_id'], ip_address=row['ip_address']) for row in batch))
+        Vote.objects.filter(pairs).exclude(id__in=[row['keep'] for row in batch]).delete()
+        affected.update(row['price_id'] for row in batch)
+
+    affected = sorted(affected)
+    for start in range(0, len(affected), BATCH_SIZE):
+        totals = (
+            Vote.objects.filter(price_id__in=affected[start:start + BATCH_SIZE])
+            .values('price_id')
+            .annotate(
+                up=Count('id', filter=Q(is_correct_price=True)),
+                down=Count('id', filter=Q(is_correct_price=False)),
+            )
+            .order_by()
+        )
+        for row in totals:
+            Price.objects.filter(pk=row['price_id']).update(upvotes=row['up'], downvotes=row['down'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0011_packinglist_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('price', 'ip_address'), name='unique_vote_per_price_ip'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0012_vote_unique_per_ip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('upvotes', models.PositiveIntegerField(default=0)),
+                ('downvotes', models.PositiveIntegerField(default=0)),
+                ('price', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_vote_rollups', to='packing_lists.price')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('price', 'day'), name='unique_vote_rollup_per_price_day')],
+            },
+        ),
+    ]
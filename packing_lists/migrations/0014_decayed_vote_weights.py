@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:26
+
+from collections import defaultdict
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copy of ranking.vote_weight() and its defaults as of this migration,
+# so the backfill doesn't change with the live module or settings. A
+# deployment with another VOTE_HALF_LIFE_DAYS gets reweighted by
+# reconcile_vote_counts.
+_DECAY_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+_VOTE_HALF_LIFE_DAYS = 180.0
+
+
+def _vote_weight(when):
+    return 2.0 ** ((when - _DECAY_EPOCH).total_seconds() / (_VOTE_HALF_LIFE_DAYS * 86400.0))
+
+
+def _day_weight(day):
+    return _vote_weight(timezone.make_aware(datetime.combine(day, time.min)))
+
+
+def backfill_decayed_votes(apps, schema_editor):
+    """
+    Weights every existing vote by its age. Votes already rolled up only
+    have a day, so they are weighted as cast at the start of it.
+    """
+    Price = apps.get_model('packing_lists', 'Price')
+    Vote = apps.get_model('packing_lists', 'Vote')
+    VoteDailyRollup = apps.get_model('packing_lists', 'VoteDailyRollup')
+    totals = defaultdict(lambda: [0.0, 0.0])
+    votes = Vote.objects.values_list('price_id', 'is_correct_price', 'created_at').order_by()
+    for price_id, is_correct, created_at in votes.iterator(chunk_size=2000):
+        totals[price_id][0 if is_correct else 1] += _vote_weight(created_at)
+    for rollup in VoteDailyRollup.objects.iterator(chunk_size=2000):
+        weight = _day_weight(rollup.day)
+        rollup.decayed_upvotes = rollup.upvotes * weight
+        rollup.decayed_downvotes = rollup.downvotes * weight
+        rollup.save(update_fields=['decayed_upvotes', 'decayed_downvotes'])
+        totals[rollup.price_id][0] += rollup.decayed_upvotes
+        totals[rollup.price_id][1] += rollup.decayed_downvotes
+    for price_id, (up, down) in totals.items():
+        Price.objects.filter(pk=price_id).update(decayed_upvotes=up, decayed_downvotes=down)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0013_votedailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='price',
+            name='decayed_downvotes',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='decayed_upvotes',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='votedailyrollup',
+            name='decayed_downvotes',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='votedailyrollup',
+            name='decayed_upvotes',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(backfill_decayed_votes, migrations.RunPython.noop),
+    ]
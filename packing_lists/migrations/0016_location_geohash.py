@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:33
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+# Frozen copy of geo.geohash_encode() at this migration's precision
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+_GEOHASH_PRECISION = 9
+
+
+def _geohash_encode(lat, lon):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate longitude, latitude, starting with longitude
+    while len(chars) < _GEOHASH_PRECISION:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def backfill_geohashes(apps, schema_editor):
+    """Geohashes every located School, Store and Base, BATCH_SIZE rows at a time"""
+    for model_name in ('School', 'Store', 'Base'):
+        model = apps.get_model('packing_lists', model_name)
+        located = model.objects.filter(latitude__isnull=False, longitude__isnull=False).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(located.filter(pk__gt=last_pk).only('pk', 'latitude', 'longitude')[:BATCH_SIZE])
+            if not batch:
+                break
+            for row in batch:
+                row.geohash = _geohash_encode(row.latitude, row.longitude)
+            model.objects.bulk_update(batch, ['geohash'])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0015_store_lat_lon_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='base',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='school',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:36
+
+import heapq
+import math
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+NEAREST_STORES_PER_LOCATION = 200
+_EARTH_RADIUS_KM = 6371.0
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    """Frozen copy of geo.haversine_km()"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * _EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def populate_distances(apps, schema_editor):
+    """
+    Nearest stores of every located School and Base, measured in Python
+    against the historical Store rows (loaded once)
+    """
+    Store = apps.get_model('packing_lists', 'Store')
+    LocationStoreDistance = apps.get_model('packing_lists', 'LocationStoreDistance')
+    stores = list(
+        Store.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .values_list('pk', 'name', 'latitude', 'longitude')
+    )
+    for model_name, field in (('School', 'school'), ('Base', 'base')):
+        model = apps.get_model('packing_lists', model_name)
+        for location in model.objects.filter(latitude__isnull=False, longitude__isnull=False).iterator():
+            nearest = heapq.nsmallest(NEAREST_STORES_PER_LOCATION, (
+                (_haversine_km(location.latitude, location.longitude, lat, lon), name, pk)
+                for pk, name, lat, lon in stores
+            ))
+            LocationStoreDistance.objects.bulk_create([
+                LocationStoreDistance(**{field: location}, store_id=store_id, distance_km=distance)
+                for distance, _, store_id in nearest
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0016_location_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationStoreDistance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_km', models.FloatField()),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='store_distances', to='packing_lists.base')),
+                ('school', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='store_distances', to='packing_lists.school')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_distances', to='packing_lists.store')),
+            ],
+            options={
+                'ordering': ['distance_km'],
+                'indexes': [models.Index(fields=['school', 'distance_km'], name='location_dist_school_idx'), models.Index(fields=['base', 'distance_km'], name='location_dist_base_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('base__isnull', True), ('school__isnull', False)), models.Q(('base__isnull', False), ('school__isnull', True)), _connector='OR'), name='location_store_distance_one_location')],
+            },
+        ),
+        migrations.RunPython(populate_distances, migrations.RunPython.noop),
+    ]
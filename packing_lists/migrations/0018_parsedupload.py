@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0017_locationstoredistance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParsedUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('parser', models.CharField(max_length=50)),
+                ('items', models.JSONField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-last_used_at'],
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'parser'), name='unique_parsed_upload')],
+            },
+        ),
+    ]
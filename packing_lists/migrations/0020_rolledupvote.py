@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0019_storeindexversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RolledUpVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField()),
+                ('is_correct_price', models.BooleanField()),
+                ('day', models.DateField()),
+                ('price', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rolled_up_votes', to='packing_lists.price')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('price', 'ip_address'), name='unique_rolled_up_vote_per_price_ip')],
+            },
+        ),
+    ]
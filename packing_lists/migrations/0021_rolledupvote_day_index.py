@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packing_lists', '0020_rolledupvote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rolledupvote',
+            index=models.Index(fields=['day'], name='rolled_up_vote_day_idx'),
+        ),
+    ]
@@ -1,18 +1,54 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from decimal import Decimal, ROUND_DOWN
+from .geo import geohash_encode
+from .ranking import price_distribution, vote_weight
 # from django.contrib.auth.models import User # Import User if you implement user accounts
 
-class School(models.Model):
+class GeohashedLocation:
+    """
+    Keeps a model's `geohash` column in step with its latitude/longitude on
+    save (see geo.geohash_q). QuerySet.update() and bulk_create() bypass
+    this, so set geohash explicitly there.
+
+    After a save, `location_changed` tells signal receivers whether the
+    coordinates differ from the ones loaded from the database (always true
+    for new rows).
+    """
+    location_changed = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_location = (instance.__dict__.get('latitude'), instance.__dict__.get('longitude'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        location = (self.latitude, self.longitude)
+        self.location_changed = self._state.adding or getattr(self, '_saved_location', None) != location
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash_encode(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+        self._saved_location = location
+
+class School(GeohashedLocation, models.Model):
     name = models.CharField(max_length=200)
     address = models.TextField(blank=True, null=True) # Full address, can be used for display or geocoding
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False, db_index=True)
 
     def __str__(self):
         return self.name
 
-class Store(models.Model):
+class Store(GeohashedLocation, models.Model):
     name = models.CharField(max_length=200)
     address_line1 = models.CharField(max_length=255, blank=True, null=True)
     address_line2 = models.CharField(max_length=255, blank=True, null=True)
@@ -28,10 +64,17 @@ class Store(models.Model):
     # location = gis_models.PointField(null=True, blank=True, srid=4326) # SRID 4326 for WGS84
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False, db_index=True)
 
     is_online = models.BooleanField(default=False, help_text="Is this store online?")
     is_in_person = models.BooleanField(default=True, help_text="Is this store a physical location?")
 
+    class Meta:
+        indexes = [
+            # Bounding-box prefilter of radius searches (see geo.bounding_box_q)
+            models.Index(fields=['latitude', 'longitude'], name='store_lat_lon_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -59,15 +102,28 @@ class Store(models.Model):
             return f"https://maps.apple.com/?q={q}"
         return None
 
-class Base(models.Model):
+class Base(GeohashedLocation, models.Model):
     name = models.CharField(max_length=200)
     address = models.TextField(blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False, db_index=True)
 
     def __str__(self):
         return self.name
 
+def _fields_except(instance, excluded):
+    """
+    Names of the concrete, non-pk fields of `instance` minus `excluded`, for
+    passing as update_fields when a save must not write columns that are only
+    ever changed with atomic F() updates.
+    """
+    return [
+        f.name for f in instance._meta.concrete_fields
+        if not f.primary_key and f.name not in excluded
+    ]
+
+
 PACKING_LIST_TYPE_CHOICES = [
     ("course", "Course"),
     ("selection", "Selection"),
@@ -85,9 +141,26 @@ class PackingList(models.Model):
     custom_type = models.CharField(max_length=100, blank=True, null=True, help_text="If 'Other', specify type")
     # user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True) # If user-specific lists
 
+    # Bumped whenever the list's items, their prices or votes change; keys the
+    # cached detail payload (see pricing.cached_items_with_prices).
+    version = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = _fields_except(self, ('version',))
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump_versions(cls, **filters):
+        """
+        Atomically increments the version of every list matching `filters`,
+        e.g. bump_versions(pk=1) or bump_versions(items__item_id=5).
+        """
+        return cls.objects.filter(**filters).update(version=F('version') + 1)
+
 class Item(models.Model):
     name = models.CharField(max_length=200, unique=True) # Ensure item names are unique
     description = models.TextField(blank=True, null=True, default="")
@@ -121,13 +194,136 @@ class Price(models.Model):
     date_purchased = models.DateField(null=True, blank=True)
     # user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True) # Who reported this price
 
+    # Denormalized vote totals so ranking never has to count the Vote table.
+    # Only ever changed through adjust_vote_counts(); see reconcile_vote_counts to rebuild.
+    upvotes = models.PositiveIntegerField(default=0, editable=False)
+    downvotes = models.PositiveIntegerField(default=0, editable=False)
+    # The same votes as sums of ranking.vote_weight(); ranking decays them with age
+    decayed_upvotes = models.FloatField(default=0.0, editable=False)
+    decayed_downvotes = models.FloatField(default=0.0, editable=False)
+
+    VOTE_COUNTER_FIELDS = ('upvotes', 'downvotes', 'decayed_upvotes', 'decayed_downvotes')
+
     def __str__(self):
         return f"{self.item.name} at {self.store.name}: {self.price} for {self.quantity}"
 
+    @property
+    def price_per_unit(self):
+        return float(self.price) / max(self.quantity, 1)
+
     def save(self, *args, **kwargs):
         if self.price is not None:
             self.price = Decimal(self.price).quantize(Decimal('0.01'), rounding=ROUND_DOWN)
-        super().save(*args, **kwargs)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back counters loaded earlier; votes may have moved them since.
+            kwargs['update_fields'] = _fields_except(self, self.VOTE_COUNTER_FIELDS)
+        previous_item_id = None
+        if not self._state.adding:
+            previous_item_id = Price.objects.filter(pk=self.pk).values_list('item_id', flat=True).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ItemPriceStats.refresh_for_item(self.item_id)
+            if previous_item_id and previous_item_id != self.item_id:
+                ItemPriceStats.refresh_for_item(previous_item_id)
+
+    @classmethod
+    def adjust_vote_counts(cls, price_id, upvotes=0, downvotes=0, cast_at=None):
+        """
+        Atomically shifts the stored vote counters of a price in the database
+        and invalidates the cached detail of every list showing the price.
+        `cast_at` is when the votes were cast (default now); it sets their
+        weight in the decayed counters.
+        """
+        weight = vote_weight(cast_at or timezone.now())
+        cls.bulk_adjust_vote_counts({price_id: (upvotes, downvotes, upvotes * weight, downvotes * weight)})
+
+    @classmethod
+    def bulk_adjust_vote_counts(cls, deltas):
+        """
+        adjust_vote_counts() for many prices at once: `deltas` maps price id
+        -> (upvotes, downvotes, decayed upvotes, decayed downvotes). All
+        prices are updated with one UPDATE, and the affected lists are bumped
+        with one more.
+        """
+        deltas = {price_id: delta for price_id, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+        updates = {}
+        for index, field in enumerate(cls.VOTE_COUNTER_FIELDS):
+            output_field = models.FloatField() if field.startswith('decayed_') else models.IntegerField()
+            change = Case(
+                *[When(pk=price_id, then=Value(delta[index])) for price_id, delta in deltas.items()],
+                default=Value(0),
+                output_field=output_field,
+            )
+            updates[field] = F(field) + change
+            if field.startswith('decayed_'):
+                # Float rounding must never leave a decayed counter below zero
+                updates[field] = Greatest(updates[field], Value(0.0))
+        cls.objects.filter(pk__in=list(deltas)).update(**updates)
+        PackingList.bump_versions(items__item__prices__id__in=list(deltas))
+
+class ItemPriceStats(models.Model):
+    """
+    Precomputed distribution of an item's unit prices, used to normalize
+    price scores per item (a $3 pair of socks and a $300 rucksack are each
+    compared against their own median). Refreshed whenever one of the item's
+    prices is saved (Price.save) or deleted, also through querysets and
+    cascades (signals.price_deleted); rebuild everything with
+    rebuild_price_stats.
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='price_stats')
+    price_count = models.PositiveIntegerField(default=0)
+    min_price = models.FloatField()
+    p25_price = models.FloatField()
+    median_price = models.FloatField()
+    p75_price = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "item price stats"
+
+    def __str__(self):
+        return f"{self.item_id}: median {self.median_price:.2f} over {self.price_count} prices"
+
+    @classmethod
+    def refresh_for_item(cls, item_id):
+        """
+        Recomputes the stats row of one item from its current prices, deleting
+        it when the item has no prices left.
+        """
+        rows = Price.objects.filter(item_id=item_id).values_list('price', 'quantity')
+        stats = price_distribution([float(price) / max(quantity, 1) for price, quantity in rows])
+        if stats is None:
+            cls.objects.filter(item_id=item_id).delete()
+            return None
+        obj, _ = cls.objects.update_or_create(item_id=item_id, defaults=stats)
+        return obj
+
+
+class VoteQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Deletes the votes and takes them back out of their prices' counters,
+        with one read and one counter UPDATE, like Vote.delete() does for a
+        single vote.
+        """
+        with transaction.atomic():
+            deltas = {}
+            votes = self.order_by().select_for_update().values_list('price_id', 'is_correct_price', 'created_at')
+            for price_id, is_correct, created_at in votes:
+                delta = deltas.setdefault(price_id, [0, 0, 0.0, 0.0])
+                side = 0 if is_correct else 1
+                delta[side] -= 1
+                delta[side + 2] -= vote_weight(created_at)
+            result = super().delete()
+            Price.bulk_adjust_vote_counts(deltas)
+        return result
+
+    def delete_keeping_counts(self):
+        """Deletes the votes but leaves the Price counters alone (see rollup_votes)"""
+        return super().delete()
+
 
 class Vote(models.Model):
     price = models.ForeignKey(Price, on_delete=models.CASCADE, related_name='votes')
@@ -136,10 +332,157 @@ class Vote(models.Model):
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now) # Use default instead of auto_now_add for non-interactive migration
 
-    # class Meta:
-    #     unique_together = ('price', 'user') # If users must log in to vote, or one vote per IP
-    #     # Or: unique_together = ('price', 'ip_address') # if anonymous but one vote per IP
+    objects = VoteQuerySet.as_manager()
+
+    class Meta:
+        # One vote per IP and price; votes without an IP are not deduplicated.
+        # Use packing_lists.votes.record_votes() to flip an existing vote.
+        # unique_together = ('price', 'user') # If users must log in to vote
+        constraints = [
+            models.UniqueConstraint(fields=['price', 'ip_address'], name='unique_vote_per_price_ip'),
+        ]
 
     def __str__(self):
         user_info = f"by IP {self.ip_address}" if self.ip_address else "by anonymous"
         return f"{'Upvote' if self.is_correct_price else 'Downvote'} for {self.price_id} {user_info}"
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if not self._state.adding:
+                # Take back whatever the stored row was counting before this save
+                previous = Vote.objects.filter(pk=self.pk).values_list('price_id', 'is_correct_price', 'created_at').first()
+                if previous:
+                    Vote._count(*previous, -1)
+            super().save(*args, **kwargs)
+            Vote._count(self.price_id, self.is_correct_price, self.created_at, 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Vote._count(self.price_id, self.is_correct_price, self.created_at, -1)
+        return result
+
+    @staticmethod
+    def _count(price_id, is_correct_price, created_at, delta):
+        if is_correct_price:
+            Price.adjust_vote_counts(price_id, upvotes=delta, cast_at=created_at)
+        else:
+            Price.adjust_vote_counts(price_id, downvotes=delta, cast_at=created_at)
+
+
+class VoteDailyRollup(models.Model):
+    """
+    Per-price, per-day vote totals for votes old enough to be archived
+    (see the rollup_votes command). Rolled-up votes stay counted in
+    Price.upvotes/downvotes; the raw Vote rows are deleted, and a
+    RolledUpVote keeps each one's (price, IP) so the IP can't vote again as
+    if for the first time.
+    """
+    price = models.ForeignKey(Price, on_delete=models.CASCADE, related_name='daily_vote_rollups')
+    day = models.DateField()
+    upvotes = models.PositiveIntegerField(default=0)
+    downvotes = models.PositiveIntegerField(default=0)
+    # The counts times ranking.day_weight(day): rolled-up votes keep only
+    # their day, so that is the weight they carry in Price's decayed
+    # counters (and what reconcile_vote_counts recomputes them from)
+    decayed_upvotes = models.FloatField(default=0.0)
+    decayed_downvotes = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['price', 'day'], name='unique_vote_rollup_per_price_day'),
+        ]
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"{self.day}: +{self.upvotes}/-{self.downvotes} for {self.price_id}"
+
+class RolledUpVote(models.Model):
+    """
+    The price, IP and side of a vote folded into a VoteDailyRollup: what is
+    left of the raw Vote to keep one vote per IP and price. When the IP votes
+    on the price again, record_votes() takes this vote back out of its
+    rollup and replaces it with the new one. rollup_votes deletes rows
+    older than --keep-ip-days, so the table doesn't grow without bound.
+    """
+    price = models.ForeignKey(Price, on_delete=models.CASCADE, related_name='rolled_up_votes')
+    ip_address = models.GenericIPAddressField()
+    is_correct_price = models.BooleanField()
+    day = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['price', 'ip_address'], name='unique_rolled_up_vote_per_price_ip'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='rolled_up_vote_day_idx'),  # Expiry (rollup_votes)
+        ]
+
+    def __str__(self):
+        return f"{'Up' if self.is_correct_price else 'Down'}vote on {self.price_id} from {self.ip_address} ({self.day})"
+
+class LocationStoreDistance(models.Model):
+    """
+    One of the nearest stores to a School or a Base (exactly one of the two
+    is set), precomputed so "stores near this school" is a single indexed
+    read. Kept current by store_distances through signals when stores,
+    schools or bases move.
+    """
+    school = models.ForeignKey(School, on_delete=models.CASCADE, null=True, blank=True, related_name='store_distances')
+    base = models.ForeignKey(Base, on_delete=models.CASCADE, null=True, blank=True, related_name='store_distances')
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='location_distances')
+    distance_km = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(school__isnull=False, base__isnull=True) | models.Q(school__isnull=True, base__isnull=False),
+                name='location_store_distance_one_location',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['school', 'distance_km'], name='location_dist_school_idx'),
+            models.Index(fields=['base', 'distance_km'], name='location_dist_base_idx'),
+        ]
+        ordering = ['distance_km']
+
+    def __str__(self):
+        return f"{self.store_id} is {self.distance_km:.1f} km from {self.school or self.base}"
+
+class ParsedUpload(models.Model):
+    """
+    Items parsed from an uploaded file, keyed by the SHA-256 of its bytes and
+    the parser that read it, so repeat uploads of the same file skip parsing.
+    A bounded LRU cache maintained by parse_cache; rows can be deleted freely.
+    """
+    content_hash = models.CharField(max_length=64)
+    parser = models.CharField(max_length=50)
+    items = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'parser'], name='unique_parsed_upload'),
+        ]
+        ordering = ['-last_used_at']
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.parser}, {len(self.items)} items)"
+
+class StoreIndexVersion(models.Model):
+    """
+    Single-row counter bumped in the same transaction as every store save or
+    delete, so each worker can tell with one primary-key read whether its
+    in-memory store spatial index is stale (see spatial_index).
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Store index version {self.version}"
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
@@ -0,0 +1,119 @@
+"""
+Persistent cache of parsed uploads, keyed by the SHA-256 of the file's bytes.
+
+The same official packing list gets uploaded by many students, and parsing a
+PDF or spreadsheet is the slow part of an upload. HashingUploadHandler (first
+in FILE_UPLOAD_HANDLERS) hashes each file while Django streams the request
+body in, so the lookup costs no extra pass over the file; ParsedUpload rows
+hold the items each (hash, parser) pair parsed to. Only successful parses are
+stored, so a failure is retried on the next upload.
+
+The table is an LRU cache of at most PARSE_CACHE['MAX_ENTRIES'] rows: a hit
+bumps the row's last_used_at, and each new row evicts the least recently used
+ones past the limit.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ParsedUpload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSE_CACHE = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 500,
+}
+
+
+def parse_cache_settings():
+    return {**DEFAULT_PARSE_CACHE, **getattr(settings, 'PARSE_CACHE', {})}
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Hashes every uploaded file as its chunks stream past and records the hex
+    digests in request.upload_hashes by form field name. Chunks are passed on
+    untouched, so it must come before the handlers that store the file.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_hashes'):
+            self.request.upload_hashes = {}
+        self.request.upload_hashes[self.field_name] = self._sha256.hexdigest()
+        return None  # The next handler builds the file object
+
+
+def upload_hash(request, field_name, file):
+    """
+    SHA-256 hex digest of an uploaded file: the one recorded by
+    HashingUploadHandler, or computed from the file when it wasn't installed.
+    """
+    digest = getattr(request, 'upload_hashes', {}).get(field_name)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in file.chunks():
+            sha256.update(chunk)
+        file.seek(0)
+        digest = sha256.hexdigest()
+    return digest
+
+
+def cached_items(content_hash, parser_name):
+    """The cached items for the file and parser, or None; a hit refreshes the row"""
+    if not parse_cache_settings()['ENABLED']:
+        return None
+    entry = ParsedUpload.objects.filter(content_hash=content_hash, parser=parser_name).only('pk', 'items').first()
+    if entry is None:
+        return None
+    ParsedUpload.objects.filter(pk=entry.pk).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+    return entry.items
+
+
+def store_items(content_hash, parser_name, items):
+    """Caches the items a file parsed to, then evicts down to MAX_ENTRIES"""
+    config = parse_cache_settings()
+    if not config['ENABLED']:
+        return
+    ParsedUpload.objects.update_or_create(
+        content_hash=content_hash, parser=parser_name,
+        defaults={'items': items, 'last_used_at': timezone.now()},
+    )
+    evict(config['MAX_ENTRIES'])
+
+
+def evict(max_entries):
+    """Deletes all but the `max_entries` most recently used rows; returns how many"""
+    stale = list(ParsedUpload.objects.order_by('-last_used_at', '-pk').values_list('pk', flat=True)[max_entries:])
+    if not stale:
+        return 0
+    deleted, _ = ParsedUpload.objects.filter(pk__in=stale).delete()
+    logger.debug("Evicted %d cached uploads", deleted)
+    return deleted
+
+
+def parse_upload(request, file, parser, field_name='file'):
+    """
+    Parses an uploaded file with `parser` unless the same bytes were parsed
+    by it before; returns (items, error) like the parsers do.
+    """
+    content_hash = upload_hash(request, field_name, file)
+    items = cached_items(content_hash, parser.__name__)
+    if items is not None:
+        return items, None
+    items, error = parser(file)
+    if items and not error:
+        store_items(content_hash, parser.__name__, items)
+    return items, error
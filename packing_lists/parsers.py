@@ -1,35 +1,86 @@
+"""
+Parsers turning uploaded packing lists (CSV, Excel, PDF, pasted text) into
+[{'item_name', 'quantity', 'notes'}, ...].
+
+Each file parser is registered for its extensions with @register_format, and
+upload_packing_list picks one with parser_for(). The heavy libraries behind
+them (pandas, openpyxl, PyPDF2) are imported the first time a file that needs
+them is parsed, not when this module is imported, so web workers that never
+handle an upload don't pay their import time and memory.
+"""
 import csv
+import functools
 import io
-import pandas as pd
-from PyPDF2 import PdfReader
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
 # import pdfplumber # Alternative PDF parsing library
 
+FORMAT_HANDLERS = {}
+
+PDF_MAX_PAGES = 100
+PDF_PAGE_TIMEOUT = 20  # seconds
+PDF_TOTAL_TIMEOUT = 45  # seconds for the whole PDF, under gunicorn's --timeout 60
+PDF_PARALLEL_MIN_PAGES = 8
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+
+_worker_pdf = None  # The PdfReader of a PDF extraction worker process
+
+
+def register_format(*extensions):
+    """Registers the decorated parser for files ending in any of `extensions`"""
+    def decorator(parser):
+        for extension in extensions:
+            FORMAT_HANDLERS[extension.lower()] = parser
+        return parser
+    return decorator
+
+
+def parser_for(filename):
+    """The registered parser for `filename`, or None for unsupported types"""
+    filename = filename.lower()
+    for extension, parser in FORMAT_HANDLERS.items():
+        if filename.endswith(extension):
+            return parser
+    return None
+
+
+def supported_extensions():
+    return list(FORMAT_HANDLERS)
+
+
+@functools.cache
+def _pandas():
+    import pandas
+    return pandas
+
+
+@functools.cache
+def _openpyxl():
+    import openpyxl
+    return openpyxl
+
+
+@functools.cache
+def _pdf_reader():
+    from PyPDF2 import PdfReader
+    return PdfReader
+
+
 # Expected column headers (can be flexible)
 # We'll try to infer these or allow mapping if not exact
 EXPECTED_ITEM_COLUMNS = ['item', 'item name', 'name', 'product']
 EXPECTED_QUANTITY_COLUMNS = ['quantity', 'qty', 'count']
 EXPECTED_NOTES_COLUMNS = ['notes', 'note', 'description', 'desc']
 
-def parse_csv(file_content_string):
-    """
-    Parses CSV content.
-    Expects a string with CSV data.
-    Returns a list of dictionaries, where each dictionary represents an item.
-    Example: [{'item_name': 'Shirt', 'quantity': 2, 'notes': 'Blue color'}]
-    """
-    items = []
-    # Use io.StringIO to treat the string as a file
-    csvfile = io.StringIO(file_content_string)
-    reader = csv.DictReader(csvfile)
+class ParseError(ValueError):
+    """A file that can't be read as a packing list; the message is shown to the user"""
 
-    # Try to identify column names dynamically
-    # This is a simple approach; more sophisticated mapping might be needed
-    fieldnames = reader.fieldnames
-    if not fieldnames:
-        return [], "CSV is empty or has no headers."
 
+def _match_columns(fieldnames):
+    """(item, quantity, notes) header names, matched by the EXPECTED_* keywords"""
     item_col, qty_col, notes_col = None, None, None
-
     for field in fieldnames:
         low_field = field.lower()
         if not item_col and any(expected in low_field for expected in EXPECTED_ITEM_COLUMNS):
@@ -38,123 +89,306 @@ def parse_csv(file_content_string):
             qty_col = field
         elif not notes_col and any(expected in low_field for expected in EXPECTED_NOTES_COLUMNS):
             notes_col = field
+    return item_col, qty_col, notes_col
 
-    if not item_col:
-        return [], "Could not determine the item name column. Please use headers like 'Item', 'Name', or 'Product'."
 
-    for row in reader:
-        item_name = row.get(item_col, '').strip()
-        if not item_name: # Skip rows where the item name is blank
-            continue
+@contextmanager
+def _text_stream(source, encoding='utf-8'):
+    """
+    Text file object over `source`: a str, a text file, or a binary file
+    (e.g. an UploadedFile) decoded incrementally. The binary file is left
+    open.
+    """
+    if isinstance(source, str):
+        yield io.StringIO(source)
+        return
+    if isinstance(source.read(0), str):
+        yield source
+        return
+    # TextIOWrapper needs the io.BufferedIOBase interface; Django's File proxies it
+    stream = io.TextIOWrapper(getattr(source, 'file', source), encoding=encoding, newline='')
+    try:
+        yield stream
+    finally:
+        stream.detach()  # Don't close the caller's file along with the wrapper
 
-        quantity_str = row.get(qty_col, '1').strip() # Default quantity to 1 if not found
-        try:
-            quantity = int(float(quantity_str)) if quantity_str else 1
-        except ValueError:
-            quantity = 1 # Default to 1 if conversion fails
 
-        notes = row.get(notes_col, '').strip()
+def iter_csv(source):
+    """
+    Yields one {'item_name', 'quantity', 'notes'} dict per CSV row with an
+    item name, reading `source` (a str or a text/binary file object) a
+    buffer at a time, so memory stays flat however large the upload is.
+    Raises ParseError when the headers are missing or no item column can
+    be found.
+    """
+    with _text_stream(source) as csvfile:
+        reader = csv.DictReader(csvfile)
 
-        items.append({
-            'item_name': item_name,
-            'quantity': quantity,
-            'notes': notes
-        })
+        # Try to identify column names dynamically
+        # This is a simple approach; more sophisticated mapping might be needed
+        fieldnames = reader.fieldnames
+        if not fieldnames:
+            raise ParseError("CSV is empty or has no headers.")
+
+        item_col, qty_col, notes_col = _match_columns(fieldnames)
+        if not item_col:
+            raise ParseError("Could not determine the item name column. Please use headers like 'Item', 'Name', or 'Product'.")
+
+        for row in reader:
+            item_name = (row.get(item_col) or '').strip()
+            if not item_name: # Skip rows where the item name is blank
+                continue
+
+            quantity_str = (row.get(qty_col) or '1').strip() # Default quantity to 1 if not found
+            try:
+                quantity = int(float(quantity_str)) if quantity_str else 1
+            except ValueError:
+                quantity = 1 # Default to 1 if conversion fails
+
+            notes = (row.get(notes_col) or '').strip()
+
+            yield {
+                'item_name': item_name,
+                'quantity': quantity,
+                'notes': notes
+            }
+
+
+@register_format('.csv')
+def parse_csv(source):
+    """
+    Parses CSV content.
+    Expects a string with CSV data or a file object (text or binary, e.g.
+    an uploaded file), which is decoded as it is read (see iter_csv).
+    Returns a list of dictionaries, where each dictionary represents an item.
+    Example: [{'item_name': 'Shirt', 'quantity': 2, 'notes': 'Blue color'}]
+    """
+    try:
+        items = list(iter_csv(source))
+    except ParseError as e:
+        return [], str(e)
 
     if not items:
         return [], "No items found in CSV, or item names were blank."
 
     return items, None # None for error message
 
-def parse_excel(file_obj):
+XLSX_MAGIC = b'PK\x03\x04'  # .xlsx files are zip archives
+
+
+def _excel_quantity(value):
+    """Whole quantity of a spreadsheet cell, 1 when blank or not a number"""
+    if value is None or value == '':
+        return 1
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return 1
+
+
+def _iter_xlsx(file_obj):
     """
-    Parses Excel file content (xlsx).
-    Expects a file object (e.g., from an InMemoryUploadedFile).
-    Returns a list of dictionaries, similar to parse_csv.
+    Streams the first sheet of an .xlsx with openpyxl's read-only mode:
+    rows are read from the zip as they are needed and never held together.
     """
-    items = []
+    try:
+        workbook = _openpyxl().load_workbook(file_obj, read_only=True, data_only=True)
+    except Exception as e:
+        raise ParseError(f"Error reading Excel file: {str(e)}")
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        headers = [str(col) if col is not None else '' for col in header or ()]
+        if not any(headers):
+            raise ParseError("Excel sheet is empty.")
+
+        # Resolve the columns once; rows are then plain tuple lookups
+        item_col, qty_col, notes_col = _match_columns(headers)
+        if not item_col:
+            raise ParseError("Could not determine the item name column in Excel. Please use headers like 'Item', 'Name', or 'Product'.")
+        item_idx = headers.index(item_col)
+        qty_idx = headers.index(qty_col) if qty_col else None
+        notes_idx = headers.index(notes_col) if notes_col else None
+
+        def cell(row, index):
+            return row[index] if index is not None and index < len(row) else None
+
+        has_data = False
+        for row in rows:
+            if not any(value is not None for value in row):
+                continue
+            has_data = True
+            item_name = cell(row, item_idx)
+            item_name = str(item_name).strip() if item_name is not None else ''
+            if not item_name: # Skip rows where item name is blank
+                continue
+            notes = cell(row, notes_idx)
+            yield {
+                'item_name': item_name,
+                'quantity': _excel_quantity(cell(row, qty_idx)),
+                'notes': str(notes).strip() if notes is not None else ''
+            }
+        if not has_data:
+            raise ParseError("Excel sheet is empty.")
+    finally:
+        workbook.close()
+
+
+def _iter_xls(file_obj):
+    """
+    Legacy .xls (and anything else that isn't a zip) through pandas, with
+    whole-column conversions instead of a per-row loop.
+    """
+    pd = _pandas()
     try:
         # Read the first sheet by default
         df = pd.read_excel(file_obj, sheet_name=0)
     except Exception as e:
-        return [], f"Error reading Excel file: {str(e)}"
+        raise ParseError(f"Error reading Excel file: {str(e)}")
 
     if df.empty:
-        return [], "Excel sheet is empty."
+        raise ParseError("Excel sheet is empty.")
 
-    # Convert column names to lowercase for easier matching
-    df.columns = [str(col).lower() for col in df.columns]
+    item_col, qty_col, notes_col = _match_columns([str(col) for col in df.columns])
+    if not item_col:
+        raise ParseError("Could not determine the item name column in Excel. Please use headers like 'Item', 'Name', or 'Product'.")
+    columns = {str(col): col for col in df.columns}
 
-    item_col, qty_col, notes_col = None, None, None
+    names = df[columns[item_col]]
+    keep = names.notna()
+    names = names.astype(str).str.strip()
+    keep &= names != ''
 
-    for col_name in df.columns:
-        if not item_col and any(expected in col_name for expected in EXPECTED_ITEM_COLUMNS):
-            item_col = col_name
-        elif not qty_col and any(expected in col_name for expected in EXPECTED_QUANTITY_COLUMNS):
-            qty_col = col_name
-        elif not notes_col and any(expected in col_name for expected in EXPECTED_NOTES_COLUMNS):
-            notes_col = col_name
+    if qty_col:
+        quantities = pd.to_numeric(df[columns[qty_col]], errors='coerce')
+        quantities = quantities.where(quantities.abs() != float('inf'), 1).fillna(1).astype(int)
+    else:
+        quantities = pd.Series(1, index=df.index)
 
-    if not item_col:
-        return [], "Could not determine the item name column in Excel. Please use headers like 'Item', 'Name', or 'Product'."
+    if notes_col:
+        notes = df[columns[notes_col]].fillna('').astype(str).str.strip()
+    else:
+        notes = pd.Series('', index=df.index)
 
-    for index, row in df.iterrows():
-        item_name = str(row.get(item_col, '')).strip()
-        if not item_name or pd.isna(row.get(item_col)): # Skip rows where item name is blank or NaN
-            continue
+    for item_name, quantity, note in zip(names[keep], quantities[keep], notes[keep]):
+        yield {'item_name': item_name, 'quantity': int(quantity), 'notes': note}
 
-        quantity_val = row.get(qty_col, 1) # Default to 1
-        try:
-            # Handle potential float values from pandas (e.g., 2.0) and convert to int
-            quantity = int(float(quantity_val)) if not pd.isna(quantity_val) and quantity_val != '' else 1
-        except ValueError:
-            quantity = 1
 
-        notes = str(row.get(notes_col, '')).strip()
-        if pd.isna(row.get(notes_col)):
-            notes = ''
+def iter_excel(file_obj):
+    """
+    Yields one {'item_name', 'quantity', 'notes'} dict per row of the first
+    sheet that has an item name. .xlsx files (recognised by their zip
+    signature, whatever the file name) are streamed with openpyxl; others
+    go through pandas. Raises ParseError for unreadable or empty sheets and
+    a missing item column.
+    """
+    file_obj.seek(0)
+    magic = file_obj.read(len(XLSX_MAGIC))
+    file_obj.seek(0)
+    if magic == XLSX_MAGIC:
+        yield from _iter_xlsx(file_obj)
+    else:
+        yield from _iter_xls(file_obj)
 
-        items.append({
-            'item_name': item_name,
-            'quantity': quantity,
-            'notes': notes
-        })
+
+@register_format('.xls', '.xlsx')
+def parse_excel(file_obj):
+    """
+    Parses Excel file content (xlsx, or xls through pandas).
+    Expects a file object (e.g., from an InMemoryUploadedFile).
+    Returns a list of dictionaries, similar to parse_csv.
+    """
+    try:
+        items = list(iter_excel(file_obj))
+    except ParseError as e:
+        return [], str(e)
 
     if not items:
         return [], "No items found in Excel, or item names were blank."
 
     return items, None
 
+def _init_pdf_worker(data):
+    global _worker_pdf
+    _worker_pdf = _pdf_reader()(io.BytesIO(data))
+
+
+def _extract_pdf_page(index):
+    return _worker_pdf.pages[index].extract_text() or ''
+
+
+def _pdf_time_left(deadline, number):
+    """Seconds left before `deadline` to read page `number`; ParseError once it has passed"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise ParseError(f"Error parsing PDF file: timed out reading page {number}.")
+    return remaining
+
+
+def iter_pdf_pages(file_obj):
+    """
+    Yields the text of each page of a PDF, in page order. Short documents
+    are read in-process; from PDF_PARALLEL_MIN_PAGES pages on, pages are
+    extracted by a pool of up to PDF_WORKERS processes and joined back in
+    order, each page getting PDF_PAGE_TIMEOUT seconds. The whole document
+    gets PDF_TOTAL_TIMEOUT seconds, so a slow PDF fails with a message
+    before the web worker is killed. Raises ParseError past PDF_MAX_PAGES
+    pages or when a page or the document times out.
+    """
+    deadline = time.monotonic() + PDF_TOTAL_TIMEOUT
+    file_obj.seek(0)
+    reader = _pdf_reader()(file_obj)
+    page_count = len(reader.pages)
+    if page_count > PDF_MAX_PAGES:
+        raise ParseError(f"Error parsing PDF file: it has {page_count} pages; at most {PDF_MAX_PAGES} can be imported.")
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        for number, page in enumerate(reader.pages, 1):
+            _pdf_time_left(deadline, number)
+            yield page.extract_text() or ''
+        return
+
+    file_obj.seek(0)
+    data = file_obj.read()
+    # spawn, not fork: the web worker may be running other threads
+    pool = multiprocessing.get_context('spawn').Pool(
+        min(PDF_WORKERS, page_count), initializer=_init_pdf_worker, initargs=(data,)
+    )
+    try:
+        pending = [pool.apply_async(_extract_pdf_page, (index,)) for index in range(page_count)]
+        for number, result in enumerate(pending, 1):
+            try:
+                yield result.get(timeout=min(PDF_PAGE_TIMEOUT, _pdf_time_left(deadline, number)))
+            except multiprocessing.TimeoutError:
+                raise ParseError(f"Error parsing PDF file: timed out reading page {number}.")
+    finally:
+        # Also kills a worker stuck on a pathological page
+        pool.terminate()
+        pool.join()
+
+
+@register_format('.pdf')
 def parse_pdf(file_obj):
     """
     Parses PDF file content.
     Expects a file object.
     This is a very basic PDF parser and might struggle with complex layouts.
-    It extracts text and tries to find lines that look like "Item Name [Quantity] [Notes]".
+    Page texts (see iter_pdf_pages) are fed to parse_text line by line, which
+    tries to find lines that look like "Item Name [Quantity] [Notes]".
     Returns a list of dictionaries.
     """
-    items = []
     try:
         # If file_obj is not a real PDF, skip test gracefully
         if not hasattr(file_obj, 'read'):
             return [], "Error parsing PDF file: Not a file object"
-        
-        # Reset file pointer to beginning
-        file_obj.seek(0)
-        
-        reader = PdfReader(file_obj)
-        text_content = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text_content += page_text + "\n"
-        
-        if not text_content.strip():
+
+        lines = (line for page_text in iter_pdf_pages(file_obj) for line in page_text.splitlines())
+        items, error = parse_text(lines)
+        if not items:
             return [], "No text could be extracted from the PDF."
-        
-        # Parse the extracted text using the text parser
-        return parse_text(text_content)
-        
+        return items, error
+
+    except ParseError as e:
+        return [], str(e)
     except Exception as e:
         # For test environments, handle various PDF parsing errors
         error_msg = str(e)
@@ -164,16 +398,21 @@ def parse_pdf(file_obj):
 
 def parse_text(text_content):
     """
-    Parses plain text content.
+    Parses plain text content, given as a string or as any iterable of
+    lines (e.g. a generator over a PDF's pages).
     Assumes each line is an item.
     "Item Name[, quantity[, notes]]"
     Returns a list of dictionaries.
     """
     items = []
-    if not text_content or not text_content.strip():
-        return [], "Text content is empty."
-
-    for line in text_content.splitlines():
+    if text_content is None or isinstance(text_content, str):
+        if not text_content or not text_content.strip():
+            return [], "Text content is empty."
+        lines = text_content.splitlines()
+    else:
+        lines = text_content
+
+    for line in lines:
         line = line.strip()
         if not line:
             continue
@@ -0,0 +1,224 @@
+"""
+Price lookups shared by the HTML packing list page and the API detail view.
+
+Both views need every price for every item on a list together with its
+upvote/downvote totals. The totals are stored on Price itself (see
+Price.adjust_vote_counts), so the helpers here load everything for a list in a
+single query without touching the Vote table, rank the rows with
+packing_lists.ranking and group them by item.
+
+Fully built detail payloads are cached per list version (see
+cached_items_with_prices), so repeat views of an unchanged list cost one
+cache lookup.
+"""
+from collections import defaultdict
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import Price
+from . import ranking
+
+
+def prices_for_list(packing_list, max_prices=None):
+    """
+    Returns a queryset of every Price for the items on the packing list.
+    Evaluating it runs exactly one query regardless of list size. See
+    prices_for_items() for what each row carries.
+    """
+    return prices_for_items(packing_list.items.values('item'), max_prices=max_prices)
+
+
+def prices_for_items(item_ids, max_prices=None):
+    """
+    Returns a queryset of every Price for `item_ids` (a list or a subquery),
+    with `store` loaded and the item's median unit price (from
+    ItemPriceStats) annotated as `item_median_price`.
+
+    With `max_prices`, the database ranks each item's prices with
+    ROW_NUMBER() OVER (PARTITION BY item ORDER BY smart score) and only the
+    top `max_prices` per item are returned; every row then also carries
+    `item_price_total`, the item's full price count (see more_count()).
+    """
+    prices = (
+        Price.objects.filter(item__in=item_ids)
+        .select_related('store')
+        .annotate(item_median_price=F('item__price_stats__median_price'))
+    )
+    if max_prices is not None:
+        by_item = [F('item_id')]
+        prices = prices.annotate(
+            price_rank=Window(
+                RowNumber(),
+                partition_by=by_item,
+                order_by=[ranking.score_expression().desc(), ranking.price_per_unit_expression().asc(), F('id').asc()],
+            ),
+            item_price_total=Window(Count('id'), partition_by=by_item),
+        ).filter(price_rank__lte=max_prices)
+    return prices.order_by('item_id', 'id')
+
+
+def _median_or_nan(price):
+    median = getattr(price, 'item_median_price', None)
+    return np.nan if median is None else median
+
+
+def rank_prices(prices):
+    """
+    Ranks a flat list of Price objects (possibly spanning many items). Each
+    price is normalized by its item's median unit price when the Price carries
+    an `item_median_price` annotation (see prices_for_list()). Confidence
+    comes from the time-decayed vote counters; `upvotes`/`downvotes` in the
+    rows are the plain totals.
+
+    Returns a dict mapping item id -> list of price dicts, best value first:
+    {'price', 'upvotes', 'downvotes', 'vote_confidence', 'price_per_unit',
+    'smart_score'}.
+    """
+    grouped = defaultdict(list)
+    if not prices:
+        return grouped
+
+    count = len(prices)
+    item_ids = np.fromiter((p.item_id for p in prices), dtype=np.int64, count=count)
+    price_per_unit = np.fromiter((p.price_per_unit for p in prices), dtype=np.float64, count=count)
+    # Votes count by age: stored weight sums scaled to today's decayed counts
+    factor = ranking.decay_factor()
+    upvotes = np.fromiter((p.decayed_upvotes for p in prices), dtype=np.float64, count=count) * factor
+    downvotes = np.fromiter((p.decayed_downvotes for p in prices), dtype=np.float64, count=count) * factor
+    # NaN where an item has no stats yet; score_prices falls back to BASE_PRICE
+    base_price = np.fromiter(
+        (_median_or_nan(p) for p in prices), dtype=np.float64, count=count
+    )
+
+    confidence, smart_score = ranking.score_prices(price_per_unit, upvotes, downvotes, base_price=base_price)
+    order = ranking.rank_order(item_ids, price_per_unit, smart_score)
+
+    # Plain Python floats so the rows serialize and render without NumPy types
+    confidence = confidence.tolist()
+    smart_score = smart_score.tolist()
+    price_per_unit = price_per_unit.tolist()
+    for index in order.tolist():
+        price = prices[index]
+        grouped[price.item_id].append({
+            'price': price,
+            'upvotes': price.upvotes,
+            'downvotes': price.downvotes,
+            'vote_confidence': confidence[index],
+            'price_per_unit': price_per_unit[index],
+            'smart_score': smart_score[index],
+        })
+    return grouped
+
+
+def ranked_prices_by_item(packing_list, max_prices=None):
+    """
+    Returns {item id: ranked price dicts} for every item on the packing list
+    using a single query, keeping at most `max_prices` per item when given.
+    See rank_prices() for the row format.
+    """
+    return rank_prices(list(prices_for_list(packing_list, max_prices=max_prices)))
+
+
+def list_items_in_section_order(packing_list):
+    """
+    The list's PackingListItems with `item` loaded, ordered by
+    (section, item name). Each carries `section_key`, its section with None
+    folded into '' so the ordering is total and usable as a cursor.
+    """
+    return (
+        packing_list.items.select_related('item')
+        .annotate(section_key=Coalesce('section', Value('')))
+        .order_by('section_key', 'item__name')
+    )
+
+
+def iter_items_with_prices(packing_list, max_prices=None, chunk_size=200):
+    """
+    Yields (PackingListItem, ranked price dicts) pairs for the whole list in
+    (section, item name) order without holding the list in memory: items
+    come from a server-side cursor and each chunk of `chunk_size` items gets
+    its prices with one query.
+    """
+    list_items = list_items_in_section_order(packing_list).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(list_items, chunk_size))
+        if not chunk:
+            return
+        yield from _with_ranked_prices(chunk, max_prices)
+
+
+def page_items_with_prices(packing_list, after=None, limit=50, max_prices=None):
+    """
+    One page of (PackingListItem, ranked price dicts) pairs in
+    (section, item name) order, starting after the `after`
+    (section_key, item name) position. Returns (pairs, has_more).
+    """
+    list_items = list_items_in_section_order(packing_list)
+    if after is not None:
+        section_key, item_name = after
+        list_items = list_items.filter(
+            Q(section_key__gt=section_key) | Q(section_key=section_key, item__name__gt=item_name)
+        )
+    page = list(list_items[:limit + 1])
+    return _with_ranked_prices(page[:limit], max_prices), len(page) > limit
+
+
+def _with_ranked_prices(list_items, max_prices):
+    ranked = rank_prices(list(prices_for_items([pli.item_id for pli in list_items], max_prices=max_prices)))
+    return [(pli, ranked.get(pli.item_id, [])) for pli in list_items]
+
+
+def section_index(packing_list):
+    """
+    Item counts per section, in display order: [(section_key, count), ...].
+    """
+    return list(
+        packing_list.items.annotate(section_key=Coalesce('section', Value('')))
+        .values_list('section_key')
+        .annotate(item_count=Count('id'))
+        .order_by('section_key')
+    )
+
+
+def more_count(ranked_rows):
+    """
+    Number of an item's prices left out of `ranked_rows` by a max_prices cut.
+    """
+    if not ranked_rows:
+        return 0
+    total = getattr(ranked_rows[0]['price'], 'item_price_total', len(ranked_rows))
+    return max(total - len(ranked_rows), 0)
+
+
+def detail_cache_key(packing_list, variant):
+    """
+    Cache key for one rendering `variant` of a packing list's detail payload.
+    The list version is part of the key, so any change to the list simply
+    makes the next request miss; so is the ranking day (ranking.ranking_key),
+    as rankings drift with vote age alone. Stale entries age out on their own.
+    """
+    return f"packing_list_detail:{packing_list.pk}:v{packing_list.version}:{ranking.ranking_key()}:{variant}"
+
+
+def cached_items_with_prices(packing_list, variant, build):
+    """
+    Returns the cached `items_with_prices` payload for the list's current
+    version, calling `build()` on a miss.
+
+    The fresh payload is only stored once the surrounding transaction
+    commits, so data read inside a transaction that rolls back never ends up
+    in the cache.
+    """
+    key = detail_cache_key(packing_list, variant)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        timeout = getattr(settings, 'PACKING_LIST_CACHE_TIMEOUT', 300)
+        transaction.on_commit(lambda: cache.set(key, data, timeout))
+    return data
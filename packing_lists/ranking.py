@@ -0,0 +1,195 @@
+"""
+Price ranking shared by the HTML packing list page and the API.
+
+Prices are scored column-wise: callers hand over one array per attribute
+(price per unit, upvotes, downvotes, ...) covering every price row of a list
+and get back arrays of the same length, so a whole list is ranked in a single
+NumPy pass instead of one Python dict at a time.
+
+The smart score balances price against community confidence:
+
+    price_score = 1 - price_per_unit / base_price      (cheaper is better)
+    vote_score  = (vote_confidence + 1) / 2            ([-1, 1] -> [0, 1])
+    smart_score = PRICE_WEIGHT * price_score + VOTE_WEIGHT * vote_score
+
+base_price is normally the item's median unit price from ItemPriceStats, so
+each price is judged against what that item usually costs; items without
+stats fall back to BASE_PRICE. Weights and BASE_PRICE come from
+settings.PRICE_RANKING.
+
+Votes fade with age: the upvotes/downvotes fed to the score are
+exponentially decayed counts with a half-life of VOTE_HALF_LIFE_DAYS. Price
+stores them as sums of vote_weight(), each vote's weight scaled to the fixed
+DECAY_EPOCH, so a new vote is a single atomic addition and every stored sum
+decays at the same rate; multiplying by decay_factor(now) gives today's
+decayed counts.
+"""
+from datetime import datetime, time, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Greatest
+from django.utils import timezone
+
+DEFAULT_RANKING = {
+    'PRICE_WEIGHT': 0.7,
+    'VOTE_WEIGHT': 0.3,
+    'BASE_PRICE': 50.0,
+    'VOTE_HALF_LIFE_DAYS': 180.0,
+}
+
+DECAY_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+# Stored weights grow 2x per half-life since DECAY_EPOCH; a half-life this
+# long keeps them inside a float for the next 80-odd years
+MIN_VOTE_HALF_LIFE_DAYS = 30.0
+
+
+def ranking_weights():
+    """
+    Returns the ranking configuration with settings.PRICE_RANKING applied
+    over the defaults. Raises ImproperlyConfigured for a VOTE_HALF_LIFE_DAYS
+    under MIN_VOTE_HALF_LIFE_DAYS, which would overflow the stored weights.
+    """
+    weights = {**DEFAULT_RANKING, **getattr(settings, 'PRICE_RANKING', {})}
+    if not weights['VOTE_HALF_LIFE_DAYS'] >= MIN_VOTE_HALF_LIFE_DAYS:
+        raise ImproperlyConfigured(
+            f"PRICE_RANKING['VOTE_HALF_LIFE_DAYS'] must be at least {MIN_VOTE_HALF_LIFE_DAYS:g} days, "
+            f"got {weights['VOTE_HALF_LIFE_DAYS']!r}."
+        )
+    return weights
+
+
+def ranking_key(now=None):
+    """
+    Token for the point in time a decayed ranking was computed at: the local
+    day and the half-life. Caches and ETags of ranked payloads include it,
+    so they expire at least daily as votes fade, even if no data changes.
+    """
+    return f"{timezone.localdate(now):%Y%m%d}-h{ranking_weights()['VOTE_HALF_LIFE_DAYS']:g}"
+
+
+def _half_lives_since_epoch(when, weights=None):
+    half_life_days = (weights or ranking_weights())['VOTE_HALF_LIFE_DAYS']
+    return (when - DECAY_EPOCH).total_seconds() / (half_life_days * 86400.0)
+
+
+def vote_weight(when, weights=None):
+    """
+    Stored weight of one vote cast at `when`: 2 ** (half-lives since
+    DECAY_EPOCH). Add it to a decayed counter for a new vote and subtract it
+    when that vote goes away.
+    """
+    return 2.0 ** _half_lives_since_epoch(when, weights)
+
+
+def day_weight(day, weights=None):
+    """
+    Stored weight of a vote known only by its day (a rolled-up vote): it is
+    weighted as cast at the start of that day, local time.
+    """
+    return vote_weight(timezone.make_aware(datetime.combine(day, time.min)), weights)
+
+
+def decay_factor(now=None, weights=None):
+    """
+    Multiplier turning stored vote weight sums into decayed vote counts as
+    of `now` (a vote cast at `now` counts as exactly 1).
+    """
+    return 2.0 ** -_half_lives_since_epoch(now or timezone.now(), weights)
+
+
+def vote_confidence(upvotes, downvotes):
+    """
+    Net votes over total votes, in [-1, 1]; 0 for prices nobody voted on.
+    """
+    up = np.asarray(upvotes, dtype=np.float64)
+    down = np.asarray(downvotes, dtype=np.float64)
+    return (up - down) / np.maximum(up + down, 1.0)
+
+
+def score_prices(price_per_unit, upvotes, downvotes, base_price=None, weights=None):
+    """
+    Scores price rows in one vectorized pass.
+
+    `base_price` may be a scalar or an array aligned with the other columns;
+    it defaults to the configured BASE_PRICE. Missing (NaN) or non-positive
+    entries of an array also fall back to BASE_PRICE. Returns a
+    (vote_confidence, smart_score) pair of float arrays.
+    """
+    weights = weights or ranking_weights()
+    ppu = np.asarray(price_per_unit, dtype=np.float64)
+    if base_price is None:
+        base_price = weights['BASE_PRICE']
+    base = np.asarray(base_price, dtype=np.float64)
+    if base.ndim:
+        base = np.where(np.isfinite(base) & (base > 0), base, weights['BASE_PRICE'])
+
+    confidence = vote_confidence(upvotes, downvotes)
+    price_score = 1.0 - ppu / base
+    vote_score = (confidence + 1.0) / 2.0
+    smart_score = weights['PRICE_WEIGHT'] * price_score + weights['VOTE_WEIGHT'] * vote_score
+    return confidence, smart_score
+
+
+def price_distribution(price_per_unit):
+    """
+    Summarizes a set of unit prices as the ItemPriceStats fields
+    (count, min, p25, median, p75), or None when there are no prices.
+    """
+    values = np.asarray(price_per_unit, dtype=np.float64)
+    if not values.size:
+        return None
+    p25, median, p75 = np.percentile(values, [25, 50, 75]).tolist()
+    return {
+        'price_count': int(values.size),
+        'min_price': float(values.min()),
+        'p25_price': p25,
+        'median_price': median,
+        'p75_price': p75,
+    }
+
+
+def rank_order(group_ids, price_per_unit, smart_score):
+    """
+    Returns the row indices ordered by group, then best smart score first,
+    with the cheaper unit price winning ties.
+    """
+    return np.lexsort((
+        np.asarray(price_per_unit, dtype=np.float64),
+        -np.asarray(smart_score, dtype=np.float64),
+        np.asarray(group_ids),
+    ))
+
+
+def price_per_unit_expression():
+    """
+    Database expression for a Price row's unit price (price / max(quantity, 1)).
+    """
+    return Cast('price', FloatField()) / Greatest(F('quantity'), Value(1))
+
+
+def score_expression(weights=None, median_field='item__price_stats__median_price', now=None):
+    """
+    Database expression computing the same smart score as score_prices() for
+    a Price queryset, so the database can order and cut rankings (e.g. top K
+    prices per item with a window function) before any rows are fetched.
+    Votes are decayed as of `now` (default: the current time).
+    """
+    weights = weights or ranking_weights()
+    factor = Value(decay_factor(now, weights))
+    upvotes = F('decayed_upvotes') * factor
+    downvotes = F('decayed_downvotes') * factor
+    confidence = (upvotes - downvotes) / Greatest(upvotes + downvotes, Value(1.0))
+    base_price = Case(
+        When(**{f'{median_field}__gt': 0}, then=Cast(median_field, FloatField())),
+        default=Value(float(weights['BASE_PRICE'])),
+        output_field=FloatField(),
+    )
+    price_score = Value(1.0) - price_per_unit_expression() / base_price
+    vote_score = (confidence + Value(1.0)) / Value(2.0)
+    return (
+        Value(float(weights['PRICE_WEIGHT'])) * price_score
+        + Value(float(weights['VOTE_WEIGHT'])) * vote_score
+    )
@@ -0,0 +1,132 @@
+"""
+Token-bucket rate limiting for write endpoints, shared by the DRF viewsets
+(WriteRateThrottle) and the function views in views.py (@rate_limit).
+
+Every (scope, client IP) pair owns a bucket of BURST tokens that refills at
+RATE tokens per period. A request spends one token; an empty bucket means
+429 with a Retry-After. Buckets live in the default cache as a single
+(tokens, timestamp) entry, so each request costs one cache get and one set
+whatever the traffic. Use a shared cache backend (Redis, Memcached) when
+running several workers so they share buckets.
+
+Limits are configured per scope in settings.RATE_LIMITS, e.g.
+
+    RATE_LIMITS = {
+        'ENABLED': True,
+        'votes': {'RATE': '60/min', 'BURST': 30},
+    }
+"""
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+DEFAULT_RATE_LIMITS = {
+    'ENABLED': True,
+    'votes': {'RATE': '60/min', 'BURST': 30},
+    'prices': {'RATE': '30/min', 'BURST': 15},
+    'stores': {'RATE': '20/min', 'BURST': 10},
+}
+
+
+def parse_rate(rate):
+    """'60/min' -> tokens per second (1.0)"""
+    count, _, period = rate.partition('/')
+    try:
+        return int(count) / PERIODS[period.strip().lower()]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. '60/min'")
+
+
+def scope_limits(scope):
+    """(tokens per second, burst) for `scope`, or None when it isn't limited"""
+    config = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'RATE_LIMITS', {})}
+    if not config.get('ENABLED') or not config.get(scope):
+        return None
+    limits = config[scope]
+    return parse_rate(limits['RATE']), int(limits['BURST'])
+
+
+def consume(scope, ident, now=None):
+    """
+    Takes one token from the (scope, ident) bucket. Returns 0 when the
+    request may proceed, otherwise the seconds until a token is available.
+
+    The read-modify-write is not atomic across workers: concurrent requests
+    can both spend the last token, which only lets a burst overshoot by the
+    number of racing workers.
+    """
+    limits = scope_limits(scope)
+    if limits is None:
+        return 0
+    rate, burst = limits
+    now = time.time() if now is None else now
+    key = f"ratelimit:{scope}:{ident}"
+
+    tokens, updated = cache.get(key) or (burst, now)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    # Expire once the bucket would be full again anyway
+    cache.set(key, (tokens - 1, now), timeout=int(burst / rate) + 1)
+    return 0
+
+
+def client_ident(request):
+    """
+    Client IP as DRF's throttles see it: X-Forwarded-For is only trusted as
+    far as REST_FRAMEWORK['NUM_PROXIES'] proxies, otherwise REMOTE_ADDR.
+    Everything keyed per client (rate limits, vote dedup) uses this.
+    """
+    return BaseThrottle().get_ident(request)
+
+
+class WriteRateThrottle(BaseThrottle):
+    """
+    DRF throttle limiting unsafe methods per client IP. The view names its
+    bucket with a `rate_limit_scope` attribute; reads are never limited.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'rate_limit_scope', None)
+        if scope is None or request.method in SAFE_METHODS:
+            return True
+        self.retry_after = consume(scope, client_ident(request))
+        return not self.retry_after
+
+    def wait(self):
+        return getattr(self, 'retry_after', None)
+
+
+def rate_limit(scope):
+    """
+    Decorator applying the `scope` bucket to POST requests of a function
+    view. AJAX callers get a JSON 429, everyone else a plain-text one.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                retry_after = consume(scope, client_ident(request))
+                if retry_after:
+                    return too_many_requests(request, retry_after)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def too_many_requests(request, retry_after):
+    message = "Too many requests. Please wait a moment and try again."
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        response = JsonResponse({'success': False, 'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain')
+    response['Retry-After'] = str(int(retry_after) + 1)
+    return response
@@ -40,7 +40,10 @@ class PriceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Price
-        fields = ['id', 'item', 'store', 'store_id', 'price', 'quantity', 'date_purchased']
+        fields = [
+            'id', 'item', 'store', 'store_id', 'price', 'quantity', 'date_purchased',
+            'upvotes', 'downvotes'
+        ]
 
 
 class VoteSerializer(serializers.ModelSerializer):
@@ -49,6 +52,12 @@ class VoteSerializer(serializers.ModelSerializer):
         fields = ['id', 'price', 'is_correct_price', 'ip_address', 'created_at']
 
 
+class BatchVoteSerializer(serializers.Serializer):
+    """One entry of POST /api/votes/batch/"""
+    price_id = serializers.IntegerField(min_value=1)
+    is_upvote = serializers.BooleanField()
+
+
 class PackingListItemSerializer(serializers.ModelSerializer):
     item = ItemSerializer(read_only=True)
     item_id = serializers.PrimaryKeyRelatedField(
@@ -114,12 +123,14 @@ class PriceWithVotesSerializer(serializers.Serializer):
     downvotes = serializers.IntegerField()
     vote_confidence = serializers.FloatField()
     price_per_unit = serializers.FloatField()
+    smart_score = serializers.FloatField()
 
 
 class ItemWithPricesSerializer(serializers.Serializer):
     pli = PackingListItemSerializer()
     item = ItemSerializer()
     prices_with_votes = PriceWithVotesSerializer(many=True)
+    more_count = serializers.IntegerField()
 
 
 class PackingListDetailSerializer(serializers.Serializer):
@@ -0,0 +1,106 @@
+"""
+Signal receivers that keep PackingList.version current.
+
+Any change that alters what a packing list's API or detail page shows (the
+list itself, its school/base, its items, their prices, the stores selling
+them) bumps the version of the affected lists. That invalidates their cached
+detail payload and changes their ETags. Vote changes are handled in
+Price.adjust_vote_counts, which every vote path goes through.
+
+Deleted prices refresh their item's ItemPriceStats here rather than in
+Price.delete(), so queryset deletes and cascades (a deleted store) count too.
+
+Store changes also invalidate the in-process store spatial index, and
+stores, schools or bases that move update the precomputed
+LocationStoreDistance table (see store_distances).
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import store_distances
+from .models import Base, Item, ItemPriceStats, PackingList, PackingListItem, Price, School, Store
+from .spatial_index import invalidate_store_index
+
+
+@receiver(post_save, sender=PackingList)
+def packing_list_changed(sender, instance, **kwargs):
+    PackingList.bump_versions(pk=instance.pk)
+
+
+@receiver(post_save, sender=School)
+def school_changed(sender, instance, created, **kwargs):
+    if not created:
+        PackingList.bump_versions(school_id=instance.pk)
+
+
+@receiver(post_save, sender=Base)
+def base_changed(sender, instance, created, **kwargs):
+    if not created:
+        PackingList.bump_versions(base_id=instance.pk)
+
+
+@receiver(post_save, sender=PackingListItem)
+@receiver(post_delete, sender=PackingListItem)
+def packing_list_item_changed(sender, instance, **kwargs):
+    PackingList.bump_versions(pk=instance.packing_list_id)
+
+
+@receiver(post_save, sender=Price)
+@receiver(post_delete, sender=Price)
+def price_changed(sender, instance, **kwargs):
+    PackingList.bump_versions(items__item_id=instance.item_id)
+
+
+@receiver(post_delete, sender=Price)
+def price_deleted(sender, instance, **kwargs):
+    ItemPriceStats.refresh_for_item(instance.item_id)
+
+
+@receiver(post_save, sender=Item)
+def item_changed(sender, instance, created, **kwargs):
+    if not created:
+        PackingList.bump_versions(items__item_id=instance.pk)
+
+
+@receiver(post_save, sender=Store)
+def store_changed(sender, instance, created, **kwargs):
+    if not created:
+        PackingList.bump_versions(items__item__prices__store_id=instance.pk)
+
+
+@receiver(post_save, sender=Store)
+def store_location_changed(sender, instance, **kwargs):
+    # The index only holds coordinates; renames etc. don't make it stale
+    if instance.location_changed:
+        invalidate_store_index()
+
+
+@receiver(post_delete, sender=Store)
+def store_removed_from_index(sender, instance, **kwargs):
+    invalidate_store_index()
+
+
+@receiver(post_save, sender=School)
+@receiver(post_save, sender=Base)
+def location_moved(sender, instance, **kwargs):
+    if instance.location_changed:
+        store_distances.refresh_location(instance)
+
+
+@receiver(post_save, sender=Store)
+def store_moved(sender, instance, **kwargs):
+    if instance.location_changed:
+        store_distances.store_moved(instance)
+
+
+@receiver(pre_delete, sender=Store)
+def store_deleting(sender, instance, **kwargs):
+    # Its distance rows cascade away with it; remember whose lists to top up.
+    # A queryset delete sends every pre_delete before deleting anything, so
+    # the counts are from before the whole delete.
+    instance._distance_locations = store_distances.store_locations(instance)
+
+
+@receiver(post_delete, sender=Store)
+def store_deleted(sender, instance, **kwargs):
+    store_distances.refill(getattr(instance, '_distance_locations', {}))
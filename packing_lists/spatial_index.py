@@ -0,0 +1,241 @@
+"""
+In-process spatial index over Store coordinates for nearest-store queries.
+
+Stores are mapped to 3D unit vectors on the sphere and kept in a KD-tree made
+of a few flat NumPy arrays (points and ids in tree order plus per-node
+bounds and children). Straight-line (chord) distance between unit vectors
+grows monotonically with great-circle distance, so k-nearest and radius
+queries on the tree give exact great-circle answers without trigonometry
+per store.
+
+Each worker builds its index on first use (the WSGI module warms it at
+worker start) and rebuilds it whenever the store table's version moves: the
+StoreIndexVersion counter, which signals bump in the same transaction as
+every store save or delete, together with the highest store id (which also
+catches bulk_create). Both come from one indexed query per lookup, so every
+worker sees committed store changes on its next query whatever the cache
+backend.
+"""
+import heapq
+import logging
+import math
+import threading
+
+import numpy as np
+from django.db.models import Subquery
+
+from .geo import EARTH_RADIUS_KM
+from .models import Store, StoreIndexVersion
+
+logger = logging.getLogger(__name__)
+
+LEAF_SIZE = 16
+
+
+def unit_vectors(latitudes, longitudes):
+    """(N, 3) unit vectors for latitude/longitude arrays in degrees"""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def _km_to_chord(km):
+    return 2.0 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def _chord_to_km(chord):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2.0, 1.0))
+
+
+class SphereKDTree:
+    """
+    Static KD-tree over points on the unit sphere. Leaves hold up to
+    `leaf_size` points, scanned with one vectorized distance computation.
+    """
+
+    def __init__(self, ids, latitudes, longitudes, leaf_size=LEAF_SIZE):
+        points = unit_vectors(latitudes, longitudes)
+        self.leaf_size = leaf_size
+        self._order = np.arange(len(points))
+        self._source = points
+        self._start, self._end, self._left, self._right = [], [], [], []
+        self._mins, self._maxs = [], []
+        if len(points):
+            self._build(0, len(points))
+
+        # Compact, tree-ordered arrays; leaves are contiguous slices
+        self.points = points[self._order]
+        self.ids = np.asarray(ids, dtype=np.int64)[self._order]
+        self.start = np.asarray(self._start, dtype=np.int32)
+        self.end = np.asarray(self._end, dtype=np.int32)
+        self.left = np.asarray(self._left, dtype=np.int32)
+        self.right = np.asarray(self._right, dtype=np.int32)
+        self.mins = np.asarray(self._mins, dtype=np.float64).reshape(-1, 3)
+        self.maxs = np.asarray(self._maxs, dtype=np.float64).reshape(-1, 3)
+        del self._order, self._source, self._start, self._end, self._left, self._right, self._mins, self._maxs
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _build(self, lo, hi):
+        node = len(self._start)
+        idx = self._order[lo:hi]
+        pts = self._source[idx]
+        low, high = pts.min(axis=0), pts.max(axis=0)
+        self._start.append(lo)
+        self._end.append(hi)
+        self._mins.append(low)
+        self._maxs.append(high)
+        self._left.append(-1)
+        self._right.append(-1)
+        if hi - lo > self.leaf_size:
+            dim = int(np.argmax(high - low))
+            mid = (lo + hi) // 2
+            self._order[lo:hi] = idx[np.argpartition(pts[:, dim], mid - lo)]
+            self._left[node] = self._build(lo, mid)
+            self._right[node] = self._build(mid, hi)
+        return node
+
+    def _box_distance(self, node, q):
+        gap = np.maximum(0.0, np.maximum(self.mins[node] - q, q - self.maxs[node]))
+        return math.sqrt(float(gap @ gap))
+
+    def _leaf_distances(self, node, q):
+        diff = self.points[self.start[node]:self.end[node]] - q
+        return np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+    def within(self, lat, lon, radius_km):
+        """(ids, distances in km) of every point within `radius_km`, nearest first"""
+        if not len(self):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        q = unit_vectors([lat], [lon])[0]
+        limit = _km_to_chord(radius_km)
+        found_ids, found_chords = [], []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._box_distance(node, q) > limit:
+                continue
+            if self.left[node] < 0:
+                chords = self._leaf_distances(node, q)
+                hit = chords <= limit
+                found_ids.append(self.ids[self.start[node]:self.end[node]][hit])
+                found_chords.append(chords[hit])
+            else:
+                stack.extend((self.left[node], self.right[node]))
+        ids = np.concatenate(found_ids) if found_ids else np.empty(0, dtype=np.int64)
+        chords = np.concatenate(found_chords) if found_chords else np.empty(0)
+        order = np.argsort(chords, kind='stable')
+        return ids[order], _chord_to_km(chords[order])
+
+    def nearest(self, lat, lon, k):
+        """(ids, distances in km) of the `k` nearest points, nearest first"""
+        if not len(self) or k < 1:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        q = unit_vectors([lat], [lon])[0]
+        best_ids = np.empty(0, dtype=np.int64)
+        best_chords = np.empty(0)
+        heap = [(self._box_distance(0, q), 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if len(best_chords) == k and bound > best_chords[-1]:
+                break  # Nothing left can beat the current k-th best
+            if self.left[node] < 0:
+                ids = np.concatenate((best_ids, self.ids[self.start[node]:self.end[node]]))
+                chords = np.concatenate((best_chords, self._leaf_distances(node, q)))
+                order = np.argsort(chords, kind='stable')[:k]
+                best_ids, best_chords = ids[order], chords[order]
+            else:
+                for child in (self.left[node], self.right[node]):
+                    heapq.heappush(heap, (self._box_distance(child, q), int(child)))
+        return best_ids, _chord_to_km(best_chords)
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def _store_version():
+    """(change counter, highest store id); moves whenever stores change"""
+    latest_store = Store.objects.order_by('-pk').values('pk')[:1]
+    row = (
+        StoreIndexVersion.objects.filter(pk=1)
+        .annotate(latest_store=Subquery(latest_store))
+        .values_list('version', 'latest_store')
+        .first()
+    )
+    if row is None:  # Counter row not created yet
+        return (0, Store.objects.order_by('-pk').values_list('pk', flat=True).first())
+    return row
+
+
+def build_store_index():
+    """Builds a SphereKDTree from every Store with coordinates (one query)"""
+    rows = np.array(
+        Store.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .values_list('id', 'latitude', 'longitude'),
+        dtype=np.float64,
+    ).reshape(-1, 3)
+    return SphereKDTree(rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2])
+
+
+def store_index():
+    """This worker's store index, rebuilt if stores changed since it was built"""
+    global _index, _index_version
+    version = _store_version()
+    with _index_lock:
+        if _index is None or _index_version != version:
+            _index = build_store_index()
+            _index_version = version
+            logger.debug("Built store spatial index with %d stores", len(_index))
+        return _index
+
+
+def warm_store_index():
+    """Builds the index ahead of the first query; never fails worker start"""
+    try:
+        store_index()
+    except Exception:  # e.g. the database isn't migrated yet
+        logger.warning("Could not build the store spatial index at startup", exc_info=True)
+
+
+def invalidate_store_index():
+    """
+    Marks every worker's index stale. Call inside the transaction changing
+    the stores: other workers see the new version when it commits, and a
+    rollback restores the old one.
+    """
+    StoreIndexVersion.bump()
+
+
+def nearest_stores(lat, lon, k=None, radius_km=None):
+    """
+    [(store id, distance km), ...] nearest first: the `k` nearest stores,
+    every store within `radius_km`, or the `k` nearest within `radius_km`.
+    """
+    index = store_index()
+    if radius_km is not None:
+        ids, distances = index.within(lat, lon, radius_km)
+        if k is not None:
+            ids, distances = ids[:k], distances[:k]
+    else:
+        ids, distances = index.nearest(lat, lon, k if k is not None else len(index))
+    return list(zip(ids.tolist(), distances.tolist()))
+
+
+def nearest_store_objects(lat, lon, k=None, radius_km=None):
+    """
+    Like nearest_stores(), but returns Store objects with a `distance`
+    attribute in km (one query besides the version check).
+    """
+    hits = nearest_stores(lat, lon, k=k, radius_km=radius_km)
+    stores = Store.objects.in_bulk([store_id for store_id, _ in hits])
+    result = []
+    for store_id, distance in hits:
+        store = stores.get(store_id)
+        if store is not None:  # Deleted since the index was built
+            store.distance = distance
+            result.append(store)
+    return result
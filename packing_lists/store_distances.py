@@ -0,0 +1,156 @@
+"""
+Precomputed distances from each School and Base to its nearest stores.
+
+Schools and bases almost never move, so LocationStoreDistance keeps the
+NEAREST_STORES_PER_LOCATION nearest stores of each of them and "stores near
+this school" reads them back in distance order from one index. The signal
+receivers keep the table current incrementally:
+
+- a school or base that moves gets its rows recomputed (one SQL distance
+  query);
+- a store that appears or moves is measured against every located school
+  and base and only enters the lists it is close enough for; lists it left
+  are topped up again;
+- a deleted store's rows cascade away and the lists it was on are topped up,
+  also when a bulk delete takes several stores off one list.
+"""
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .geo import haversine_km, stores_within
+from .models import Base, LocationStoreDistance, School, Store
+
+NEAREST_STORES_PER_LOCATION = 200
+
+
+def _location_field(location):
+    return 'school' if isinstance(location, School) else 'base'
+
+
+def _locations(keys):
+    """School and Base objects for ('school'|'base', id) keys"""
+    school_ids = [pk for field, pk in keys if field == 'school']
+    base_ids = [pk for field, pk in keys if field == 'base']
+    return list(School.objects.filter(pk__in=school_ids)) + list(Base.objects.filter(pk__in=base_ids))
+
+
+def refresh_location(location):
+    """Recomputes the nearest stores of one School or Base"""
+    field = _location_field(location)
+    with transaction.atomic():
+        LocationStoreDistance.objects.filter(**{field: location}).delete()
+        if location.latitude is None or location.longitude is None:
+            return
+        nearest = stores_within(
+            Store.objects.all(), location.latitude, location.longitude, limit=NEAREST_STORES_PER_LOCATION
+        ).values_list('pk', 'distance')
+        LocationStoreDistance.objects.bulk_create([
+            LocationStoreDistance(**{field: location}, store_id=store_id, distance_km=distance)
+            for store_id, distance in nearest
+        ])
+
+
+def refresh_all():
+    """Recomputes every located School and Base; returns how many"""
+    locations = list(School.objects.all()) + list(Base.objects.all())
+    for location in locations:
+        refresh_location(location)
+    return len(locations)
+
+
+def store_moved(store):
+    """
+    Updates the table for a store that was created, moved or lost its
+    coordinates: drops its old rows, inserts it into every list it now
+    belongs to, trims those lists back to size and refills lists it left.
+    """
+    with transaction.atomic():
+        previous = store_locations(store)
+        LocationStoreDistance.objects.filter(store=store).delete()
+        joined = set()
+        if store.latitude is not None and store.longitude is not None:
+            joined = _insert_store(store)
+        refill({key: count for key, count in previous.items() if key not in joined})
+
+
+def store_locations(store):
+    """
+    {('school'|'base', id): row count} of the lists `store` is on, taken
+    before it leaves them so refill() can tell which lists were full
+    """
+    counts = {}
+    for field in ('school', 'base'):
+        listed = LocationStoreDistance.objects.filter(store=store, **{f'{field}__isnull': False}).values(field)
+        grouped = (
+            LocationStoreDistance.objects.filter(**{f'{field}__in': listed})
+            .values(f'{field}_id').annotate(count=Count('pk')).order_by()
+        )
+        for row in grouped:
+            counts[(field, row[f'{field}_id'])] = row['count']
+    return counts
+
+
+def refill(previous):
+    """
+    Tops up lists that lost stores, given their row counts from before
+    (see store_locations). A list that was full before and is short now is
+    recomputed; a shorter one already held every located store. A queryset
+    delete can take several stores off one list at once: the first refill
+    restores it, and the later calls find it full again.
+    """
+    for (field, pk), count in previous.items():
+        if count < NEAREST_STORES_PER_LOCATION:
+            continue
+        if LocationStoreDistance.objects.filter(**{f'{field}_id': pk}).count() < NEAREST_STORES_PER_LOCATION:
+            for location in _locations([(field, pk)]):
+                refresh_location(location)
+
+
+def _insert_store(store):
+    """Adds `store` to each list it is near enough for; returns their keys"""
+    stats = {}
+    for field in ('school', 'base'):
+        grouped = (
+            LocationStoreDistance.objects.filter(**{f'{field}__isnull': False})
+            .values(f'{field}_id').annotate(count=Count('pk'), farthest=Max('distance_km')).order_by()
+        )
+        for row in grouped:
+            stats[(field, row[f'{field}_id'])] = (row['count'], row['farthest'])
+
+    new_rows, joined, full = [], set(), []
+    for model, field in ((School, 'school'), (Base, 'base')):
+        located = model.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        for pk, lat, lon in located.values_list('pk', 'latitude', 'longitude'):
+            distance = haversine_km(lat, lon, store.latitude, store.longitude)
+            count, farthest = stats.get((field, pk), (0, None))
+            if count >= NEAREST_STORES_PER_LOCATION:
+                if distance >= farthest:
+                    continue
+                full.append((field, pk))
+            new_rows.append(LocationStoreDistance(**{f'{field}_id': pk}, store=store, distance_km=distance))
+            joined.add((field, pk))
+    LocationStoreDistance.objects.bulk_create(new_rows)
+
+    # Full lists the store entered now hold one row too many: drop the farthest
+    for field, pk in full:
+        farthest = (
+            LocationStoreDistance.objects.filter(**{f'{field}_id': pk})
+            .order_by('-distance_km', '-pk').values_list('pk', flat=True)[:1]
+        )
+        LocationStoreDistance.objects.filter(pk__in=list(farthest)).delete()
+    return joined
+
+
+def stores_near(location, radius_km=None):
+    """
+    Nearest stores of a School or Base from the precomputed table, nearest
+    first, with a `distance` attribute in km; one query.
+    """
+    rows = LocationStoreDistance.objects.filter(**{_location_field(location): location})
+    if radius_km is not None:
+        rows = rows.filter(distance_km__lte=radius_km)
+    stores = []
+    for row in rows.select_related('store').order_by('distance_km', 'store__name'):
+        row.store.distance = row.distance_km
+        stores.append(row.store)
+    return stores
@@ -0,0 +1,342 @@
+from django.test import TestCase
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import json
+
+from .models import PackingList, Item, PackingListItem, Price, Store, Vote
+from .pricing import detail_cache_key, iter_items_with_prices
+from .test_utils import add_items
+
+
+class PackingListDetailAPITests(TestCase):
+    """Test the packing list detail_view API endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="API List")
+        self.stores = [Store.objects.create(name=f"Store {i}") for i in range(3)]
+    
+    def detail_url(self):
+        return f"/api/packing-lists/{self.packing_list.id}/detail_view/"
+    
+    def test_detail_view_query_count_is_constant(self):
+        """Test that the number of queries does not depend on list size"""
+        add_items(self.packing_list, self.stores, 5)
+        with self.assertNumQueries(4):
+            self.client.get(self.detail_url())
+        add_items(self.packing_list, self.stores, 20)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.detail_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items_with_prices']), 25)
+    
+    def test_detail_view_vote_totals(self):
+        """Test that vote totals are reported per price"""
+        add_items(self.packing_list, self.stores, 1)
+        price = Price.objects.first()
+        Vote.objects.create(price=price, is_correct_price=False, ip_address="10.0.0.2")
+        response = self.client.get(self.detail_url())
+        prices = {p['price']['id']: p for p in response.data['items_with_prices'][0]['prices_with_votes']}
+        self.assertEqual(prices[price.id]['upvotes'], 1)
+        self.assertEqual(prices[price.id]['downvotes'], 1)
+        # Both votes are brand new, so decay leaves them (almost exactly) balanced
+        self.assertAlmostEqual(prices[price.id]['vote_confidence'], 0)
+
+
+class TopPricesAPITests(TestCase):
+    """Test the max_prices cut on detail_view"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="Top K List")
+        self.item = Item.objects.create(name="Rucksack")
+        PackingListItem.objects.create(packing_list=self.packing_list, item=self.item)
+        self.prices = [
+            Price.objects.create(item=self.item, store=Store.objects.create(name=f"Store {i}"), price=Decimal(amount))
+            for i, amount in enumerate(["120.00", "90.00", "150.00", "100.00", "80.00"])
+        ]
+        self.url = f"/api/packing-lists/{self.packing_list.id}/detail_view/"
+    
+    def test_max_prices_returns_top_k(self):
+        """Test that only the best K prices are returned, in ranking order"""
+        full = self.client.get(self.url).data['items_with_prices'][0]
+        response = self.client.get(self.url, {'max_prices': 2})
+        self.assertEqual(response.status_code, 200)
+        entry = response.data['items_with_prices'][0]
+        top_ids = [row['price']['id'] for row in entry['prices_with_votes']]
+        self.assertEqual(top_ids, [row['price']['id'] for row in full['prices_with_votes'][:2]])
+        self.assertEqual(top_ids, [self.prices[4].id, self.prices[1].id])
+        self.assertEqual(entry['more_count'], 3)
+        self.assertEqual(full['more_count'], 0)
+    
+    def test_max_prices_respects_votes(self):
+        """Test that the database ranking uses the vote counters"""
+        Price.adjust_vote_counts(self.prices[4].id, downvotes=50)
+        Price.adjust_vote_counts(self.prices[0].id, upvotes=50)
+        entry = self.client.get(self.url, {'max_prices': 1}).data['items_with_prices'][0]
+        full = self.client.get(self.url).data['items_with_prices'][0]
+        self.assertEqual(entry['prices_with_votes'][0]['price']['id'], full['prices_with_votes'][0]['price']['id'])
+    
+    def test_max_prices_query_count(self):
+        """Test that the cut happens in the same single price query"""
+        with self.assertNumQueries(4):
+            self.client.get(self.url, {'max_prices': 1})
+    
+    def test_invalid_max_prices(self):
+        """Test that a non-positive max_prices is rejected"""
+        self.assertEqual(self.client.get(self.url, {'max_prices': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'max_prices': 'abc'}).status_code, 400)
+    
+    def test_lazy_price_fetch_by_item(self):
+        """Test that the remaining prices can be fetched per item"""
+        other = Item.objects.create(name="Other")
+        Price.objects.create(item=other, store=Store.objects.create(name="Elsewhere"), price=Decimal("1.00"))
+        response = self.client.get("/api/prices/", {'item': self.item.id})
+        self.assertEqual(response.data['count'], 5)
+
+
+class DetailCacheTests(TestCase):
+    """Test the version-keyed detail cache"""
+    
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="Hot List")
+        self.item = Item.objects.create(name="Compass")
+        self.pli = PackingListItem.objects.create(packing_list=self.packing_list, item=self.item)
+        self.store = Store.objects.create(name="Store")
+        self.price = Price.objects.create(item=self.item, store=self.store, price=Decimal("25.00"))
+        self.url = f"/api/packing-lists/{self.packing_list.id}/detail_view/"
+    
+    def version(self):
+        self.packing_list.refresh_from_db()
+        return self.packing_list.version
+    
+    def test_version_bumps(self):
+        """Test that item, price, vote and store changes bump the list version"""
+        start = self.version()
+        self.pli.packed = True
+        self.pli.save()
+        self.assertEqual(self.version(), start + 1)
+        Price.objects.create(item=self.item, store=self.store, price=Decimal("20.00"))
+        self.assertEqual(self.version(), start + 2)
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        self.assertEqual(self.version(), start + 3)
+        self.store.name = "Renamed Store"
+        self.store.save()
+        self.assertEqual(self.version(), start + 4)
+    
+    def test_list_save_keeps_version(self):
+        """Test that saving a stale list instance does not roll the version back"""
+        stale = PackingList.objects.get(id=self.packing_list.id)
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        expected = self.version()
+        stale.name = "Renamed"
+        stale.save()
+        self.assertEqual(self.version(), expected + 1)  # The save itself bumps once
+    
+    def test_repeat_views_hit_cache(self):
+        """Test that an unchanged list is served from the cache until it changes"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['items_with_prices'][0]['prices_with_votes'][0]['upvotes'], 0)
+        
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['items_with_prices'][0]['prices_with_votes'][0]['upvotes'], 1)
+    
+    def test_html_detail_uses_cache(self):
+        """Test that the HTML detail page is served from the cache too"""
+        url = f"/list/{self.packing_list.id}/"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, "Compass")
+
+
+class ConditionalRequestTests(TestCase):
+    """Test ETag / If-None-Match handling on the packing list endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="Tagged List")
+        self.item = Item.objects.create(name="Poncho")
+        PackingListItem.objects.create(packing_list=self.packing_list, item=self.item)
+        self.price = Price.objects.create(item=self.item, store=Store.objects.create(name="Store"), price=Decimal("15.00"))
+        self.detail_url = f"/api/packing-lists/{self.packing_list.id}/detail_view/"
+    
+    def test_detail_view_not_modified(self):
+        """Test that a matching If-None-Match costs one query and returns 304"""
+        response = self.client.get(self.detail_url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_detail_view_etag_changes_with_data(self):
+        """Test that a vote changes the ETag so clients refetch"""
+        etag = self.client.get(self.detail_url)['ETag']
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_detail_view_etag_depends_on_query(self):
+        """Test that different max_prices cuts get different ETags"""
+        full = self.client.get(self.detail_url)['ETag']
+        cut = self.client.get(self.detail_url, {'max_prices': 1})['ETag']
+        self.assertNotEqual(full, cut)
+    
+    def test_detail_view_etag_expires_daily(self):
+        """Test that a day later the ETag and cached ranking are rebuilt, as votes have faded"""
+        etag = self.client.get(self.detail_url)['ETag']
+        cache_key = detail_cache_key(self.packing_list, 'full')
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertNotEqual(detail_cache_key(self.packing_list, 'full'), cache_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_detail_view_etag_depends_on_format(self):
+        """Test that JSON and NDJSON bodies of one URL get different ETags"""
+        json_response = self.client.get(self.detail_url)
+        stream = self.client.get(self.detail_url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertNotEqual(json_response['ETag'], stream['ETag'])
+        self.assertIn('Accept', json_response['Vary'])
+        self.assertIn('Accept', stream['Vary'])
+        
+        response = self.client.get(self.detail_url, HTTP_ACCEPT='application/x-ndjson', HTTP_IF_NONE_MATCH=json_response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        not_modified = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=json_response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertIn('Accept', not_modified['Vary'])
+    
+    def test_list_and_retrieve_not_modified(self):
+        """Test conditional GETs on the list and retrieve endpoints"""
+        for url in ("/api/packing-lists/", f"/api/packing-lists/{self.packing_list.id}/"):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        
+        list_etag = self.client.get("/api/packing-lists/")['ETag']
+        self.packing_list.name = "Renamed"
+        self.packing_list.save()
+        self.assertEqual(self.client.get("/api/packing-lists/", HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+    
+    def test_missing_list_still_404(self):
+        """Test that unknown ids are not answered from the ETag path"""
+        self.assertEqual(self.client.get("/api/packing-lists/99999/detail_view/").status_code, 404)
+
+
+class StreamingDetailTests(TestCase):
+    """Test the NDJSON streaming mode of detail_view"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="Deployment List")
+        store = Store.objects.create(name="Store")
+        for section, name in (("Gear", "Tent"), ("Clothing", "Socks"), (None, "Notebook"), ("Gear", "Axe"), ("Clothing", "Hat")):
+            item = Item.objects.create(name=name)
+            PackingListItem.objects.create(packing_list=self.packing_list, item=item, section=section)
+            Price.objects.create(item=item, store=store, price=Decimal("5.00"))
+        self.url = f"/api/packing-lists/{self.packing_list.id}/detail_view/"
+    
+    def read_lines(self, response):
+        body = b"".join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+    
+    def test_stream_query_param(self):
+        """Test that ?stream=1 yields header, sections, items and a trailer"""
+        response = self.client.get(self.url, {'stream': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self.read_lines(response)
+        
+        self.assertEqual(lines[0]['type'], 'packing_list')
+        self.assertEqual(lines[0]['data']['name'], "Deployment List")
+        self.assertEqual(lines[-1], {'type': 'end', 'item_count': 5})
+        sections = [line['name'] for line in lines if line['type'] == 'section']
+        self.assertEqual(sections, ['', 'Clothing', 'Gear'])
+        names = [line['data']['item']['name'] for line in lines if line['type'] == 'item']
+        self.assertEqual(names, ['Notebook', 'Hat', 'Socks', 'Axe', 'Tent'])
+        self.assertEqual(lines[2]['data']['prices_with_votes'][0]['price']['price'], '5.00')
+    
+    def test_stream_accept_header(self):
+        """Test that Accept: application/x-ndjson selects the streaming mode"""
+        response = self.client.get(self.url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(self.read_lines(response)[-1]['item_count'], 5)
+    
+    def test_items_are_fetched_in_chunks(self):
+        """Test that each chunk of items costs one price query"""
+        with self.assertNumQueries(4):  # items cursor + 3 chunks of prices
+            pairs = list(iter_items_with_prices(self.packing_list, chunk_size=2))
+        self.assertEqual(len(pairs), 5)
+
+
+class DetailPaginationTests(TestCase):
+    """Test cursor pagination and the section index on detail_view"""
+    
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="Paged List")
+        store = Store.objects.create(name="Store")
+        for section, name in (("Gear", "Tent"), ("Clothing", "Socks"), (None, "Notebook"), ("Gear", "Axe"), ("Clothing", "Hat")):
+            item = Item.objects.create(name=name)
+            PackingListItem.objects.create(packing_list=self.packing_list, item=item, section=section)
+            Price.objects.create(item=item, store=store, price=Decimal("5.00"))
+        self.url = f"/api/packing-lists/{self.packing_list.id}/detail_view/"
+    
+    def names(self, response):
+        return [entry['item']['name'] for entry in response.data['items_with_prices']]
+    
+    def test_pages_follow_section_order(self):
+        """Test that following next_cursor walks every item exactly once"""
+        names = []
+        params = {'page_size': 2}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['items_with_prices']), 2)
+            names += self.names(response)
+            if response.data['next_cursor'] is None:
+                break
+            params = {'page_size': 2, 'cursor': response.data['next_cursor']}
+        self.assertEqual(names, ['Notebook', 'Hat', 'Socks', 'Axe', 'Tent'])
+    
+    def test_page_query_count(self):
+        """Test that a page costs a fixed number of queries"""
+        with self.assertNumQueries(4):  # version, list, page of items, prices
+            response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(self.names(response), ['Notebook', 'Hat', 'Socks'])
+    
+    def test_section_index(self):
+        """Test that the section index lists counts and cursors that jump to each section"""
+        response = self.client.get(f"/api/packing-lists/{self.packing_list.id}/sections/")
+        self.assertEqual(response.status_code, 200)
+        sections = response.data['sections']
+        self.assertEqual(
+            [(s['section'], s['item_count']) for s in sections],
+            [('', 1), ('Clothing', 2), ('Gear', 2)],
+        )
+        gear = self.client.get(self.url, {'cursor': sections[2]['cursor']})
+        self.assertEqual(self.names(gear), ['Axe', 'Tent'])
+        self.assertIsNone(gear.data['next_cursor'])
+    
+    def test_invalid_page_parameters(self):
+        """Test that bad cursors and page sizes are rejected"""
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page_size': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page_size': 'ten'}).status_code, 400)
@@ -0,0 +1,168 @@
+import itertools
+import time
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from . import basket
+from .basket import choose_stores
+from .models import Item, PackingList, PackingListItem, Price, Store
+
+
+class ChooseStoresTests(TestCase):
+    """Test the store-selection solver"""
+    
+    def brute_force(self, costs, max_stores):
+        """(-covered items, total cost) of the best plan by full enumeration"""
+        best = (0, 0.0)
+        for size in range(1, min(max_stores, costs.shape[1]) + 1):
+            for combo in itertools.combinations(range(costs.shape[1]), size):
+                mins = costs[:, list(combo)].min(axis=1)
+                best = min(best, (-int(np.isfinite(mins).sum()), float(mins[np.isfinite(mins)].sum())))
+        return best
+    
+    def evaluate(self, costs, columns):
+        if not columns:
+            return (0, 0.0)
+        mins = costs[:, columns].min(axis=1)
+        return (-int(np.isfinite(mins).sum()), float(mins[np.isfinite(mins)].sum()))
+    
+    def test_exact_matches_brute_force(self):
+        """Test that small instances are solved optimally"""
+        rng = np.random.default_rng(3)
+        for _ in range(100):
+            costs = rng.uniform(1, 100, (rng.integers(1, 10), rng.integers(1, 8)))
+            costs[rng.random(costs.shape) < 0.5] = np.inf
+            max_stores = int(rng.integers(1, 4))
+            columns, method, optimal = choose_stores(costs, max_stores)
+            self.assertEqual(method, 'exact')
+            self.assertTrue(optimal)
+            self.assertLessEqual(len(columns), max_stores)
+            covered, total = self.evaluate(costs, columns)
+            best_covered, best_total = self.brute_force(costs, max_stores)
+            self.assertEqual(covered, best_covered)
+            self.assertAlmostEqual(total, best_total)
+    
+    def test_coverage_beats_cost(self):
+        """Test that a plan covering more items wins over a cheaper one"""
+        costs = np.array([[1.0, 50.0], [np.inf, 50.0]])
+        self.assertEqual(choose_stores(costs, 1)[0], [1])
+        self.assertEqual(choose_stores(costs, 2)[0], [0, 1])
+    
+    def test_unused_stores_dropped(self):
+        """Test that stores nothing is bought from aren't in the plan"""
+        costs = np.array([[1.0, 2.0, 3.0], [1.0, 2.0, 3.0]])
+        self.assertEqual(choose_stores(costs, 3)[0], [0])
+    
+    def test_large_instance_is_greedy_and_fast(self):
+        """Test that a 300-item list over many stores stays within the budget"""
+        rng = np.random.default_rng(5)
+        costs = rng.uniform(1, 100, (300, 150))
+        costs[rng.random(costs.shape) < 0.8] = np.inf
+        started = time.monotonic()
+        columns, method, optimal = choose_stores(costs, 4, time_budget=0.5)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual((method, optimal), ('greedy', False))
+        self.assertLessEqual(len(columns), 4)
+    
+    def test_pruning_respects_the_budget(self):
+        """Test that the quadratic dominance check stops at its share of the budget"""
+        rng = np.random.default_rng(9)
+        costs = rng.uniform(1, 100, (300, 2000))
+        costs[rng.random(costs.shape) < 0.7] = np.inf
+        started = time.monotonic()
+        columns, method, _ = choose_stores(costs, 3, time_budget=0.2)
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(method, 'greedy')
+        self.assertTrue(columns)
+    
+    def test_deadline_falls_back_to_greedy(self):
+        """Test that enumeration gives up at the deadline"""
+        rng = np.random.default_rng(7)
+        costs = rng.uniform(1, 100, (20, 30))
+        with mock.patch.object(basket, 'COMBINATION_CHUNK', 10):
+            columns, method, optimal = choose_stores(costs, 3, time_budget=0)
+        self.assertEqual((method, optimal), ('greedy', False))
+        self.assertTrue(columns)
+
+
+class BasketAPITests(TestCase):
+    """Test GET /api/packing-lists/{id}/basket/"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.packing_list = PackingList.objects.create(name="Ranger School")
+        self.boots = Item.objects.create(name="Boots")
+        self.socks = Item.objects.create(name="Socks")
+        self.compass = Item.objects.create(name="Compass")
+        self.packed = Item.objects.create(name="Already Packed")
+        self.boots_line = PackingListItem.objects.create(packing_list=self.packing_list, item=self.boots)
+        self.socks_line = PackingListItem.objects.create(packing_list=self.packing_list, item=self.socks, quantity=5)
+        self.compass_line = PackingListItem.objects.create(packing_list=self.packing_list, item=self.compass)
+        PackingListItem.objects.create(packing_list=self.packing_list, item=self.packed, packed=True)
+        
+        self.px = Store.objects.create(name="PX", latitude=35.139, longitude=-79.006)
+        self.surplus = Store.objects.create(name="Surplus", latitude=35.05, longitude=-78.88)
+        self.far = Store.objects.create(name="Far Away", latitude=40.0, longitude=-100.0)
+        self.online = Store.objects.create(name="Online", is_online=True, is_in_person=False)
+        
+        Price.objects.create(item=self.boots, store=self.px, price=Decimal("120.00"))
+        Price.objects.create(item=self.boots, store=self.surplus, price=Decimal("90.00"))
+        # Packs of 3 socks: 5 socks need 2 packs
+        Price.objects.create(item=self.socks, store=self.px, price=Decimal("10.00"), quantity=3)
+        Price.objects.create(item=self.socks, store=self.surplus, price=Decimal("3.00"))
+        Price.objects.create(item=self.compass, store=self.far, price=Decimal("5.00"))
+        Price.objects.create(item=self.compass, store=self.online, price=Decimal("40.00"))
+        Price.objects.create(item=self.packed, store=self.px, price=Decimal("1.00"))
+        self.url = f'/api/packing-lists/{self.packing_list.id}/basket/'
+        self.near = {'lat': 35.1, 'lon': -79.0, 'radius': 50}
+    
+    def test_cheapest_plan(self):
+        """Test that unpacked items are assigned to the cheapest nearby stores"""
+        data = self.client.get(self.url, {**self.near, 'max_stores': 2}).json()
+        self.assertEqual(data['method'], 'exact')
+        self.assertTrue(data['optimal'])
+        self.assertEqual(data['total_cost'], 90.00 + 15.00)
+        self.assertEqual([s['store']['name'] for s in data['stores']], ["Surplus"])
+        self.assertEqual([u['item_name'] for u in data['unavailable']], ["Compass"])
+        self.assertNotIn(self.packed.id, [a['item_id'] for a in data['assignments']])
+    
+    def test_store_limit_and_pack_sizes(self):
+        """Test that a one-store limit picks the best single store"""
+        Price.objects.filter(item=self.socks, store=self.surplus).delete()
+        Price.objects.create(item=self.socks, store=self.surplus, price=Decimal("30.00"))
+        data = self.client.get(self.url, {**self.near, 'max_stores': 1}).json()
+        costs = {a['item_name']: a['cost'] for a in data['assignments']}
+        self.assertEqual([s['store']['name'] for s in data['stores']], ["PX"])
+        self.assertEqual(costs, {"Boots": 120.00, "Socks": 20.00})
+    
+    def test_online_stores(self):
+        """Test that online stores join the candidates on request"""
+        data = self.client.get(self.url, {**self.near, 'online': 1}).json()
+        self.assertEqual(data['unavailable'], [])
+        online = [s for s in data['stores'] if s['store']['name'] == "Online"]
+        self.assertIsNone(online[0]['distance_km'])
+    
+    def test_downvoted_prices_ignored(self):
+        """Test that prices voted wrong don't enter the plan"""
+        price = Price.objects.get(item=self.boots, store=self.surplus)
+        Price.adjust_vote_counts(price.id, downvotes=3)
+        data = self.client.get(self.url, self.near).json()
+        boots = [a for a in data['assignments'] if a['item_name'] == "Boots"]
+        self.assertEqual(boots[0]['cost'], 120.00)
+    
+    def test_candidate_stores_capped_to_nearest_sellers(self):
+        """Test that only the nearest stores pricing a wanted item are considered"""
+        Store.objects.create(name="Nearest, sells nothing", latitude=35.1, longitude=-79.0)
+        with mock.patch.object(basket, 'MAX_CANDIDATE_STORES', 1):
+            data = self.client.get(self.url, {**self.near, 'radius': 5000}).json()
+        self.assertEqual([s['store']['name'] for s in data['stores']], ["PX"])
+    
+    def test_invalid_parameters(self):
+        """Test that missing location and bad store limits are rejected"""
+        for params in ({}, {'lat': 35, 'lon': -79}, {**self.near, 'max_stores': 0}, {**self.near, 'max_stores': 'x'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        self.assertEqual(self.client.get('/api/packing-lists/999999/basket/', self.near).status_code, 404)
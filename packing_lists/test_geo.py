@@ -0,0 +1,124 @@
+import random
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .geo import (
+    bounding_box_q, distance_expression, geohash_encode, geohash_q, haversine_km, stores_nearby, stores_within,
+)
+from .models import Base, School, Store
+
+
+class GeoTests(TestCase):
+    """Test the SQL distance helpers"""
+    
+    def setUp(self):
+        self.points = {
+            'Fort Bragg': (35.1390, -79.0060),
+            'Fayetteville': (35.0527, -78.8784),
+            'Fort Liberty PX': (35.1414, -79.0040),
+            'Raleigh': (35.7796, -78.6382),
+            'Honolulu': (21.3069, -157.8583),
+            'Fiji': (-17.7134, 178.0650),
+            'Samoa': (-13.7590, -172.1046),
+        }
+        self.stores = {name: Store.objects.create(name=name, latitude=lat, longitude=lon) for name, (lat, lon) in self.points.items()}
+        Store.objects.create(name="Online Only", is_online=True)
+    
+    def test_database_distance_matches_python(self):
+        """Test that the SQL haversine agrees with the Python one"""
+        lat, lon = self.points['Fort Bragg']
+        rows = Store.objects.filter(latitude__isnull=False).annotate(distance=distance_expression(lat, lon))
+        for store in rows:
+            self.assertAlmostEqual(store.distance, haversine_km(lat, lon, store.latitude, store.longitude), places=6)
+    
+    def test_radius_order_and_limit(self):
+        """Test that radius, ordering and limit are applied in the query"""
+        lat, lon = self.points['Fort Bragg']
+        nearby = list(stores_within(Store.objects.all(), lat, lon, radius_km=20))
+        self.assertEqual([s.name for s in nearby], ['Fort Bragg', 'Fort Liberty PX', 'Fayetteville'])
+        nearest = list(stores_within(Store.objects.all(), lat, lon, limit=2))
+        self.assertEqual([s.name for s in nearest], ['Fort Bragg', 'Fort Liberty PX'])
+        with self.assertNumQueries(1):
+            list(stores_within(Store.objects.all(), lat, lon, radius_km=200, limit=10))
+    
+    def test_bounding_box_contains_circle(self):
+        """Test that the prefilter never drops a store inside the radius"""
+        for name, (lat, lon) in self.points.items():
+            for radius in (1, 50, 500, 5000):
+                inside = {
+                    other for other, (olat, olon) in self.points.items()
+                    if haversine_km(lat, lon, olat, olon) <= radius
+                }
+                boxed = set(Store.objects.filter(bounding_box_q(lat, lon, radius)).values_list('name', flat=True))
+                self.assertLessEqual(inside, boxed, f"{name} within {radius} km")
+    
+    def test_radius_across_antimeridian(self):
+        """Test that a search near the date line finds stores on both sides"""
+        lat, lon = self.points['Fiji']
+        names = [s.name for s in stores_within(Store.objects.all(), lat, lon, radius_km=1200)]
+        self.assertEqual(names, ['Fiji', 'Samoa'])
+
+
+class GeohashTests(TestCase):
+    """Test geohash columns and prefix-range lookups"""
+    
+    def test_encode(self):
+        """Test the encoding against a published reference value"""
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geohash_encode(-90, -180, 3), '000')
+    
+    def test_filled_on_save(self):
+        """Test that every location model keeps its geohash in step"""
+        for model in (Store, School, Base):
+            location = model.objects.create(name="Spot", latitude=35.139, longitude=-79.006)
+            self.assertEqual(location.geohash, geohash_encode(35.139, -79.006))
+            location.latitude = location.longitude = None
+            location.save()
+            location.refresh_from_db()
+            self.assertIsNone(location.geohash)
+    
+    def test_update_fields_include_geohash(self):
+        """Test that saving only the coordinates also writes the geohash"""
+        store = Store.objects.create(name="Moved")
+        store.latitude, store.longitude = 21.3069, -157.8583
+        store.save(update_fields=['latitude', 'longitude'])
+        store.refresh_from_db()
+        self.assertEqual(store.geohash, geohash_encode(21.3069, -157.8583))
+    
+    def test_prefix_ranges_contain_circle(self):
+        """Test that the geohash prefilter never drops a store inside the radius"""
+        rng = random.Random(7)
+        points = [(35.1 + rng.uniform(-3, 3), -79.0 + rng.uniform(-3, 3)) for _ in range(200)]
+        points += [(rng.uniform(-85, 85), rng.uniform(-180, 180)) for _ in range(200)]
+        points += [(-17.7134, 178.0650), (-13.7590, -172.1046), (89.5, 0.0)]
+        for lat, lon in points:
+            Store.objects.create(name="S", latitude=lat, longitude=lon)
+        queries = [(35.139, -79.006), (35.0, -76.0), (-17.7134, 179.99), (88.9, 45.0), (0.0, 0.0)]
+        for lat, lon in queries:
+            for radius in (0.5, 5, 40, 300, 2000, 8000):
+                inside = {
+                    store_id for store_id, slat, slon in Store.objects.values_list('id', 'latitude', 'longitude')
+                    if haversine_km(lat, lon, slat, slon) <= radius
+                }
+                candidates = set(Store.objects.filter(geohash_q(lat, lon, radius)).values_list('id', flat=True))
+                self.assertLessEqual(inside, candidates, f"({lat}, {lon}) within {radius} km")
+                found = {s.id for s in stores_nearby(Store.objects.all(), lat, lon, radius)}
+                self.assertEqual(found, inside)
+    
+    def test_nearby_endpoint(self):
+        """Test GET /api/stores/nearby/ ordering, radius and validation"""
+        client = APIClient()
+        Store.objects.create(name="Raleigh", latitude=35.7796, longitude=-78.6382)
+        Store.objects.create(name="Fort Bragg PX", latitude=35.1390, longitude=-79.0060)
+        Store.objects.create(name="Fayetteville", latitude=35.0527, longitude=-78.8784)
+        response = client.get('/api/stores/nearby/', {'lat': 35.14, 'lon': -79.0, 'radius': 20})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['name'] for r in results], ["Fort Bragg PX", "Fayetteville"])
+        self.assertLess(results[0]['distance_km'], results[1]['distance_km'])
+        response = client.get('/api/stores/nearby/', {'lat': 35.14, 'lon': -79.0, 'radius': 200, 'limit': 1})
+        self.assertEqual(len(response.json()['results']), 1)
+        for params in ({'lat': 35, 'lon': -79}, {'lat': 35, 'lon': -79, 'radius': 0},
+                       {'lat': 35, 'lon': -79, 'radius': 'inf'}, {'lat': 95, 'lon': 0, 'radius': 5}):
+            self.assertEqual(client.get('/api/stores/nearby/', params).status_code, 400)
@@ -1,7 +1,9 @@
 from django.test import TestCase
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from django.core.management import call_command
 from decimal import Decimal
+from io import StringIO
 from .models import School, Store, PackingList, Item, PackingListItem, Price, Vote
 
 
@@ -302,6 +304,81 @@ class VoteModelTests(TestCase):
         self.assertIn("127.0.0.1", str(vote))
 
 
+class VoteCounterTests(TestCase):
+    """Test the denormalized vote counters on Price"""
+    
+    def setUp(self):
+        self.item = Item.objects.create(name="Test Item")
+        self.store = Store.objects.create(name="Test Store")
+        self.price = Price.objects.create(
+            item=self.item,
+            store=self.store,
+            price=Decimal("10.00")
+        )
+    
+    def test_vote_creation_increments_counters(self):
+        """Test that creating votes bumps the matching counter"""
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.2")
+        Vote.objects.create(price=self.price, is_correct_price=False, ip_address="10.0.0.3")
+        self.price.refresh_from_db()
+        self.assertEqual(self.price.upvotes, 2)
+        self.assertEqual(self.price.downvotes, 1)
+    
+    def test_vote_flip_and_delete(self):
+        """Test that changing and deleting a vote keeps counters in step"""
+        vote = Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        vote.is_correct_price = False
+        vote.save()
+        self.price.refresh_from_db()
+        self.assertEqual((self.price.upvotes, self.price.downvotes), (0, 1))
+        
+        vote.delete()
+        self.price.refresh_from_db()
+        self.assertEqual((self.price.upvotes, self.price.downvotes), (0, 0))
+    
+    def test_queryset_delete_updates_counters(self):
+        """Test that bulk vote deletes (e.g. the admin's) take the votes back out of the counters"""
+        for i, correct in enumerate([True, True, False]):
+            Vote.objects.create(price=self.price, is_correct_price=correct, ip_address=f"10.0.0.{i}")
+        
+        Vote.objects.filter(ip_address__in=["10.0.0.0", "10.0.0.2"]).delete()
+        self.price.refresh_from_db()
+        self.assertEqual((self.price.upvotes, self.price.downvotes), (1, 0))
+        out = StringIO()
+        call_command('reconcile_vote_counts', '--dry-run', stdout=out)
+        self.assertIn("0 would be fixed", out.getvalue())
+        
+        Vote.objects.all().delete_keeping_counts()
+        self.price.refresh_from_db()
+        self.assertEqual((self.price.upvotes, self.price.downvotes), (1, 0))
+    
+    def test_price_save_does_not_overwrite_counters(self):
+        """Test that saving a stale Price instance keeps the stored counters"""
+        stale = Price.objects.get(id=self.price.id)
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        stale.price = Decimal("12.00")
+        stale.save()
+        self.price.refresh_from_db()
+        self.assertEqual(self.price.upvotes, 1)
+        self.assertEqual(self.price.price, Decimal("12.00"))
+    
+    def test_reconcile_vote_counts_command(self):
+        """Test that reconcile_vote_counts repairs drifted counters"""
+        Vote.objects.create(price=self.price, is_correct_price=True, ip_address="10.0.0.1")
+        Price.objects.filter(id=self.price.id).update(upvotes=7, downvotes=3)
+        
+        out = StringIO()
+        call_command('reconcile_vote_counts', '--dry-run', stdout=out)
+        self.price.refresh_from_db()
+        self.assertEqual(self.price.upvotes, 7)
+        self.assertIn("1 would be fixed", out.getvalue())
+        
+        call_command('reconcile_vote_counts', stdout=StringIO())
+        self.price.refresh_from_db()
+        self.assertEqual((self.price.upvotes, self.price.downvotes), (1, 0))
+
+
 class ModelRelationshipTests(TestCase):
     """Test relationships between models"""
     
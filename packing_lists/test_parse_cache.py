@@ -0,0 +1,110 @@
+import hashlib
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ParsedUpload
+from .parse_cache import evict, parse_upload, upload_hash
+from .parsers import parse_csv
+
+CSV_DATA = b"Item Name,Quantity\nBoots,1\nSocks,6"
+
+
+class ParseCacheUploadTests(TestCase):
+    """Test that repeat uploads are served from the parse cache"""
+
+    def upload(self, data=CSV_DATA, name="list.csv"):
+        return self.client.post(reverse('upload_packing_list'), {'file': SimpleUploadedFile(name, data)})
+
+    def test_upload_is_hashed_while_streaming(self):
+        """The upload handler's digest is what keys the cache"""
+        response = self.upload()
+
+        self.assertEqual(response.status_code, 302)
+        entry = ParsedUpload.objects.get()
+        self.assertEqual(entry.content_hash, hashlib.sha256(CSV_DATA).hexdigest())
+        self.assertEqual(entry.parser, 'parse_csv')
+        self.assertEqual([item['item_name'] for item in entry.items], ['Boots', 'Socks'])
+
+    def test_repeat_upload_skips_parsing(self):
+        """The same bytes under another name reach the configure step without parsing"""
+        self.upload()
+        parser = mock.Mock(__name__='parse_csv', side_effect=AssertionError("parsed again"))
+        with mock.patch('packing_lists.views.parser_for', return_value=parser):
+            response = self.upload(name="copy.csv")
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/list/upload/configure/', response.url)
+        session_key_items = response.url.split('/')[-2]
+        self.assertEqual([item['quantity'] for item in self.client.session[session_key_items]], [1, 6])
+        self.assertEqual(ParsedUpload.objects.get().hits, 1)
+
+    def test_failed_parse_is_not_cached(self):
+        """Errors are returned as usual and retried on the next upload"""
+        response = self.upload(b"Color,Size\nRed,L")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ParsedUpload.objects.exists())
+
+    @override_settings(PARSE_CACHE={'ENABLED': False})
+    def test_disabled_cache(self):
+        self.upload()
+        self.assertFalse(ParsedUpload.objects.exists())
+
+
+class ParseCacheTests(TestCase):
+    """Test hashing fallback and LRU eviction"""
+
+    def test_upload_hash_without_handler(self):
+        """Files that didn't stream through the handler are hashed on demand"""
+        request = RequestFactory().get('/')
+        file = SimpleUploadedFile("list.csv", CSV_DATA)
+
+        self.assertEqual(upload_hash(request, 'file', file), hashlib.sha256(CSV_DATA).hexdigest())
+        self.assertEqual(file.read(), CSV_DATA)  # Rewound for the parser
+
+    def test_parse_upload_caches_per_parser(self):
+        request = RequestFactory().get('/')
+        items, error = parse_upload(request, SimpleUploadedFile("list.csv", CSV_DATA), parse_csv)
+
+        self.assertIsNone(error)
+        self.assertEqual(len(items), 2)
+        other = mock.Mock(__name__='parse_excel', return_value=([{'item_name': 'X', 'quantity': 1, 'notes': ''}], None))
+        items, _ = parse_upload(request, SimpleUploadedFile("list.xlsx", CSV_DATA), other)
+
+        other.assert_called_once()
+        self.assertEqual(items[0]['item_name'], 'X')
+        self.assertEqual(ParsedUpload.objects.count(), 2)
+
+    def test_evicts_least_recently_used(self):
+        now = timezone.now()
+        for age in range(5):
+            ParsedUpload.objects.create(
+                content_hash=f"{age:064d}", parser='parse_csv', items=[], last_used_at=now - timedelta(hours=age)
+            )
+
+        self.assertEqual(evict(3), 2)
+        self.assertEqual(
+            sorted(ParsedUpload.objects.values_list('content_hash', flat=True)),
+            [f"{age:064d}" for age in range(3)],
+        )
+        self.assertEqual(evict(3), 0)
+
+    @override_settings(PARSE_CACHE={'MAX_ENTRIES': 2})
+    def test_store_keeps_recently_hit_entries(self):
+        """A hit protects an old entry from eviction"""
+        request = RequestFactory().get('/')
+        files = [f"Item Name\nItem {n}".encode() for n in range(3)]
+        parse_upload(request, SimpleUploadedFile("a.csv", files[0]), parse_csv)
+        parse_upload(request, SimpleUploadedFile("b.csv", files[1]), parse_csv)
+        parse_upload(request, SimpleUploadedFile("a.csv", files[0]), parse_csv)  # Hit
+        parse_upload(request, SimpleUploadedFile("c.csv", files[2]), parse_csv)
+
+        self.assertEqual(
+            set(ParsedUpload.objects.values_list('content_hash', flat=True)),
+            {hashlib.sha256(files[0]).hexdigest(), hashlib.sha256(files[2]).hexdigest()},
+        )
@@ -1,9 +1,41 @@
+from django.conf import settings
 from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
 import pandas as pd
 import io
+import os
+import subprocess
+import sys
+from unittest import mock
 
-from .parsers import parse_csv, parse_excel, parse_pdf, parse_text
+from . import parsers
+from .parsers import ParseError, iter_csv, parse_csv, parse_excel, parse_pdf, parse_text, parser_for
+
+
+def make_pdf(pages):
+    """A minimal PDF with one Helvetica text page per list of lines in `pages`"""
+    objects = [None, b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        ops = b"BT /F1 12 Tf 14 TL 72 720 Td " + b" ".join(b"(%s) Tj T*" % line.encode() for line in lines) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(ops), ops))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects) - 1)
+        )
+        kids.append(b"%d 0 R" % (len(objects) - 1))
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects[1:], 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % len(objects)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects), xref)
+    return bytes(out)
 
 
 class CSVParserTests(TestCase):
@@ -119,6 +151,30 @@ class CSVParserTests(TestCase):
         self.assertEqual(len(items), 2)
         self.assertEqual(items[0]['item_name'], 'T-shirt')
         self.assertEqual(items[0]['notes'], 'Blå')
+    
+    def test_parse_csv_uploaded_file(self):
+        """Test parsing an uploaded (binary) file without reading it up front"""
+        upload = SimpleUploadedFile("list.csv", "Item Name,Quantity\nBlå sokker,2\nPants,1".encode('utf-8'))
+        items, error = parse_csv(upload)
+        
+        self.assertIsNone(error)
+        self.assertEqual([i['item_name'] for i in items], ['Blå sokker', 'Pants'])
+        self.assertFalse(upload.closed)
+    
+    def test_iter_csv_is_lazy(self):
+        """Test that rows are decoded and yielded one at a time"""
+        source = io.BytesIO(b"Item,Qty\n" + b"".join(b"Item %d,1\n" % i for i in range(10000)))
+        rows = iter_csv(source)
+        self.assertEqual(next(rows)['item_name'], 'Item 0')
+        self.assertLess(source.tell(), len(source.getvalue()))
+        self.assertEqual(sum(1 for _ in rows), 9999)
+    
+    def test_iter_csv_header_errors(self):
+        """Test that header problems raise ParseError on first read"""
+        with self.assertRaisesMessage(ParseError, "CSV is empty"):
+            next(iter_csv(io.BytesIO(b"")))
+        with self.assertRaisesMessage(ParseError, "item name column"):
+            next(iter_csv(io.StringIO("Qty,Notes\n1,x")))
 
 
 class ExcelParserTests(TestCase):
@@ -267,6 +323,50 @@ class ExcelParserTests(TestCase):
         self.assertEqual(len(items), 2)
         self.assertEqual(items[0]['quantity'], 2)  # Converted to int
         self.assertEqual(items[1]['quantity'], 1)  # Converted to int
+    
+    def test_parse_excel_header_only(self):
+        """Test that a sheet with headers but no rows counts as empty"""
+        excel_file_io = io.BytesIO()
+        pd.DataFrame(columns=['Item Name', 'Quantity']).to_excel(excel_file_io, index=False)
+        items, error = parse_excel(SimpleUploadedFile("test.xlsx", excel_file_io.getvalue()))
+        
+        self.assertEqual(items, [])
+        self.assertIn("Excel sheet is empty", error)
+    
+    def test_parse_excel_sniffs_xlsx_content(self):
+        """Test that an .xlsx is streamed whatever its file name says"""
+        excel_file_io = io.BytesIO()
+        pd.DataFrame({'Item': ['Boots'], 'Qty': [2]}).to_excel(excel_file_io, index=False)
+        with mock.patch.object(pd, 'read_excel') as read_excel:
+            items, error = parse_excel(SimpleUploadedFile("legacy.xls", excel_file_io.getvalue()))
+        
+        read_excel.assert_not_called()
+        self.assertIsNone(error)
+        self.assertEqual(items, [{'item_name': 'Boots', 'quantity': 2, 'notes': ''}])
+    
+    def test_parse_xls_through_pandas(self):
+        """Test the pandas fallback for non-zip (.xls) workbooks"""
+        df = pd.DataFrame({
+            'Item Name': ['Boots', None, '  ', 'Socks', 'Gloves'],
+            'Quantity': [2.7, 1, 1, 'many', float('inf')],
+            'Notes': ['Tan', 'x', 'y', float('nan'), ' Black '],
+        })
+        with mock.patch.object(pd, 'read_excel', return_value=df):
+            items, error = parse_excel(SimpleUploadedFile("old.xls", b"\xd0\xcf\x11\xe0legacy"))
+        
+        self.assertIsNone(error)
+        self.assertEqual(items, [
+            {'item_name': 'Boots', 'quantity': 2, 'notes': 'Tan'},
+            {'item_name': 'Socks', 'quantity': 1, 'notes': ''},
+            {'item_name': 'Gloves', 'quantity': 1, 'notes': 'Black'},
+        ])
+    
+    def test_parse_excel_unreadable(self):
+        """Test that a corrupt workbook reports a read error"""
+        items, error = parse_excel(SimpleUploadedFile("broken.xlsx", b"PK\x03\x04 not really a zip"))
+        
+        self.assertEqual(items, [])
+        self.assertIn("Error reading Excel file", error)
 
 
 class PDFParserTests(TestCase):
@@ -339,6 +439,59 @@ class PDFParserTests(TestCase):
         # Should handle the error gracefully
         self.assertIsNotNone(error)
         self.assertEqual(len(items), 0)
+    
+    def test_parse_pdf_pages_in_order(self):
+        """Test that the text of every page is parsed, in page order"""
+        pdf_file = SimpleUploadedFile("list.pdf", make_pdf([["Boots, 2"], ["Socks, 6, Wool", "Cap"]]))
+        items, error = parse_pdf(pdf_file)
+        
+        self.assertIsNone(error)
+        self.assertEqual(
+            [(i['item_name'], i['quantity'], i['notes']) for i in items],
+            [('Boots', 2, ''), ('Socks', 6, 'Wool'), ('Cap', 1, '')],
+        )
+    
+    def test_parse_pdf_parallel_extraction(self):
+        """Test that large PDFs go through the worker pool and keep page order"""
+        pages = [[f"Item {n}, {n}"] for n in range(1, 7)]
+        pdf_file = SimpleUploadedFile("list.pdf", make_pdf(pages))
+        with mock.patch.object(parsers, 'PDF_PARALLEL_MIN_PAGES', 2), mock.patch.object(parsers, 'PDF_WORKERS', 2):
+            items, error = parse_pdf(pdf_file)
+        
+        self.assertIsNone(error)
+        self.assertEqual([i['item_name'] for i in items], [f"Item {n}" for n in range(1, 7)])
+        self.assertEqual([i['quantity'] for i in items], list(range(1, 7)))
+    
+    def test_parse_pdf_total_timeout(self):
+        """Test that both extraction paths stop at the whole-document deadline"""
+        pages = [[f"Item {n}, {n}"] for n in range(1, 4)]
+        for min_pages in (2, 8):
+            with self.subTest(parallel=min_pages == 2):
+                pdf_file = SimpleUploadedFile("list.pdf", make_pdf(pages))
+                with mock.patch.object(parsers, 'PDF_TOTAL_TIMEOUT', 0), \
+                        mock.patch.object(parsers, 'PDF_PARALLEL_MIN_PAGES', min_pages), \
+                        mock.patch.object(parsers, 'PDF_WORKERS', 2):
+                    items, error = parse_pdf(pdf_file)
+        
+                self.assertEqual(items, [])
+                self.assertEqual(error, "Error parsing PDF file: timed out reading page 1.")
+    
+    def test_parse_pdf_page_limit(self):
+        """Test that PDFs over PDF_MAX_PAGES are rejected before any extraction"""
+        pdf_file = SimpleUploadedFile("list.pdf", make_pdf([["A"], ["B"], ["C"]]))
+        with mock.patch.object(parsers, 'PDF_MAX_PAGES', 2):
+            items, error = parse_pdf(pdf_file)
+        
+        self.assertEqual(items, [])
+        self.assertIn("at most 2", error)
+    
+    def test_parse_pdf_without_text(self):
+        """Test that a PDF with only blank pages reports that no text was found"""
+        pdf_file = SimpleUploadedFile("blank.pdf", make_pdf([[], []]))
+        items, error = parse_pdf(pdf_file)
+        
+        self.assertEqual(items, [])
+        self.assertEqual(error, "No text could be extracted from the PDF.")
 
 
 class TextParserTests(TestCase):
@@ -360,6 +513,14 @@ class TextParserTests(TestCase):
         self.assertEqual(items[2]['item_name'], 'Keyboard')
         self.assertEqual(items[2]['quantity'], 1)
     
+    def test_parse_text_iterable_of_lines(self):
+        """Test that parse_text also takes lines one at a time, e.g. from a generator"""
+        items, error = parse_text(line for line in ["Tent, 1", "", "  Stakes, 8, Spare  "])
+        
+        self.assertIsNone(error)
+        self.assertEqual([(i['item_name'], i['quantity'], i['notes']) for i in items],
+                         [('Tent', 1, ''), ('Stakes', 8, 'Spare')])
+    
     def test_parse_text_only_item_name(self):
         """Test parsing text with only item names"""
         text_data = "Single Item Line\nAnother Item"
@@ -454,6 +615,31 @@ class TextParserTests(TestCase):
         self.assertEqual(items[2]['item_name'], 'Item 3')
 
 
+class FormatRegistryTests(TestCase):
+    """Test the format-handler registry and deferred library imports"""
+    
+    def test_parser_for(self):
+        """Test that parsers are found by extension, case-insensitively"""
+        self.assertIs(parser_for("list.CSV"), parse_csv)
+        self.assertIs(parser_for("list.xls"), parse_excel)
+        self.assertIs(parser_for("list.xlsx"), parse_excel)
+        self.assertIs(parser_for("list.pdf"), parse_pdf)
+        self.assertIsNone(parser_for("list.docx"))
+    
+    def test_importing_views_skips_heavy_libraries(self):
+        """Test that web workers don't import pandas, openpyxl or PyPDF2 at boot"""
+        code = (
+            "import sys, django; django.setup(); import packing_lists.views, packing_lists.api_views; "
+            "print(' '.join(m for m in ('pandas', 'openpyxl', 'PyPDF2') if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'community_packing_list.settings')},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+
 class ParserEdgeCaseTests(TestCase):
     """Test edge cases and error conditions in parsers"""
     
@@ -0,0 +1,210 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+from django.core.exceptions import ImproperlyConfigured
+
+from django.core.management import call_command
+from io import StringIO
+
+from .models import PackingList, Item, PackingListItem, Price, Store, ItemPriceStats, Vote
+from .pricing import ranked_prices_by_item
+from . import ranking
+
+
+class RankingEngineTests(TestCase):
+    """Test the vectorized ranking functions"""
+    
+    def test_score_prices_matches_formula(self):
+        """Test the smart score for a single price row"""
+        confidence, score = ranking.score_prices([10.0], [3], [1])
+        self.assertAlmostEqual(confidence[0], 0.5)
+        self.assertAlmostEqual(score[0], 0.7 * (1 - 10.0 / 50.0) + 0.3 * 0.75)
+    
+    def test_no_votes_is_neutral(self):
+        """Test that prices without votes get zero confidence"""
+        confidence, _ = ranking.score_prices([5.0, 5.0], [0, 0], [0, 0])
+        self.assertEqual(confidence.tolist(), [0.0, 0.0])
+    
+    @override_settings(PRICE_RANKING={'PRICE_WEIGHT': 0.0, 'VOTE_WEIGHT': 1.0})
+    def test_weights_from_settings(self):
+        """Test that configured weights change the order"""
+        ppu = [5.0, 50.0]
+        _, score = ranking.score_prices(ppu, [0, 10], [5, 0])
+        order = ranking.rank_order([1, 1], ppu, score)
+        self.assertEqual(order.tolist(), [1, 0])
+    
+    def test_rank_order_groups_items(self):
+        """Test that rows are grouped by item, best score first, cheaper wins ties"""
+        ppu = [20.0, 10.0, 30.0, 10.0]
+        _, score = ranking.score_prices(ppu, [0, 0, 0, 0], [0, 0, 0, 0])
+        order = ranking.rank_order([2, 1, 2, 1], ppu, score)
+        self.assertEqual(order.tolist()[:2], [1, 3])
+        self.assertEqual(order.tolist()[2:], [0, 2])
+
+
+class SharedRankingTests(TestCase):
+    """Test that the HTML page and the API rank prices the same way"""
+    
+    def setUp(self):
+        self.packing_list = PackingList.objects.create(name="Ranked List")
+        self.item = Item.objects.create(name="Boots")
+        PackingListItem.objects.create(packing_list=self.packing_list, item=self.item)
+        cheap = Store.objects.create(name="Cheap Store")
+        trusted = Store.objects.create(name="Trusted Store")
+        self.cheap_price = Price.objects.create(item=self.item, store=cheap, price=Decimal("30.00"))
+        self.trusted_price = Price.objects.create(item=self.item, store=trusted, price=Decimal("35.00"))
+        Price.adjust_vote_counts(self.cheap_price.id, downvotes=4)
+        Price.adjust_vote_counts(self.trusted_price.id, upvotes=4)
+    
+    def test_html_and_api_agree(self):
+        """Test that both endpoints put the same price first"""
+        response = self.client.get(reverse('view_packing_list', args=[self.packing_list.id]))
+        html_order = [row['price'].id for row in response.context['items_with_prices'][0]['prices_with_votes']]
+        
+        response = APIClient().get(f"/api/packing-lists/{self.packing_list.id}/detail_view/")
+        api_rows = response.data['items_with_prices'][0]['prices_with_votes']
+        api_order = [row['price']['id'] for row in api_rows]
+        
+        self.assertEqual(html_order, [self.trusted_price.id, self.cheap_price.id])
+        self.assertEqual(api_order, html_order)
+        self.assertIn('smart_score', api_rows[0])
+
+
+class ItemPriceStatsTests(TestCase):
+    """Test per-item price statistics and the normalization they feed"""
+    
+    def setUp(self):
+        self.store = Store.objects.create(name="Store")
+        self.socks = Item.objects.create(name="Socks")
+        self.rucksack = Item.objects.create(name="Rucksack")
+    
+    def test_stats_follow_price_saves_and_deletes(self):
+        """Test that saving and deleting prices refreshes the item's stats"""
+        Price.objects.create(item=self.socks, store=self.store, price=Decimal("2.00"))
+        Price.objects.create(item=self.socks, store=self.store, price=Decimal("4.00"))
+        last = Price.objects.create(item=self.socks, store=self.store, price=Decimal("12.00"), quantity=2)
+        
+        stats = ItemPriceStats.objects.get(item=self.socks)
+        self.assertEqual(stats.price_count, 3)
+        self.assertEqual(stats.min_price, 2.0)
+        self.assertEqual(stats.median_price, 4.0)
+        self.assertEqual(stats.p25_price, 3.0)
+        self.assertEqual(stats.p75_price, 5.0)
+        
+        last.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.price_count, 2)
+        self.assertEqual(stats.median_price, 3.0)
+        
+        Price.objects.filter(item=self.socks).first().delete()
+        Price.objects.filter(item=self.socks).first().delete()
+        self.assertFalse(ItemPriceStats.objects.filter(item=self.socks).exists())
+    
+    def test_stats_follow_bulk_and_cascade_deletes(self):
+        """Test that queryset deletes and deleting a store refresh the stats"""
+        other_store = Store.objects.create(name="Other")
+        Price.objects.create(item=self.socks, store=self.store, price=Decimal("2.00"))
+        Price.objects.create(item=self.socks, store=other_store, price=Decimal("4.00"))
+        Price.objects.create(item=self.socks, store=other_store, price=Decimal("6.00"))
+        
+        other_store.delete()
+        stats = ItemPriceStats.objects.get(item=self.socks)
+        self.assertEqual((stats.price_count, stats.median_price), (1, 2.0))
+        
+        Price.objects.filter(item=self.socks).delete()
+        self.assertFalse(ItemPriceStats.objects.filter(item=self.socks).exists())
+    
+    def test_scores_are_normalized_per_item(self):
+        """Test that a cheap-for-its-kind rucksack scores like cheap-for-their-kind socks"""
+        packing_list = PackingList.objects.create(name="List")
+        for item, prices in ((self.socks, ("3.00", "4.00", "5.00")), (self.rucksack, ("300.00", "400.00", "500.00"))):
+            PackingListItem.objects.create(packing_list=packing_list, item=item)
+            for price in prices:
+                Price.objects.create(item=item, store=self.store, price=Decimal(price))
+        
+        ranked = ranked_prices_by_item(packing_list)
+        best_socks = ranked[self.socks.id][0]
+        best_rucksack = ranked[self.rucksack.id][0]
+        self.assertEqual(best_rucksack['price_per_unit'], 300.0)
+        self.assertAlmostEqual(best_socks['smart_score'], best_rucksack['smart_score'])
+        self.assertGreater(best_rucksack['smart_score'], 0)
+    
+    def test_rebuild_price_stats_command(self):
+        """Test that the batch command rebuilds missing and removes stale rows"""
+        Price.objects.create(item=self.socks, store=self.store, price=Decimal("2.00"))
+        Price.objects.create(item=self.socks, store=self.store, price=Decimal("6.00"))
+        ItemPriceStats.objects.all().delete()
+        ItemPriceStats.objects.create(
+            item=self.rucksack, price_count=1, min_price=1, p25_price=1, median_price=1, p75_price=1
+        )
+        
+        call_command('rebuild_price_stats', stdout=StringIO())
+        
+        stats = ItemPriceStats.objects.get(item=self.socks)
+        self.assertEqual(stats.price_count, 2)
+        self.assertEqual(stats.median_price, 4.0)
+        self.assertFalse(ItemPriceStats.objects.filter(item=self.rucksack).exists())
+
+
+
+class DecayedConfidenceTests(TestCase):
+    """Test time-decayed vote confidence"""
+    
+    def setUp(self):
+        self.packing_list = PackingList.objects.create(name="Decay List")
+        self.item = Item.objects.create(name="Gloves")
+        PackingListItem.objects.create(packing_list=self.packing_list, item=self.item)
+        self.old_price = Price.objects.create(item=self.item, store=Store.objects.create(name="Old Favourite"), price=Decimal("20.00"))
+        self.new_price = Price.objects.create(item=self.item, store=Store.objects.create(name="New Store"), price=Decimal("20.00"))
+    
+    def test_weights_halve_every_half_life(self):
+        """Test that a vote counts 1 when cast and 0.5 one half-life later"""
+        now = timezone.now()
+        weight = ranking.vote_weight(now)
+        self.assertAlmostEqual(weight * ranking.decay_factor(now), 1.0)
+        later = now + timedelta(days=ranking.ranking_weights()['VOTE_HALF_LIFE_DAYS'])
+        self.assertAlmostEqual(weight * ranking.decay_factor(later), 0.5)
+    
+    def test_old_votes_fade(self):
+        """Test that many old upvotes lose to one fresh upvote"""
+        Price.adjust_vote_counts(self.old_price.id, upvotes=3, cast_at=timezone.now() - timedelta(days=730))
+        Price.adjust_vote_counts(self.new_price.id, upvotes=1)
+        rows = ranked_prices_by_item(self.packing_list)[self.item.id]
+        self.assertEqual(rows[0]['price'].id, self.new_price.id)
+        self.assertAlmostEqual(rows[0]['vote_confidence'], 1.0, places=6)
+        self.assertLess(rows[1]['vote_confidence'], 0.25)  # 3 votes, four half-lives old
+        self.assertEqual(rows[1]['upvotes'], 3)  # Plain totals are still reported
+        
+        # The database ranking decays votes the same way
+        top = APIClient().get(f"/api/packing-lists/{self.packing_list.id}/detail_view/", {'max_prices': 1})
+        self.assertEqual(top.data['items_with_prices'][0]['prices_with_votes'][0]['price']['id'], self.new_price.id)
+    
+    def test_half_life_too_short_is_rejected(self):
+        """Test that a half-life short enough to overflow the stored weights is refused"""
+        for half_life in (1, 0, -5):
+            with self.subTest(half_life), override_settings(PRICE_RANKING={'VOTE_HALF_LIFE_DAYS': half_life}):
+                with self.assertRaises(ImproperlyConfigured):
+                    ranking.vote_weight(timezone.now())
+    
+    def test_ranking_key_changes_daily(self):
+        """Test that cached rankings are keyed on the day they were computed"""
+        now = timezone.now()
+        key = ranking.ranking_key(now)
+        self.assertEqual(ranking.ranking_key(now), key)
+        self.assertNotEqual(ranking.ranking_key(now + timedelta(days=1)), key)
+        with override_settings(PRICE_RANKING={'VOTE_HALF_LIFE_DAYS': 30}):
+            self.assertNotEqual(ranking.ranking_key(now), key)
+    
+    @override_settings(PRICE_RANKING={'VOTE_HALF_LIFE_DAYS': 30})
+    def test_reconcile_rebuilds_decayed_counters(self):
+        """Test that reconcile_vote_counts recomputes decayed weights, e.g. after a half-life change"""
+        Vote.objects.create(price=self.old_price, is_correct_price=True, ip_address="10.0.0.1",
+                            created_at=timezone.now() - timedelta(days=60))
+        expected = ranking.vote_weight(Vote.objects.get().created_at)
+        Price.objects.filter(id=self.old_price.id).update(decayed_upvotes=0)
+        call_command('reconcile_vote_counts', stdout=StringIO())
+        self.old_price.refresh_from_db()
+        self.assertAlmostEqual(self.old_price.decayed_upvotes, expected)
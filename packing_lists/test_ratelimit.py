@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from decimal import Decimal
+
+from .models import Item, Price, Store, Vote
+from .ratelimit import consume, parse_rate
+
+TIGHT_LIMITS = {
+    'ENABLED': True,
+    'votes': {'RATE': '60/min', 'BURST': 2},
+    'prices': {'RATE': '60/min', 'BURST': 2},
+    'stores': {'RATE': '60/min', 'BURST': 2},
+}
+
+
+@override_settings(RATE_LIMITS=TIGHT_LIMITS)
+class TokenBucketTests(TestCase):
+    """Test the cache-backed token bucket"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        """Test rate strings are converted to tokens per second"""
+        self.assertEqual(parse_rate('60/min'), 1.0)
+        self.assertEqual(parse_rate('10/s'), 10.0)
+        with self.assertRaises(ValueError):
+            parse_rate('often')
+
+    def test_burst_then_refill(self):
+        """Test that a bucket allows its burst and refills over time"""
+        self.assertEqual(consume('votes', '1.2.3.4', now=100.0), 0)
+        self.assertEqual(consume('votes', '1.2.3.4', now=100.0), 0)
+        self.assertAlmostEqual(consume('votes', '1.2.3.4', now=100.0), 1.0)
+        self.assertEqual(consume('votes', '1.2.3.4', now=101.0), 0)
+
+    def test_buckets_are_per_ip_and_scope(self):
+        """Test that clients and endpoint classes don't share tokens"""
+        for _ in range(2):
+            consume('votes', '1.2.3.4', now=100.0)
+        self.assertTrue(consume('votes', '1.2.3.4', now=100.0))
+        self.assertEqual(consume('votes', '5.6.7.8', now=100.0), 0)
+        self.assertEqual(consume('prices', '1.2.3.4', now=100.0), 0)
+
+    @override_settings(RATE_LIMITS={**TIGHT_LIMITS, 'ENABLED': False})
+    def test_disabled(self):
+        """Test that limits can be switched off"""
+        for _ in range(5):
+            self.assertEqual(consume('votes', '1.2.3.4', now=100.0), 0)
+
+
+@override_settings(RATE_LIMITS=TIGHT_LIMITS)
+class RateLimitedEndpointTests(TestCase):
+    """Test that write endpoints answer 429 once the bucket is empty"""
+
+    def setUp(self):
+        cache.clear()
+        self.price = Price.objects.create(
+            item=Item.objects.create(name="Boots"),
+            store=Store.objects.create(name="Store"),
+            price=Decimal("90.00"),
+        )
+
+    def test_vote_api(self):
+        """Test that the vote API is throttled with a Retry-After"""
+        client = APIClient()
+        data = {'price_id': self.price.id, 'upvote_price_id': self.price.id}
+        statuses = [client.post('/api/votes/', data).status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+        response = client.post('/api/votes/', data)
+        self.assertIn('Retry-After', response)
+
+    def test_reads_are_not_limited(self):
+        """Test that GETs never spend tokens"""
+        client = APIClient()
+        for _ in range(5):
+            self.assertEqual(client.get('/api/prices/').status_code, 200)
+
+    def test_vote_form(self):
+        """Test that the HTML vote form shares the votes bucket"""
+        for _ in range(2):
+            self.assertEqual(self.client.post('/vote/', {'upvote_price_id': self.price.id}).status_code, 302)
+        response = self.client.post('/vote/', {'upvote_price_id': self.price.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(APIClient().post('/api/votes/', {'price_id': self.price.id}).status_code, 429)
+
+    def test_store_modal_returns_json(self):
+        """Test that AJAX callers get a JSON 429"""
+        for _ in range(2):
+            self.client.post('/stores/add/modal/', {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = self.client.post('/stores/add/modal/', {}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.json()['success'])
+
+    def test_spoofed_forwarded_for_shares_the_bucket(self):
+        """A client rotating X-Forwarded-For doesn't get a fresh bucket"""
+        client = APIClient()
+        data = {'price_id': self.price.id, 'upvote_price_id': self.price.id}
+        statuses = [
+            client.post('/api/votes/', data, HTTP_X_FORWARDED_FOR=f"203.0.113.{n}").status_code
+            for n in range(3)
+        ]
+        self.assertEqual(statuses, [201, 201, 429])
+        # ...nor a second vote on the same price
+        self.price.refresh_from_db()
+        self.assertEqual(self.price.upvotes, 1)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1})
+    def test_trusted_proxy_forwarded_for(self):
+        """Behind one proxy, only the address that proxy appended is used"""
+        client = APIClient()
+        data = {'price_id': self.price.id, 'upvote_price_id': self.price.id}
+        for n in range(2):
+            client.post('/api/votes/', data, HTTP_X_FORWARDED_FOR=f"203.0.113.{n}, 198.51.100.7")
+        response = client.post('/api/votes/', data, HTTP_X_FORWARDED_FOR="198.51.100.7")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(
+            client.post('/api/votes/', data, HTTP_X_FORWARDED_FOR="203.0.113.1, 198.51.100.8").status_code, 201
+        )
+        self.assertEqual(Vote.objects.get(ip_address="198.51.100.8").price, self.price)
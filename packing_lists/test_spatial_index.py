@@ -0,0 +1,137 @@
+import random
+
+from django.db.models import F
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .geo import haversine_km
+from .models import Store, StoreIndexVersion
+from .spatial_index import SphereKDTree, nearest_store_objects, nearest_stores
+
+
+class SphereKDTreeTests(TestCase):
+    """Test the KD-tree against a brute-force haversine scan"""
+    
+    def setUp(self):
+        rng = random.Random(42)
+        self.points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+        # A dense cluster so leaves get split on close points too
+        self.points += [(35.1 + rng.uniform(-0.5, 0.5), -79.0 + rng.uniform(-0.5, 0.5)) for _ in range(100)]
+        self.ids = list(range(1, len(self.points) + 1))
+        lats, lons = zip(*self.points)
+        self.tree = SphereKDTree(self.ids, lats, lons, leaf_size=8)
+        self.queries = [(35.14, -79.0), (0.0, 179.9), (89.9, 10.0), (-45.0, -60.0)]
+    
+    def brute_force(self, lat, lon):
+        return sorted((haversine_km(lat, lon, p_lat, p_lon), pid) for pid, (p_lat, p_lon) in zip(self.ids, self.points))
+    
+    def test_nearest_matches_brute_force(self):
+        """Test that k-nearest agrees with scanning every point"""
+        for lat, lon in self.queries:
+            expected = self.brute_force(lat, lon)[:10]
+            ids, distances = self.tree.nearest(lat, lon, 10)
+            self.assertEqual(ids.tolist(), [pid for _, pid in expected])
+            for got, (want, _) in zip(distances, expected):
+                self.assertAlmostEqual(got, want, places=6)
+    
+    def test_within_matches_brute_force(self):
+        """Test that radius queries find exactly the points inside the radius"""
+        for lat, lon in self.queries:
+            for radius in (50, 1000, 5000):
+                expected = [pid for km, pid in self.brute_force(lat, lon) if km <= radius]
+                ids, distances = self.tree.within(lat, lon, radius)
+                self.assertEqual(ids.tolist(), expected)
+                self.assertTrue(all(d <= radius + 1e-6 for d in distances))
+    
+    def test_empty_and_oversized(self):
+        """Test that an empty tree and k larger than the tree behave"""
+        empty = SphereKDTree([], [], [])
+        self.assertEqual(len(empty.nearest(0, 0, 5)[0]), 0)
+        self.assertEqual(len(empty.within(0, 0, 100)[0]), 0)
+        self.assertEqual(len(self.tree.nearest(0, 0, 10000)[0]), len(self.points))
+
+
+class StoreIndexTests(TestCase):
+    """Test the store index built from the database"""
+    
+    def setUp(self):
+        self.bragg = Store.objects.create(name="Fort Bragg PX", latitude=35.1390, longitude=-79.0060)
+        self.fayetteville = Store.objects.create(name="Fayetteville", latitude=35.0527, longitude=-78.8784)
+        self.raleigh = Store.objects.create(name="Raleigh", latitude=35.7796, longitude=-78.6382)
+        Store.objects.create(name="Online Only", is_online=True)
+    
+    def test_nearest_and_radius(self):
+        """Test k-nearest and radius lookups over stores with coordinates"""
+        hits = nearest_stores(35.1390, -79.0060, k=2)
+        self.assertEqual([store_id for store_id, _ in hits], [self.bragg.id, self.fayetteville.id])
+        self.assertAlmostEqual(hits[0][1], 0.0, places=6)
+        nearby = nearest_stores(35.1390, -79.0060, radius_km=20)
+        self.assertEqual([store_id for store_id, _ in nearby], [self.bragg.id, self.fayetteville.id])
+        self.assertEqual(len(nearest_stores(35.1390, -79.0060)), 3)
+    
+    def test_rebuilt_after_store_changes(self):
+        """Test that saves and deletes are picked up by the next query"""
+        nearest_stores(0, 0, k=1)
+        nearer = Store.objects.create(name="New PX", latitude=35.1400, longitude=-79.0050)
+        self.assertEqual(nearest_stores(35.1400, -79.0050, k=1)[0][0], nearer.id)
+        nearer.latitude, nearer.longitude = 10.0, 10.0
+        nearer.save()
+        self.assertEqual(nearest_stores(35.1400, -79.0050, k=1)[0][0], self.bragg.id)
+        self.bragg.delete()
+        self.assertNotIn(self.bragg.id, [store_id for store_id, _ in nearest_stores(35.14, -79.0, radius_km=50)])
+    
+    def test_changes_from_other_workers(self):
+        """Test that the version check needs no shared cache and sees signal-less writes"""
+        nearest_stores(0, 0, k=1)
+        with self.assertNumQueries(1):
+            nearest_stores(0, 0, k=1)  # Unchanged: the version check only
+
+        # Another worker saved a store: only the committed counter moved
+        moved = Store.objects.filter(pk=self.raleigh.pk)
+        moved.update(latitude=35.1395, longitude=-79.0055)
+        # (a bare update() sends no signal, so the index isn't rebuilt yet)
+        self.assertEqual(nearest_stores(35.1395, -79.0055, k=1)[0][0], self.bragg.id)
+        StoreIndexVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        self.assertEqual(nearest_stores(35.1395, -79.0055, k=1)[0][0], self.raleigh.id)
+
+        # bulk_create sends no signals but raises the highest store id
+        added = Store.objects.bulk_create([Store(name="Bulk PX", latitude=1.0, longitude=1.0)])
+        self.assertEqual(nearest_stores(1.0, 1.0, k=1)[0][0], added[0].id)
+
+    def test_store_objects(self):
+        """Test that Store objects come back in order with distances, from one query"""
+        nearest_stores(0, 0, k=1)  # Build outside the counted block
+        with self.assertNumQueries(2):  # Version check, stores
+            stores = nearest_store_objects(35.1390, -79.0060, k=3)
+        self.assertEqual([s.name for s in stores], ["Fort Bragg PX", "Fayetteville", "Raleigh"])
+        self.assertAlmostEqual(stores[2].distance, haversine_km(35.1390, -79.0060, 35.7796, -78.6382), places=6)
+
+
+class NearestStoresAPITests(TestCase):
+    """Test GET /api/stores/nearest/"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.bragg = Store.objects.create(name="Fort Bragg PX", latitude=35.1390, longitude=-79.0060)
+        self.raleigh = Store.objects.create(name="Raleigh", latitude=35.7796, longitude=-78.6382)
+    
+    def test_nearest(self):
+        """Test that stores come back nearest first with distance_km"""
+        response = self.client.get('/api/stores/nearest/', {'lat': 35.14, 'lon': -79.0, 'k': 1})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['id'] for r in results], [self.bragg.id])
+        self.assertLess(results[0]['distance_km'], 1)
+    
+    def test_radius(self):
+        """Test that radius limits the results"""
+        response = self.client.get('/api/stores/nearest/', {'lat': 35.14, 'lon': -79.0, 'radius': 200})
+        self.assertEqual([r['name'] for r in response.json()['results']], ["Fort Bragg PX", "Raleigh"])
+        response = self.client.get('/api/stores/nearest/', {'lat': 35.14, 'lon': -79.0, 'radius': 10})
+        self.assertEqual([r['name'] for r in response.json()['results']], ["Fort Bragg PX"])
+    
+    def test_invalid_parameters(self):
+        """Test that bad coordinates, k and radius are rejected"""
+        for params in ({}, {'lat': 'x', 'lon': 0}, {'lat': 91, 'lon': 0}, {'lat': 0, 'lon': 0, 'k': 0},
+                       {'lat': 0, 'lon': 0, 'k': 1000}, {'lat': 0, 'lon': 0, 'radius': -1}):
+            self.assertEqual(self.client.get('/api/stores/nearest/', params).status_code, 400)
@@ -0,0 +1,91 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from . import store_distances
+from .geo import haversine_km
+from .models import Base, LocationStoreDistance, School, Store
+from .store_distances import stores_near
+
+SHORT_LISTS = 3
+
+
+class LocationStoreDistanceTests(TestCase):
+    """Test that the precomputed nearest-store lists stay exact"""
+    
+    def setUp(self):
+        patcher = mock.patch.object(store_distances, 'NEAREST_STORES_PER_LOCATION', SHORT_LISTS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.school = School.objects.create(name="Ranger School", latitude=34.5, longitude=-83.9)
+        self.base = Base.objects.create(name="Fort Bragg", latitude=35.139, longitude=-79.006)
+        for i in range(6):
+            Store.objects.create(name=f"Store {i}", latitude=34.5 + i * 0.1, longitude=-83.9 + i * 0.1)
+        Store.objects.create(name="Online Only", is_online=True)
+    
+    def assertListsExact(self):
+        """Every list holds exactly the nearest stores a full scan finds"""
+        located = Store.objects.filter(latitude__isnull=False)
+        for location in (self.school, self.base):
+            location.refresh_from_db()
+            expected = sorted(
+                located, key=lambda s: haversine_km(location.latitude, location.longitude, s.latitude, s.longitude)
+            )[:SHORT_LISTS]
+            self.assertEqual([s.name for s in stores_near(location)], [s.name for s in expected], str(location))
+    
+    def test_lists_built_on_create(self):
+        """Test that new stores and locations fill the lists"""
+        self.assertListsExact()
+        self.assertEqual(LocationStoreDistance.objects.filter(school=self.school).count(), SHORT_LISTS)
+    
+    def test_store_moves_in_and_out(self):
+        """Test that a moving store enters, leaves and refills lists"""
+        far = Store.objects.get(name="Store 5")
+        far.latitude, far.longitude = 35.14, -79.0
+        far.save()
+        self.assertListsExact()
+        far.latitude = far.longitude = None
+        far.save()
+        self.assertListsExact()
+    
+    def test_store_deleted(self):
+        """Test that deleting a listed store tops the list up again"""
+        Store.objects.get(name="Store 0").delete()
+        self.assertListsExact()
+    
+    def test_stores_bulk_deleted(self):
+        """Test that a queryset delete of several listed stores refills the list"""
+        Store.objects.filter(name__in=["Store 0", "Store 1"]).delete()
+        self.assertEqual([s.name for s in stores_near(self.school)], ["Store 2", "Store 3", "Store 4"])
+        self.assertListsExact()
+    
+    def test_location_moves(self):
+        """Test that a moved school gets its list recomputed"""
+        self.school.latitude, self.school.longitude = 35.1, -79.0
+        self.school.save()
+        self.assertListsExact()
+    
+    def test_unrelated_edit_skips_work(self):
+        """Test that saving a store without moving it doesn't touch the table"""
+        store = Store.objects.get(name="Store 0")
+        store.name = "Renamed"
+        with self.assertNumQueries(2):  # The save and the version bump
+            store.save()
+    
+    def test_rebuild_command(self):
+        """Test that the rebuild command recomputes from scratch"""
+        LocationStoreDistance.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_store_distances', stdout=out)
+        self.assertIn("2 schools and bases", out.getvalue())
+        self.assertListsExact()
+    
+    def test_store_list_reads_table(self):
+        """Test that the school filter of store_list is served from the table"""
+        response = self.client.get(reverse('store_list'), {'school_id': self.school.id, 'radius': 20})
+        names = [entry['store'].name for entry in response.context['stores']]
+        self.assertEqual(names, ["Store 0", "Store 1"])
+        self.assertAlmostEqual(response.context['stores'][1]['distance'], haversine_km(34.5, -83.9, 34.6, -83.8))
@@ -0,0 +1,20 @@
+"""Fixture helpers shared by the test modules"""
+from decimal import Decimal
+
+from .models import Item, PackingListItem, Price, Vote
+
+
+def add_items(packing_list, stores, count, votes=(True,)):
+    """
+    Adds `count` new items to `packing_list`, numbered on from its current
+    size, each priced at every store in `stores`. Every price gets one vote
+    per entry of `votes` (True for an upvote), each from its own IP.
+    """
+    start = packing_list.items.count()
+    for i in range(start, start + count):
+        item = Item.objects.create(name=f"Item {i}")
+        PackingListItem.objects.create(packing_list=packing_list, item=item)
+        for store in stores:
+            price = Price.objects.create(item=item, store=store, price=Decimal("10.00") + i)
+            for n, is_correct in enumerate(votes, 1):
+                Vote.objects.create(price=price, is_correct_price=is_correct, ip_address=f"10.0.0.{n}")
@@ -6,7 +6,11 @@ from django.db import IntegrityError
 from decimal import Decimal
 import json
 
+from . import store_distances
 from .models import School, Store, PackingList, Item, PackingListItem, Price, Vote
+from .spatial_index import invalidate_store_index
+from .test_utils import add_items
+from .views import STORES_PER_PAGE
 
 
 class HomeViewTests(TestCase):
@@ -251,6 +255,29 @@ class PackingListDetailViewTests(TestCase):
         self.assertIn("Item not found", str(messages[0]))
 
 
+class PackingListDetailQueryCountTests(TestCase):
+    """Test that the detail page query count does not grow with list size"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.packing_list = PackingList.objects.create(name="Big List")
+        self.stores = [Store.objects.create(name=f"Store {i}") for i in range(3)]
+    
+    def test_query_count_is_constant(self):
+        """Test that a 5 item list and a 25 item list cost the same number of queries"""
+        url = reverse('view_packing_list', args=[self.packing_list.id])
+        add_items(self.packing_list, self.stores, 5, votes=(True, False))
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        add_items(self.packing_list, self.stores, 20, votes=(True, False))
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['items_with_prices']), 25)
+        first_price = response.context['items_with_prices'][0]['prices_with_votes'][0]
+        self.assertEqual(first_price['upvotes'], 1)
+        self.assertEqual(first_price['downvotes'], 1)
+
+
 class AddPriceViewTests(TestCase):
     """Test the add price view functionality"""
     
@@ -435,6 +462,56 @@ class StoreListViewTests(TestCase):
         })
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Stores near your current location")
+    
+    def test_store_list_sorted_by_distance(self):
+        """Test that nearby stores come first with their distance in km"""
+        response = self.client.get(reverse('store_list'), {'school_id': self.school.id})
+        stores = response.context['stores']
+        self.assertEqual([entry['store'] for entry in stores], [self.store1, self.store2])
+        self.assertLess(stores[0]['distance'], 1.0)
+        self.assertAlmostEqual(stores[1]['distance'], 559.1, delta=1.0)
+    
+    def test_store_list_radius(self):
+        """Test that a radius keeps only the stores inside it"""
+        response = self.client.get(reverse('store_list'), {'school_id': self.school.id, 'radius': '50'})
+        self.assertEqual([entry['store'] for entry in response.context['stores']], [self.store1])
+        self.assertContains(response, "within 50 km")
+    
+    def test_store_list_invalid_radius(self):
+        """Test that a bad radius is ignored with a warning"""
+        response = self.client.get(reverse('store_list'), {'school_id': self.school.id, 'radius': '-3'})
+        self.assertEqual(len(response.context['stores']), 2)
+        self.assertIn("Invalid search radius", str(list(get_messages(response.wsgi_request))[0]))
+    
+    def test_store_list_pages_past_one_page(self):
+        """Test that distance-sorted results page through every store instead of stopping at one page"""
+        Store.objects.bulk_create([
+            Store(name=f"Bulk {i:03d}", city="Los Angeles", latitude=34.06 + i * 0.001, longitude=-118.24)
+            for i in range(STORES_PER_PAGE + 50)
+        ])
+        store_distances.refresh_all()
+        invalidate_store_index()
+        total = Store.objects.filter(latitude__isnull=False).count()
+        
+        searches = {
+            'school': {'school_id': self.school.id},
+            'gps': {'user_lat': '34.0522', 'user_lon': '-118.2437'},
+            'text': {'school_id': self.school.id, 'city': 'Los Angeles'},
+        }
+        for label, params in searches.items():
+            with self.subTest(label):
+                first = self.client.get(reverse('store_list'), params)
+                self.assertEqual(len(first.context['stores']), STORES_PER_PAGE)
+                self.assertEqual(first.context['next_page'], 2)
+                self.assertContains(first, "page=2")
+                second = self.client.get(reverse('store_list'), {**params, 'page': 2})
+                self.assertIsNone(second.context['next_page'])
+                self.assertEqual(second.context['previous_page'], 1)
+                stores = [entry['store'] for entry in first.context['stores'] + second.context['stores']]
+                expected = total if label != 'text' else total - 1  # Store 2 is in San Francisco
+                self.assertEqual(len(set(stores)), expected)
+                distances = [entry['distance'] for entry in first.context['stores'] + second.context['stores']]
+                self.assertEqual(distances, sorted(distances))
 
 
 class ConfigureUploadedListViewTests(TestCase):
@@ -0,0 +1,394 @@
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.utils import timezone
+from rest_framework.test import APIClient
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+import csv
+import os
+import tempfile
+from unittest import mock
+
+from .models import PackingList, Item, PackingListItem, Price, Store, RolledUpVote, Vote, VoteDailyRollup
+from . import ranking, votes
+from .ranking import day_weight
+from .votes import PendingVote, VoteBuffer, record_votes
+
+
+class VoteIngestionTestCase(TestCase):
+    """Shared fixtures for the vote ingestion tests"""
+
+    def setUp(self):
+        self.packing_list = PackingList.objects.create(name="Voting List")
+        self.item = Item.objects.create(name="Canteen")
+        PackingListItem.objects.create(packing_list=self.packing_list, item=self.item)
+        store = Store.objects.create(name="Store")
+        self.prices = [
+            Price.objects.create(item=self.item, store=store, price=Decimal(amount))
+            for amount in ("8.00", "9.00")
+        ]
+
+    def counters(self, price):
+        price.refresh_from_db()
+        return price.upvotes, price.downvotes
+
+
+class RecordVotesTests(VoteIngestionTestCase):
+    """Test bulk vote writes"""
+
+    def pending(self, price_id, up, ip="10.0.0.1"):
+        return PendingVote(price_id, up, ip, timezone.now())
+
+    def test_counters_and_rows(self):
+        """Test that bulk writes create rows and adjust counters per price"""
+        first, second = self.prices
+        created = record_votes([
+            self.pending(first.id, True),
+            self.pending(first.id, True, "10.0.0.2"),
+            self.pending(first.id, False, "10.0.0.3"),
+            self.pending(second.id, False),
+        ])
+        self.assertEqual(len(created), 4)
+        self.assertEqual(Vote.objects.count(), 4)
+        self.assertEqual(self.counters(first), (2, 1))
+        self.assertEqual(self.counters(second), (0, 1))
+
+    def test_unknown_prices_are_dropped(self):
+        """Test that votes for missing prices are skipped, not fatal"""
+        created = record_votes([self.pending(self.prices[0].id, True), self.pending(99999, True)])
+        self.assertEqual(len(created), 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_bumps_list_version(self):
+        """Test that a flush invalidates cached list details"""
+        before = PackingList.objects.get(pk=self.packing_list.pk).version
+        record_votes([self.pending(self.prices[0].id, True), self.pending(self.prices[1].id, True)])
+        self.assertEqual(PackingList.objects.get(pk=self.packing_list.pk).version, before + 1)
+
+
+class VoteBufferTests(VoteIngestionTestCase):
+    """Test the write-behind vote buffer"""
+
+    def test_add_does_not_query(self):
+        """Test that buffering a vote touches no database"""
+        buffer = VoteBuffer(max_size=10, max_age=None)
+        with self.assertNumQueries(0):
+            buffer.add(self.prices[0].id, True, "10.0.0.1")
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(Vote.objects.count(), 0)
+
+    def test_flush_on_size(self):
+        """Test that reaching max_size writes the whole batch"""
+        buffer = VoteBuffer(max_size=3, max_age=None)
+        for i in range(3):
+            buffer.add(self.prices[0].id, True, f"10.0.0.{i}")
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.counters(self.prices[0]), (3, 0))
+
+    def test_explicit_flush(self):
+        """Test that flush() drains pending votes"""
+        buffer = VoteBuffer(max_size=100, max_age=None)
+        buffer.add(self.prices[1].id, False, "10.0.0.1")
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(self.counters(self.prices[1]), (0, 1))
+
+    def test_failed_flush_keeps_votes(self):
+        """Test that a failing write leaves the batch pending for a retry"""
+        buffer = VoteBuffer(max_size=100, max_age=None)
+        buffer.add(self.prices[0].id, True, "10.0.0.1")
+        with mock.patch.object(votes, 'record_votes', side_effect=RuntimeError), self.assertLogs('packing_lists.votes'):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_bad_vote_does_not_block_the_batch(self):
+        """Test that a vote that always fails is retried alone, then dropped"""
+        buffer = VoteBuffer(max_size=100, max_age=None, max_attempts=2)
+        real_record_votes = votes.record_votes
+
+        def poisoned(pending):
+            if any(vote.ip_address == "10.0.0.66" for vote in pending):
+                raise RuntimeError("bad vote")
+            return real_record_votes(pending)
+
+        for ip in ("10.0.0.1", "10.0.0.66", "10.0.0.2"):
+            buffer.add(self.prices[0].id, True, ip)
+        with mock.patch.object(votes, 'record_votes', side_effect=poisoned), self.assertLogs('packing_lists.votes') as logs:
+            self.assertEqual(buffer.flush(), 2)
+            self.assertEqual(len(buffer), 1)
+            buffer.add(self.prices[1].id, False, "10.0.0.3")
+            self.assertEqual(buffer.flush(), 1)
+        self.assertIn("Dropping buffered vote", logs.output[-1])
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.counters(self.prices[0]), (2, 0))
+        self.assertEqual(self.counters(self.prices[1]), (0, 1))
+
+    def test_malformed_ip_is_rejected(self):
+        """Test that add() refuses IPs the database would reject at flush time"""
+        buffer = VoteBuffer(max_size=100, max_age=None)
+        with self.assertRaises(ValueError):
+            buffer.add(self.prices[0].id, True, "not-an-ip, 10.0.0.1")
+        self.assertEqual(len(buffer), 0)
+
+    @override_settings(VOTE_BUFFER={'ENABLED': True, 'MAX_SIZE': 100, 'MAX_AGE': 0})
+    def test_api_accepts_buffered_vote(self):
+        """Test that the vote API answers 202 while buffering"""
+        buffer = VoteBuffer(max_size=100, max_age=None)
+        with mock.patch.object(votes, '_buffer', buffer):
+            response = APIClient().post('/api/votes/', {'price_id': self.prices[0].id, 'upvote_price_id': 1})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(Vote.objects.count(), 0)
+            buffer.flush()
+        self.assertEqual(self.counters(self.prices[0]), (1, 0))
+
+    def test_buffer_disabled_by_default(self):
+        """Test that votes are written synchronously unless buffering is enabled"""
+        response = APIClient().post('/api/votes/', {'price_id': self.prices[0].id, 'upvote_price_id': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+class VoteUpsertTests(VoteIngestionTestCase):
+    """Test one-vote-per-IP deduplication"""
+
+    def test_prices_locked_before_reading_votes(self):
+        """Test that concurrent first votes from one IP queue on the price row"""
+        locked = []
+        real = QuerySet.select_for_update
+
+        def recording(queryset, *args, **kwargs):
+            locked.append(queryset.model)
+            return real(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', recording):
+            record_votes([PendingVote(self.prices[0].id, True, "10.0.0.1", timezone.now())])
+        self.assertEqual(locked, [Price])
+
+    def test_revote_flips_existing_vote(self):
+        """Test that voting again from the same IP replaces the vote"""
+        price = self.prices[0]
+        first = votes.submit_vote(price.id, True, "10.0.0.1")
+        self.assertEqual(self.counters(price), (1, 0))
+        second = votes.submit_vote(price.id, False, "10.0.0.1")
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(self.counters(price), (0, 1))
+
+    def test_flip_moves_decayed_weight(self):
+        """Test that a flipped vote takes its old weight back"""
+        price = self.prices[0]
+        votes.submit_vote(price.id, True, "10.0.0.1")
+        votes.submit_vote(price.id, False, "10.0.0.1")
+        price.refresh_from_db()
+        self.assertAlmostEqual(price.decayed_upvotes, 0.0)
+        self.assertGreater(price.decayed_downvotes, 0.0)
+
+    def test_repeat_vote_is_idempotent(self):
+        """Test that repeating the same vote changes nothing"""
+        price = self.prices[0]
+        for _ in range(3):
+            votes.submit_vote(price.id, True, "10.0.0.1")
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(self.counters(price), (1, 0))
+
+    def test_batch_keeps_latest_vote_per_ip(self):
+        """Test that a batch with repeats from one IP writes only the last vote"""
+        price = self.prices[0]
+        now = timezone.now()
+        record_votes([
+            PendingVote(price.id, True, "10.0.0.1", now),
+            PendingVote(price.id, False, "10.0.0.1", now),
+            PendingVote(price.id, True, "10.0.0.2", now),
+        ])
+        self.assertEqual(Vote.objects.count(), 2)
+        self.assertEqual(self.counters(price), (1, 1))
+
+    def test_votes_without_ip_are_not_merged(self):
+        """Test that anonymous votes without an address still add up"""
+        price = self.prices[0]
+        votes.submit_vote(price.id, True, None)
+        votes.submit_vote(price.id, True, None)
+        self.assertEqual(self.counters(price), (2, 0))
+
+    def test_views_flip_votes(self):
+        """Test that the HTML and API vote endpoints share the upsert"""
+        price = self.prices[1]
+        self.client.post('/vote/', {'upvote_price_id': price.id}, REMOTE_ADDR="10.0.0.9")
+        response = APIClient().post('/api/votes/', {'price_id': price.id, 'downvote_price_id': price.id}, REMOTE_ADDR="10.0.0.9")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['is_correct_price'], False)
+        self.assertEqual(Vote.objects.filter(price=price).count(), 1)
+        self.assertEqual(self.counters(price), (0, 1))
+
+
+class RollupVotesTests(VoteIngestionTestCase):
+    """Test the rollup_votes archival command"""
+
+    def setUp(self):
+        super().setUp()
+        self.old = timezone.now() - timedelta(days=200)
+        price = self.prices[0]
+        record_votes(
+            [PendingVote(price.id, True, f"10.0.0.{i}", self.old) for i in range(3)]
+            + [PendingVote(price.id, False, "10.0.1.1", self.old)]
+            + [PendingVote(price.id, True, "10.0.2.1", timezone.now())]
+        )
+
+    def rollup(self, *args):
+        call_command('rollup_votes', '--days', '90', '--batch-size', '2', *args, stdout=StringIO())
+
+    def test_old_votes_are_folded_and_deleted(self):
+        """Test that old raw votes become one daily rollup and counters are untouched"""
+        self.rollup()
+        price = self.prices[0]
+        self.assertEqual(Vote.objects.filter(price=price).count(), 1)
+        rollup = VoteDailyRollup.objects.get(price=price)
+        self.assertEqual((rollup.day, rollup.upvotes, rollup.downvotes), (timezone.localdate(self.old), 3, 1))
+        self.assertEqual(self.counters(price), (4, 1))
+
+    def test_rollups_are_additive(self):
+        """Test that a later run adds onto an existing day's rollup"""
+        self.rollup()
+        record_votes([PendingVote(self.prices[0].id, True, "10.0.3.1", self.old)])
+        self.rollup()
+        rollup = VoteDailyRollup.objects.get(price=self.prices[0])
+        self.assertEqual((rollup.upvotes, rollup.downvotes), (4, 1))
+
+    def test_rolled_up_votes_still_count_once_per_ip(self):
+        """Test that voting again after a rollup flips the rolled-up vote"""
+        self.rollup()
+        price = self.prices[0]
+        self.assertEqual(RolledUpVote.objects.filter(price=price).count(), 4)
+        record_votes([
+            PendingVote(price.id, True, "10.0.0.1", timezone.now()),
+            PendingVote(price.id, True, "10.0.1.1", timezone.now()),
+        ])
+        self.assertEqual(self.counters(price), (5, 0))
+        rollup = VoteDailyRollup.objects.get(price=price)
+        self.assertEqual((rollup.upvotes, rollup.downvotes), (2, 0))
+        self.assertFalse(RolledUpVote.objects.filter(ip_address__in=["10.0.0.1", "10.0.1.1"]).exists())
+        out = StringIO()
+        call_command('reconcile_vote_counts', stdout=out)
+        self.assertIn('0 fixed', out.getvalue())
+
+    def test_emptied_rollup_is_deleted(self):
+        """Test that taking back a day's last rolled-up vote drops the rollup"""
+        self.rollup()
+        price = self.prices[0]
+        record_votes(
+            [PendingVote(price.id, True, f"10.0.0.{i}", timezone.now()) for i in range(3)]
+            + [PendingVote(price.id, True, "10.0.1.1", timezone.now())]
+        )
+        self.assertFalse(VoteDailyRollup.objects.filter(price=price).exists())
+        self.assertFalse(RolledUpVote.objects.exists())
+        self.assertEqual(self.counters(price), (5, 0))
+
+    def test_reconcile_counts_rollups(self):
+        """Test that reconcile_vote_counts sees rolled-up votes"""
+        self.rollup()
+        out = StringIO()
+        call_command('reconcile_vote_counts', stdout=out)
+        self.assertIn('0 fixed', out.getvalue())
+        self.assertEqual(self.counters(self.prices[0]), (4, 1))
+
+    def test_folded_votes_are_weighted_by_day(self):
+        """Test that folding moves each vote's decayed weight to its day's start"""
+        self.rollup()
+        price = self.prices[0]
+        price.refresh_from_db()
+        weight = day_weight(timezone.localdate(self.old))
+        fresh = ranking.vote_weight(Vote.objects.get(price=price).created_at)
+        self.assertAlmostEqual(price.decayed_upvotes / (3 * weight + fresh), 1.0)
+        self.assertAlmostEqual(price.decayed_downvotes / weight, 1.0)
+
+    def test_reconcile_reweights_rollups_after_half_life_change(self):
+        """Test that rolled-up votes take the new half-life, from their day"""
+        self.rollup()
+        with override_settings(PRICE_RANKING={'VOTE_HALF_LIFE_DAYS': 30}):
+            call_command('reconcile_vote_counts', stdout=StringIO())
+            weight = day_weight(timezone.localdate(self.old))
+            fresh = ranking.vote_weight(Vote.objects.get(price=self.prices[0]).created_at)
+            factor = ranking.decay_factor()
+        price = Price.objects.get(pk=self.prices[0].pk)
+        self.assertAlmostEqual(price.decayed_downvotes / weight, 1.0)
+        self.assertAlmostEqual(price.decayed_upvotes / (3 * weight + fresh), 1.0)
+        self.assertLess(price.decayed_downvotes * factor, 0.02)  # ~200 days is over six half-lives
+        rollup = VoteDailyRollup.objects.get(price=price)
+        self.assertAlmostEqual(rollup.decayed_downvotes / weight, 1.0)
+
+    def test_rolled_up_ips_expire(self):
+        """Test that --keep-ip-days forgets old voters, whose next vote then counts as new"""
+        self.rollup('--keep-ip-days', '300')
+        self.assertEqual(RolledUpVote.objects.count(), 4)
+        out = StringIO()
+        call_command('rollup_votes', '--keep-ip-days', '100', '--batch-size', '3', stdout=out)
+        self.assertIn("4 rolled-up vote IPs", out.getvalue())
+        self.assertFalse(RolledUpVote.objects.exists())
+
+        price = self.prices[0]
+        record_votes([PendingVote(price.id, False, "10.0.0.1", timezone.now())])
+        self.assertEqual(self.counters(price), (4, 2))
+        rollup = VoteDailyRollup.objects.get(price=price)
+        self.assertEqual((rollup.upvotes, rollup.downvotes), (3, 1))
+
+    def test_dry_run_and_archive(self):
+        """Test that --dry-run keeps rows and --archive writes them out"""
+        self.rollup('--dry-run')
+        self.assertEqual(Vote.objects.count(), 5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'votes.csv')
+            self.rollup('--archive', path)
+            with open(path, newline='') as archive:
+                self.assertEqual(len(list(csv.reader(archive))), 4)
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+class BatchVoteAPITests(VoteIngestionTestCase):
+    """Test POST /api/votes/batch/"""
+
+    url = '/api/votes/batch/'
+
+    def test_batch_records_votes_and_returns_aggregates(self):
+        """Test that a batch is written at once and reports per-price totals"""
+        first, second = self.prices
+        payload = [
+            {'price_id': first.id, 'is_upvote': True},
+            {'price_id': second.id, 'is_upvote': False},
+            {'price_id': second.id, 'is_upvote': True},  # Same IP: the last vote wins
+        ]
+        with self.assertNumQueries(9):
+            response = APIClient().post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['recorded'], 3)
+        aggregates = {row['price_id']: row for row in response.data['prices']}
+        self.assertEqual((aggregates[first.id]['upvotes'], aggregates[first.id]['downvotes']), (1, 0))
+        self.assertEqual((aggregates[second.id]['upvotes'], aggregates[second.id]['downvotes']), (1, 0))
+        self.assertAlmostEqual(aggregates[first.id]['vote_confidence'], 1.0, places=6)
+        self.assertEqual(Vote.objects.count(), 2)
+
+    def test_wrapped_payload(self):
+        """Test that {"votes": [...]} is accepted too"""
+        response = APIClient().post(self.url, {'votes': [{'price_id': self.prices[0].id, 'is_upvote': False}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(self.prices[0]), (0, 1))
+
+    def test_unknown_price_rejects_whole_batch(self):
+        """Test that one unknown price id writes nothing"""
+        payload = [{'price_id': self.prices[0].id, 'is_upvote': True}, {'price_id': 99999, 'is_upvote': True}]
+        response = APIClient().post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['unknown_price_ids'], [99999])
+        self.assertEqual(Vote.objects.count(), 0)
+        self.assertEqual(self.counters(self.prices[0]), (0, 0))
+
+    def test_invalid_payloads(self):
+        """Test that malformed, empty and oversized batches are rejected"""
+        client = APIClient()
+        self.assertEqual(client.post(self.url, [], format='json').status_code, 400)
+        self.assertEqual(client.post(self.url, [{'price_id': 'x', 'is_upvote': True}], format='json').status_code, 400)
+        self.assertEqual(client.post(self.url, {'price_id': 1}, format='json').status_code, 400)
+        oversized = [{'price_id': self.prices[0].id, 'is_upvote': True}] * 201
+        self.assertEqual(client.post(self.url, oversized, format='json').status_code, 400)
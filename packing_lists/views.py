@@ -2,9 +2,16 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.contrib import messages # For feedback to the user
 from django.db import IntegrityError
-from .models import PackingList, Item, PackingListItem, School, Price, Vote, Store
+from .models import PackingList, Item, PackingListItem, School, Price, Store
 from .forms import PackingListForm, UploadFileForm, PriceForm, VoteForm, ConfigureUploadListForm, PackingListItemForm, StoreForm
-from .parsers import parse_csv, parse_excel, parse_pdf, parse_text
+from .parsers import parse_text, parser_for
+from .parse_cache import parse_upload
+from .pricing import ranked_prices_by_item, cached_items_with_prices
+from .votes import submit_vote
+from .ratelimit import client_ident, rate_limit
+from .geo import stores_within
+from .spatial_index import nearest_store_objects
+from . import store_distances
 import io
 import uuid # For unique session keys
 from django.http import Http404, JsonResponse
@@ -65,15 +72,11 @@ def upload_packing_list(request):
 
             if file:
                 original_filename = file.name
-                filename_lower = original_filename.lower()
+                parser = parser_for(original_filename)
                 try:
-                    if filename_lower.endswith('.csv'):
-                        file_content_string = file.read().decode('utf-8')
-                        parsed_items, error_message = parse_csv(file_content_string)
-                    elif filename_lower.endswith(('.xls', '.xlsx')):
-                        parsed_items, error_message = parse_excel(file)
-                    elif filename_lower.endswith('.pdf'):
-                        parsed_items, error_message = parse_pdf(file)
+                    if parser is not None:
+                        # Repeat uploads of the same file come from the parse cache
+                        parsed_items, error_message = parse_upload(request, file, parser)
                 except Exception as e:
                     error_message = f"Error processing file: {str(e)}"
             elif text_content:
@@ -141,53 +144,21 @@ def packing_list_detail(request, list_id):
             return redirect(reverse('view_packing_list', args=[list_id]))
 
     # Prepare items with their prices for the template
-    # For each PackingListItem, we want to find prices for its Item.
-    items_with_prices = []
-    for pli in list_items:
-        # Fetch all prices for the item
-        prices = pli.item.prices.select_related('store').all()
-        
-        # Calculate vote counts and smart score for each price
-        prices_with_votes = []
-        for price in prices:
-            upvotes = price.votes.filter(is_correct_price=True).count()
-            downvotes = price.votes.filter(is_correct_price=False).count()
-            
-            # Calculate vote confidence (net votes / total votes)
-            total_votes = upvotes + downvotes
-            vote_confidence = (upvotes - downvotes) / max(total_votes, 1)  # Avoid division by zero
-            
-            # Calculate price per unit
-            price_per_unit = float(price.price) / max(price.quantity, 1)
-            
-            # Smart scoring algorithm:
-            # - Lower price gets higher score (inverted)
-            # - Higher vote confidence gets higher score
-            # - Balance: 70% price, 30% vote confidence
-            # - Use a base price for normalization (median price or $50 default)
-            base_price = 50.0  # Default normalization price
-            price_score = 1.0 - (price_per_unit / base_price)  # Lower price = higher score
-            vote_score = (vote_confidence + 1) / 2  # Convert from [-1,1] to [0,1]
-            
-            smart_score = (0.7 * price_score) + (0.3 * vote_score)
-            
-            prices_with_votes.append({
-                'price': price,
-                'upvotes': upvotes,
-                'downvotes': downvotes,
-                'vote_confidence': vote_confidence,
-                'price_per_unit': price_per_unit,
-                'smart_score': smart_score
-            })
-        
-        # Sort prices by smart score (highest first = best value)
-        prices_with_votes.sort(key=lambda x: x['smart_score'], reverse=True)
-        
-        items_with_prices.append({
-            'pli': pli, # The PackingListItem object (contains quantity, notes, packed status)
-            'item': pli.item, # The Item object (name, description)
-            'prices_with_votes': prices_with_votes # List of price dicts with vote counts, sorted by smart score
-        })
+    # All prices for the whole list come from one query and are ranked together
+    # (best value first, see packing_lists.ranking). The result is cached per
+    # list version, so unchanged lists skip all of this.
+    def build_items_with_prices():
+        ranked_prices = ranked_prices_by_item(packing_list)
+        return [
+            {
+                'pli': pli, # The PackingListItem object (contains quantity, notes, packed status)
+                'item': pli.item, # The Item object (name, description)
+                'prices_with_votes': ranked_prices.get(pli.item_id, []) # List of price dicts with vote counts, sorted by smart score
+            }
+            for pli in list_items
+        ]
+
+    items_with_prices = cached_items_with_prices(packing_list, 'html', build_items_with_prices)
 
     context = {
         'packing_list': packing_list,
@@ -197,6 +168,7 @@ def packing_list_detail(request, list_id):
     return render(request, 'packing_lists/packing_list_detail.html', context)
 
 # @login_required (if user accounts are implemented)
+@rate_limit('prices')
 def add_price_for_item(request, item_id, list_id=None): # list_id is for redirecting back
     item = get_object_or_404(Item, id=item_id)
 
@@ -244,6 +216,7 @@ def add_price_for_item(request, item_id, list_id=None): # list_id is for redirec
 
 
 # @login_required (if user accounts are implemented)
+@rate_limit('votes')
 def handle_vote(request):
     if request.method == 'POST':
         # Determine if it's an upvote or downvote based on the button name/value
@@ -272,18 +245,21 @@ def handle_vote(request):
             price_id = form.cleaned_data.get('price_id')
             is_correct = form.cleaned_data.get('is_correct_price')
 
+            ip_address = client_ident(request)
             try:
-                price_instance = Price.objects.get(id=price_id)
+                vote = submit_vote(price_id, is_correct, ip_address)
             except Price.DoesNotExist:
                 messages.error(request, "Price not found.")
                 return redirect(request.META.get('HTTP_REFERER', reverse('home')))
+            except ValueError:  # Malformed client address
+                messages.error(request, "Your vote could not be recorded.")
+                return redirect(request.META.get('HTTP_REFERER', reverse('home')))
 
-            ip_address = request.META.get('REMOTE_ADDR')
-            Vote.objects.create(
-                price=price_instance,
-                is_correct_price=is_correct,
-                ip_address=ip_address
-            )
+            if vote is None:
+                # Buffered; the price is checked when the buffer flushes
+                messages.success(request, "Thanks, your vote has been recorded.")
+                return redirect(request.META.get('HTTP_REFERER', reverse('home')))
+            price_instance = vote.price
             if is_correct:
                 messages.success(request, f"Upvoted price for '{price_instance.item.name}' (from IP: {ip_address}).")
             else:
@@ -378,25 +354,31 @@ def configure_uploaded_list(request, session_key_items):
     return render(request, 'packing_lists/configure_upload_form.html', context)
 
 
-from django.db.models import Q
-import math
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Radius of Earth in kilometers. Use 3959 for miles.
-
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+# Distance-sorted store searches show this many stores per page
+STORES_PER_PAGE = 200
 
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
-
-    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-    distance = R * c
-    return distance
+def _nearby_page(stores_qs, lat, lon, radius_km, page, text_filtered, school):
+    """
+    Stores on `page` (from 1) of the stores nearest (lat, lon), nearest
+    first, and whether another page follows. Without text filters the first
+    page comes from the school's precomputed list or the spatial index;
+    other pages are sliced from stores_within() in SQL.
+    """
+    if page == 1 and not text_filtered:
+        if school is not None:
+            nearby = store_distances.stores_near(school, radius_km=radius_km)
+            if len(nearby) < store_distances.NEAREST_STORES_PER_LOCATION:
+                # A list that isn't full holds every store within the radius
+                return nearby[:STORES_PER_PAGE], len(nearby) > STORES_PER_PAGE
+            if len(nearby) >= STORES_PER_PAGE:
+                more = stores_within(stores_qs, lat, lon, radius_km=radius_km)[STORES_PER_PAGE:].exists()
+                return nearby[:STORES_PER_PAGE], more
+        else:
+            nearby = nearest_store_objects(lat, lon, k=STORES_PER_PAGE + 1, radius_km=radius_km)
+            return nearby[:STORES_PER_PAGE], len(nearby) > STORES_PER_PAGE
+    offset = (page - 1) * STORES_PER_PAGE
+    nearby = list(stores_within(stores_qs, lat, lon, radius_km=radius_km)[offset:offset + STORES_PER_PAGE + 1])
+    return nearby[:STORES_PER_PAGE], len(nearby) > STORES_PER_PAGE
 
 def store_list(request):
     """
@@ -404,6 +386,12 @@ def store_list(request):
     - By city, state, zip (text input)
     - By proximity to a selected School/Base
     - By proximity to user's current location (GPS)
+    - Within `radius` km of that location (narrowed by an indexed bounding box)
+    Distance-sorted results are paged, STORES_PER_PAGE at a time (?page=N).
+    The first page near a school is read from the precomputed
+    LocationStoreDistance table, near a GPS position from the in-process
+    spatial index; combined with text filters, and for later pages,
+    distances, ordering and paging run in SQL.
     """
     stores_qs = Store.objects.all().order_by('name')
     schools = School.objects.filter(latitude__isnull=False, longitude__isnull=False).order_by('name')
@@ -415,6 +403,11 @@ def store_list(request):
     selected_school_id = request.GET.get('school_id', '').strip()
     user_lat = request.GET.get('user_lat', '').strip()
     user_lon = request.GET.get('user_lon', '').strip()
+    radius_param = request.GET.get('radius', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', '1')))
+    except ValueError:
+        page = 1
 
     # Apply text filters
     if city_filter:
@@ -430,6 +423,7 @@ def store_list(request):
     sort_by_distance = False
 
     target_lat, target_lon = None, None
+    selected_school = None
     filter_description = "All Stores"
 
     if selected_school_id:
@@ -448,16 +442,28 @@ def store_list(request):
         except ValueError:
             messages.warning(request, "Invalid GPS coordinates provided.")
 
+    radius_km = None
+    if radius_param:
+        try:
+            radius_km = float(radius_param)
+            if not radius_km > 0:
+                raise ValueError
+        except ValueError:
+            radius_km = None
+            messages.warning(request, "Invalid search radius provided.")
+
+    previous_page = next_page = None
     if sort_by_distance and target_lat is not None and target_lon is not None:
-        temp_stores_with_distance = []
-        for store in stores_qs.filter(latitude__isnull=False, longitude__isnull=False):
-            distance = haversine(target_lat, target_lon, store.latitude, store.longitude)
-            temp_stores_with_distance.append({'store': store, 'distance': distance})
-
-        # Sort by distance
-        temp_stores_with_distance.sort(key=lambda x: x['distance'])
-        # stores_qs is now a list of dicts, not a queryset
-        stores_to_display = temp_stores_with_distance
+        # Text filters can't be applied to the precomputed lists or the spatial index; SQL does both
+        text_filtered = bool(city_filter or state_filter or zip_filter)
+        nearby, more = _nearby_page(
+            stores_qs, target_lat, target_lon, radius_km, page, text_filtered, selected_school
+        )
+        previous_page = page - 1 if page > 1 else None
+        next_page = page + 1 if more else None
+        if radius_km is not None:
+            filter_description += f" (within {radius_km:g} km)"
+        stores_to_display = [{'store': store, 'distance': store.distance} for store in nearby]
     else:
         # If not sorting by distance, stores_qs remains a queryset
         # To keep a consistent structure for the template, wrap in the same dict structure
@@ -468,6 +474,11 @@ def store_list(request):
         'stores': stores_to_display,
         'schools': schools,
         'filter_description': filter_description,
+        'page': page,
+        'previous_page': previous_page,
+        'next_page': next_page,
+        'first_index': (page - 1) * STORES_PER_PAGE + 1,
+        'last_index': (page - 1) * STORES_PER_PAGE + len(stores_to_display),
         'current_filters': { # For repopulating form
             'city': city_filter,
             'state': state_filter,
@@ -475,6 +486,7 @@ def store_list(request):
             'school_id': selected_school_id,
             'user_lat': user_lat,
             'user_lon': user_lon,
+            'radius': radius_param,
         },
         'title': 'Find Stores'
     }
@@ -536,6 +548,7 @@ def edit_item_in_list(request, list_id, pli_id):
     }
     return render(request, 'packing_lists/packing_listitem_form.html', context)
 
+@rate_limit('stores')
 def store_edit(request, store_id):
     store = get_object_or_404(Store, id=store_id)
     if request.method == 'POST':
@@ -548,6 +561,7 @@ def store_edit(request, store_id):
         form = StoreForm(instance=store)
     return render(request, 'packing_lists/store_form.html', {'form': form, 'store': store, 'title': f"Edit Store: {store.name}"})
 
+@rate_limit('prices')
 def price_form_partial(request, item_id, list_id=None):
     item = get_object_or_404(Item, id=item_id)
     if request.method == 'POST' and request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -582,6 +596,7 @@ def price_form_partial(request, item_id, list_id=None):
             return JsonResponse({'html': html})
         return render(request, 'packing_lists/price_form.html', context)
 
+@rate_limit('stores')
 def add_store_modal(request):
     if request.method == 'POST' and request.headers.get('x-requested-with') == 'XMLHttpRequest':
         form = StoreForm(request.POST)
@@ -0,0 +1,356 @@
+"""
+Vote ingestion shared by the HTML vote form and the API.
+
+record_votes() writes any number of votes with one price lookup, one
+lookup of the voters' previous votes, one bulk upsert and one counter UPDATE
+per distinct delta, all in a single transaction. Each IP holds at most one
+vote per price (see the Vote unique constraint); voting again flips it,
+also when the earlier vote has since been rolled up (see RolledUpVote).
+
+When settings.VOTE_BUFFER['ENABLED'] is set, submit_vote() does not touch
+the database at all: votes are collected in an in-process VoteBuffer and
+written through record_votes() once MAX_SIZE votes are pending or the oldest
+one is MAX_AGE seconds old. Pending votes are flushed on clean interpreter
+shutdown; a crashed worker loses at most one buffer's worth of votes. When a
+batch fails to write, its votes are retried one by one, so a single bad vote
+can't hold the rest back; a vote that still fails MAX_ATTEMPTS flushes in a
+row is dropped and logged.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_ipv46_address
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Price, RolledUpVote, Vote, VoteDailyRollup
+from . import ranking
+from .ranking import day_weight, vote_weight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VOTE_BUFFER = {
+    'ENABLED': False,
+    'MAX_SIZE': 200,
+    'MAX_AGE': 2.0,
+    'MAX_ATTEMPTS': 3,
+}
+
+PendingVote = namedtuple('PendingVote', 'price_id is_correct_price ip_address created_at')
+
+
+def vote_buffer_settings():
+    return {**DEFAULT_VOTE_BUFFER, **getattr(settings, 'VOTE_BUFFER', {})}
+
+
+class UnknownPricesError(Price.DoesNotExist):
+    """Raised by record_votes(strict=True) when some voted prices don't exist"""
+
+    def __init__(self, price_ids):
+        self.price_ids = sorted(price_ids)
+        super().__init__(f"Unknown price ids: {self.price_ids}")
+
+
+def record_votes(votes, strict=False):
+    """
+    Writes PendingVotes in one transaction and keeps the Price vote counters
+    in step. A vote from an IP that already voted on the price replaces that
+    vote (INSERT ... ON CONFLICT (price, ip) DO UPDATE) instead of adding a
+    row, and a rolled-up earlier vote is taken back out of its daily rollup;
+    within the batch the latest vote per (price, IP) wins. Votes for
+    prices that no longer exist are dropped, or with `strict` the whole batch
+    is rejected with UnknownPricesError. Returns the written Vote objects.
+    """
+    votes = list(votes)
+    if not votes:
+        return []
+    with transaction.atomic():
+        # Lock the prices (in pk order, so batches can't deadlock) before
+        # reading earlier votes: locking only existing Vote rows would let two
+        # concurrent first votes from one IP both count, though the upsert
+        # leaves a single row
+        existing = set(
+            Price.objects.select_for_update().filter(pk__in={v.price_id for v in votes})
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        if strict and len(existing) < len({v.price_id for v in votes}):
+            raise UnknownPricesError({v.price_id for v in votes} - existing)
+        latest = {}
+        for index, vote in enumerate(votes):
+            if vote.price_id in existing:
+                # Votes without an IP are never merged
+                key = (vote.price_id, vote.ip_address) if vote.ip_address else index
+                latest[key] = vote
+        votes_by_pair = [v for v in latest.values() if v.ip_address]
+
+        # What each (price, IP) pair currently counts, so flips move the counters
+        previous, rolled = {}, {}
+        if votes_by_pair:
+            previous = {
+                (price_id, ip): (is_correct, created_at)
+                for price_id, ip, is_correct, created_at in Vote.objects.filter(
+                    price_id__in={v.price_id for v in votes_by_pair},
+                    ip_address__in={v.ip_address for v in votes_by_pair},
+                ).values_list('price_id', 'ip_address', 'is_correct_price', 'created_at')
+            }
+
+            # An earlier vote may also have been rolled up (see rollup_votes)
+            rolled = {
+                (price_id, ip): (pk, is_correct, day)
+                for pk, price_id, ip, is_correct, day in RolledUpVote.objects.filter(
+                    price_id__in={v.price_id for v in votes_by_pair},
+                    ip_address__in={v.ip_address for v in votes_by_pair},
+                ).values_list('pk', 'price_id', 'ip_address', 'is_correct_price', 'day')
+                if (price_id, ip) in latest and (price_id, ip) not in previous
+            }
+
+        # (upvotes, downvotes, decayed upvotes, decayed downvotes) per price.
+        # A replaced vote is taken back with its old weight; repeating the
+        # same vote keeps the counts but refreshes its weight.
+        deltas = defaultdict(lambda: [0, 0, 0.0, 0.0])
+        for vote in latest.values():
+            pair = (vote.price_id, vote.ip_address)
+            if pair in previous:
+                is_correct, created_at = previous[pair]
+                side = 0 if is_correct else 1
+                deltas[vote.price_id][side] -= 1
+                deltas[vote.price_id][side + 2] -= vote_weight(created_at)
+            elif pair in rolled:
+                _, is_correct, day = rolled[pair]
+                side = 0 if is_correct else 1
+                deltas[vote.price_id][side] -= 1
+                deltas[vote.price_id][side + 2] -= day_weight(day)
+            side = 0 if vote.is_correct_price else 1
+            deltas[vote.price_id][side] += 1
+            deltas[vote.price_id][side + 2] += vote_weight(vote.created_at)
+
+        # bulk_create skips Vote.save(), so the counters are adjusted here
+        written = Vote.objects.bulk_create(
+            [
+                Vote(
+                    price_id=v.price_id,
+                    is_correct_price=v.is_correct_price,
+                    ip_address=v.ip_address,
+                    created_at=v.created_at,
+                )
+                for v in latest.values()
+            ],
+            update_conflicts=True,
+            unique_fields=['price', 'ip_address'],
+            update_fields=['is_correct_price', 'created_at'],
+        )
+        if rolled:
+            _take_back_rolled_up(rolled)
+        Price.bulk_adjust_vote_counts({price_id: tuple(delta) for price_id, delta in deltas.items()})
+    dropped = sum(1 for v in votes if v.price_id not in existing)
+    if dropped:
+        logger.info("Dropped %d votes for deleted prices", dropped)
+    return written
+
+
+def _take_back_rolled_up(rolled):
+    """
+    Removes replaced rolled-up votes, {(price id, IP): (RolledUpVote pk,
+    is_correct_price, day)}, from their daily rollups; rollups left empty
+    are deleted.
+    """
+    per_rollup = defaultdict(lambda: [0, 0])
+    for (price_id, _), (_, is_correct, day) in rolled.items():
+        per_rollup[(price_id, day)][0 if is_correct else 1] += 1
+    for (price_id, day), (up, down) in per_rollup.items():
+        weight = day_weight(day)
+        VoteDailyRollup.objects.filter(price_id=price_id, day=day).update(
+            upvotes=F('upvotes') - up,
+            downvotes=F('downvotes') - down,
+            decayed_upvotes=F('decayed_upvotes') - up * weight,
+            decayed_downvotes=F('decayed_downvotes') - down * weight,
+        )
+    VoteDailyRollup.objects.filter(
+        price_id__in={price_id for price_id, _ in per_rollup}, upvotes=0, downvotes=0
+    ).delete()
+    RolledUpVote.objects.filter(pk__in=[pk for pk, _, _ in rolled.values()]).delete()
+
+
+def vote_totals_by_price():
+    """
+    Every price's (upvotes, downvotes, decayed upvotes, decayed downvotes)
+    recounted from the raw Vote rows plus the daily rollups of archived
+    votes; what Price's counters should hold. Weights are recomputed with
+    the current half-life: from each raw vote's time, and from each rollup's
+    day (see ranking.day_weight). Streams the Vote table once.
+    """
+    totals = defaultdict(lambda: [0, 0, 0.0, 0.0])
+    raw = Vote.objects.values_list('price_id', 'is_correct_price', 'created_at').order_by()
+    for price_id, is_correct, created_at in raw.iterator(chunk_size=2000):
+        side = 0 if is_correct else 1
+        totals[price_id][side] += 1
+        totals[price_id][side + 2] += vote_weight(created_at)
+    rolled = VoteDailyRollup.objects.values_list('price_id', 'day', 'upvotes', 'downvotes').order_by()
+    for price_id, day, upvotes, downvotes in rolled.iterator(chunk_size=2000):
+        weight = day_weight(day)
+        totals[price_id][0] += upvotes
+        totals[price_id][1] += downvotes
+        totals[price_id][2] += upvotes * weight
+        totals[price_id][3] += downvotes * weight
+    return {price_id: tuple(counts) for price_id, counts in totals.items()}
+
+
+def price_vote_aggregates(price_ids):
+    """
+    Current vote aggregates of the given prices, from one query:
+    [{'price_id', 'upvotes', 'downvotes', 'vote_confidence'}, ...] with the
+    same (time-decayed) confidence the rankings use.
+    """
+    rows = list(
+        Price.objects.filter(pk__in=price_ids).order_by('pk')
+        .values_list('pk', 'upvotes', 'downvotes', 'decayed_upvotes', 'decayed_downvotes')
+    )
+    if not rows:
+        return []
+    factor = ranking.decay_factor()
+    confidence = ranking.vote_confidence(
+        [row[3] * factor for row in rows], [row[4] * factor for row in rows]
+    ).tolist()
+    return [
+        {'price_id': pk, 'upvotes': up, 'downvotes': down, 'vote_confidence': conf}
+        for (pk, up, down, _, _), conf in zip(rows, confidence)
+    ]
+
+
+class VoteBuffer:
+    """
+    Thread-safe in-memory write-behind buffer for votes. add() is O(1) and
+    never queries; flush() writes everything pending through record_votes().
+    """
+
+    def __init__(self, max_size=200, max_age=2.0, max_attempts=3):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._pending = []
+        self._attempts = {}  # Failed writes so far per pending vote
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, price_id, is_correct_price, ip_address):
+        """Queues one vote; raises ValueError for a malformed IP address"""
+        if ip_address:
+            try:
+                validate_ipv46_address(ip_address)
+            except ValidationError:
+                raise ValueError(f"Invalid IP address {ip_address!r}")
+        vote = PendingVote(int(price_id), bool(is_correct_price), ip_address, timezone.now())
+        with self._lock:
+            self._pending.append(vote)
+            full = len(self._pending) >= self.max_size
+            if not full:
+                self._schedule()
+        if full:
+            self.flush()
+
+    def _schedule(self):
+        """Starts the MAX_AGE flush timer unless one is running; call with the lock held"""
+        if self._timer is None and self.max_age:
+            self._timer = threading.Timer(self.max_age, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes every pending vote it can; returns how many were written"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        started = time.monotonic()
+        try:
+            written = len(record_votes(pending))
+        except Exception:
+            logger.warning("Writing %d buffered votes failed; retrying them one by one", len(pending), exc_info=True)
+            written = self._flush_one_by_one(pending)
+        else:
+            for vote in pending:
+                self._attempts.pop(vote, None)
+        logger.debug("Flushed %d buffered votes in %.3fs", written, time.monotonic() - started)
+        return written
+
+    def _flush_one_by_one(self, pending):
+        """
+        Writes votes individually after a failed batch. Failures go back in
+        the buffer for the next flush, or are dropped after max_attempts.
+        """
+        written, retry = 0, []
+        for vote in pending:
+            try:
+                written += len(record_votes([vote]))
+            except Exception:
+                attempts = self._attempts.pop(vote, 0) + 1
+                if attempts < self.max_attempts:
+                    self._attempts[vote] = attempts
+                    retry.append(vote)
+                else:
+                    logger.error("Dropping buffered vote %s after %d failed writes", vote, attempts, exc_info=True)
+            else:
+                self._attempts.pop(vote, None)
+        if retry:
+            with self._lock:
+                self._pending[:0] = retry
+                self._schedule()
+        return written
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Buffered vote flush failed")
+        finally:
+            # Timer threads get their own connection; don't leak it
+            connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def vote_buffer():
+    """The process-wide VoteBuffer, or None when buffering is disabled"""
+    global _buffer
+    config = vote_buffer_settings()
+    if not config['ENABLED']:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = VoteBuffer(
+                max_size=config['MAX_SIZE'], max_age=config['MAX_AGE'], max_attempts=config['MAX_ATTEMPTS']
+            )
+            atexit.register(_buffer.flush)
+    return _buffer
+
+
+def submit_vote(price_id, is_correct_price, ip_address):
+    """
+    Records one vote, replacing any earlier vote from the same IP on the
+    price. Returns the written Vote, or None if the vote was buffered (the
+    price is then only validated when the buffer flushes). Raises
+    Price.DoesNotExist for an unknown price when not buffering, and
+    ValueError for a malformed IP address when buffering.
+    """
+    buffer = vote_buffer()
+    if buffer is not None:
+        buffer.add(price_id, is_correct_price, ip_address)
+        return None
+    written = record_votes([PendingVote(int(price_id), bool(is_correct_price), ip_address, timezone.now())])
+    if not written:
+        raise Price.DoesNotExist(f"Price {price_id} does not exist")
+    return written[0]